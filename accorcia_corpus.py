@@ -1,70 +1,137 @@
-import pandas as pd
-import re
-import os
-
-INPUT_FILE = 'sanders-r_corpus.csv'
-OUTPUT_FILE = 'sanders_r_corpus_CLEAN.csv'
-MESSAGE_COLUMN = 'message' 
-
-def clean_email_text_for_semantic_analysis(raw_text):
-
-    if not isinstance(raw_text, str):
-        return ""
-    
-    content = raw_text.strip()
-    
-    # Pulizia metadati e header di sistema (non rilevanti per l'analisi semantica)
-    content = re.sub(r'^\s*(Message-ID|Mime-Version|Content-Type|Content-Transfer-Encoding|X-Folder|X-Origin|X-FileName):.*$', 
-                     '', content, flags=re.MULTILINE | re.IGNORECASE)
-    
-    # Rimozione campi X- secondari (cc, bcc, etc.)
-    content = re.sub(r'^\s*X-(cc|bcc|From|To|Origin|FileName|Mailer|User-Agent|Priority|UID|Status|User|Ref|Attachment|Keywords):.*$', 
-                     '', content, flags=re.MULTILINE | re.IGNORECASE)
-    
-    # Strip dei separatori di inoltro standard Enron
-    content = re.sub(r'^\s*-+\s*Forwarded by.*$', '', content, flags=re.MULTILINE | re.IGNORECASE)
-    
-    # Rimozione info di contatto e firme (URL, numeri di telefono)
-    content = re.sub(r'^\s*Office:\s*\(?\d+\)?.*$', '', content, flags=re.MULTILINE) 
-    content = re.sub(r'^\s*www\..*$', '', content, flags=re.MULTILINE) 
-    
-    # Rimozione separatori grafici (es. stringhe con << >>)
-    content = re.sub(r'^[<]+.*[>]+$', '', content, flags=re.MULTILINE) 
-    
-    # Normalizzazione newline ed eccessi di spazi bianchi
-    content = re.sub(r'\n{3,}', '\n\n', content).strip()
-    
-    return content
-
-if __name__ == "__main__":
-    print(f"Esecuzione script di cleaning su: {INPUT_FILE}")
-    
-    try:
-        df = pd.read_csv(INPUT_FILE)
-        
-        if MESSAGE_COLUMN not in df.columns:
-            print(f"Colonna '{MESSAGE_COLUMN}' mancante. Campi rilevati: {df.columns.tolist()}")
-            exit()
-            
-        print(f"Processando {len(df)} entry...")
-        
-        # Applico la pulizia e genero il dataset finale
-        df['cleaned_message'] = df[MESSAGE_COLUMN].apply(clean_email_text_for_semantic_analysis)
-        
-        # Export dei soli campi necessari per la tesi
-        output_df = df[['file', 'cleaned_message']] 
-        output_df.to_csv(OUTPUT_FILE, index=False)
-        
-        print(f"Completato. Dataset salvato in: {OUTPUT_FILE}")
-        
-        # Verifica rapida dell'output
-        print("\nLog - Primo record processato:")
-        print("-" * 40)
-        print(output_df['cleaned_message'].iloc[0][:300] + "...")
-        print("-" * 40)
-
-    except FileNotFoundError:
-        print(f"Errore: File {INPUT_FILE} non trovato.")
-    except Exception as e:
-
-        print(f"Errore durante l'esecuzione: {e}")
+import pandas as pd
+import re
+import os
+from multiprocessing import Pool
+from corpus_reader import iter_corpus_chunks
+
+INPUT_FILE = 'sanders-r_corpus.csv'
+OUTPUT_FILE = 'sanders_r_corpus_CLEAN.csv'
+MESSAGE_COLUMN = 'message'
+CHUNKSIZE = 5000  # Righe lette e scritte per volta: il CSV non viene mai caricato per intero
+
+# Motore di pulizia:
+# "single":     funzione per messaggio con regole precompilate (default)
+# "vectorized": catena di Series.str.replace sull'intero blocco
+# "pool":       funzione per messaggio distribuita su NUM_WORKERS processi
+CLEAN_MODE = "single"
+NUM_WORKERS = os.cpu_count()
+POOL_CHUNKSIZE = 500
+
+# Regole di pulizia, precompilate e applicate nello stesso ordine della versione originale.
+# Ogni regola deve restare una sub separata: i prefissi ^\s* possono assorbire le righe
+# svuotate dalle regole precedenti, quindi un'unica sub con le alternative unite
+# non darebbe lo stesso output byte per byte.
+CLEANING_RULES = [
+    # Pulizia metadati e header di sistema (non rilevanti per l'analisi semantica)
+    re.compile(r'^\s*(Message-ID|Mime-Version|Content-Type|Content-Transfer-Encoding|X-Folder|X-Origin|X-FileName):.*$',
+               re.MULTILINE | re.IGNORECASE),
+    # Rimozione campi X- secondari (cc, bcc, etc.)
+    re.compile(r'^\s*X-(cc|bcc|From|To|Origin|FileName|Mailer|User-Agent|Priority|UID|Status|User|Ref|Attachment|Keywords):.*$',
+               re.MULTILINE | re.IGNORECASE),
+    # Strip dei separatori di inoltro standard Enron
+    re.compile(r'^\s*-+\s*Forwarded by.*$', re.MULTILINE | re.IGNORECASE),
+    # Rimozione info di contatto e firme (URL, numeri di telefono)
+    re.compile(r'^\s*Office:\s*\(?\d+\)?.*$', re.MULTILINE),
+    re.compile(r'^\s*www\..*$', re.MULTILINE),
+    # Rimozione separatori grafici (es. stringhe con << >>)
+    re.compile(r'^[<]+.*[>]+$', re.MULTILINE),
+]
+# Normalizzazione newline ed eccessi di spazi bianchi
+NEWLINES_RULE = re.compile(r'\n{3,}')
+
+# Unica scansione combinata che dice quali regole possono avere effetto sul messaggio.
+# Ogni gruppo è un letterale necessario alla regola corrispondente (a parità o più
+# permissivo di maiuscole/minuscole). Le regole cancellano solo contenuto compreso tra
+# un inizio e una fine riga, quindi non possono creare nuove occorrenze di questi
+# letterali: saltare le regole senza trigger non cambia l'output. Fa eccezione \n{3,},
+# che va sempre applicata se un'altra regola ha cancellato qualcosa.
+# X-Origin/X-FileName compaiono solo nel gruppo r0: la regola 0 cancella già ogni riga
+# su cui la regola 1 li troverebbe.
+TRIGGER_REGEX = re.compile(
+    r'(?P<r0>(?:Message-ID|Mime-Version|Content-Type|Content-Transfer-Encoding|X-Folder|X-Origin|X-FileName):)'
+    r'|(?P<r1>X-(?:cc|bcc|From|To|Mailer|User-Agent|Priority|UID|Status|User|Ref|Attachment|Keywords):)'
+    r'|(?P<r2>Forwarded by)'
+    r'|(?P<r3>Office:)'
+    r'|(?P<r4>www\.)'
+    r'|(?P<r5>^<)'
+    r'|(?P<nl>\n{3,})',
+    re.MULTILINE | re.IGNORECASE
+)
+
+def clean_email_text_for_semantic_analysis(raw_text):
+
+    if not isinstance(raw_text, str):
+        return ""
+
+    content = raw_text.strip()
+
+    triggered = {m.lastgroup for m in TRIGGER_REGEX.finditer(content)}
+
+    changed = False
+    for i, rule in enumerate(CLEANING_RULES):
+        if f"r{i}" in triggered:
+            content, n = rule.subn('', content)
+            changed = changed or n > 0
+
+    if changed or "nl" in triggered:
+        content = NEWLINES_RULE.sub('\n\n', content).strip()
+
+    return content
+
+def clean_series_vectorized(messages):
+    """Stessa pulizia sull'intera Series con Series.str (una passata per regola sul blocco)."""
+    content = messages.where(messages.map(lambda v: isinstance(v, str)), "").astype(object)
+    content = content.str.strip()
+    for rule in CLEANING_RULES:
+        content = content.str.replace(rule, '', regex=True)
+    return content.str.replace(NEWLINES_RULE, '\n\n', regex=True).str.strip()
+
+def clean_series(messages, mode=CLEAN_MODE, pool=None):
+    if mode == "vectorized":
+        return clean_series_vectorized(messages)
+    if mode == "pool":
+        cleaned = pool.imap(clean_email_text_for_semantic_analysis, messages.tolist(), chunksize=POOL_CHUNKSIZE)
+        return pd.Series(list(cleaned), index=messages.index, dtype=object)
+    return messages.apply(clean_email_text_for_semantic_analysis)
+
+if __name__ == "__main__":
+    print(f"Esecuzione script di cleaning su: {INPUT_FILE} (motore: {CLEAN_MODE})")
+
+    pool = Pool(processes=NUM_WORKERS) if CLEAN_MODE == "pool" else None
+    try:
+        columns = pd.read_csv(INPUT_FILE, nrows=0).columns.tolist()
+        if MESSAGE_COLUMN not in columns:
+            print(f"Colonna '{MESSAGE_COLUMN}' mancante. Campi rilevati: {columns}")
+            exit()
+
+        processed = 0
+        first_record = None
+        for chunk in iter_corpus_chunks(INPUT_FILE, columns=['file', MESSAGE_COLUMN], chunksize=CHUNKSIZE):
+            # Applico la pulizia e genero il dataset finale
+            chunk['cleaned_message'] = clean_series(chunk[MESSAGE_COLUMN], CLEAN_MODE, pool)
+
+            # Export dei soli campi necessari per la tesi, in append dopo il primo blocco
+            output_df = chunk[['file', 'cleaned_message']]
+            output_df.to_csv(OUTPUT_FILE, index=False, mode='w' if processed == 0 else 'a', header=processed == 0)
+
+            if first_record is None:
+                first_record = output_df['cleaned_message'].iloc[0]
+            processed += len(chunk)
+            print(f"Processate {processed} entry...")
+
+        print(f"Completato. Dataset salvato in: {OUTPUT_FILE}")
+
+        # Verifica rapida dell'output
+        print("\nLog - Primo record processato:")
+        print("-" * 40)
+        print((first_record or "")[:300] + "...")
+        print("-" * 40)
+
+    except FileNotFoundError:
+        print(f"Errore: File {INPUT_FILE} non trovato.")
+    except Exception as e:
+
+        print(f"Errore durante l'esecuzione: {e}")
+    finally:
+        if pool is not None:
+            pool.close()
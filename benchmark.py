@@ -0,0 +1,377 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import importlib.util
+
+# Benchmark riproducibile degli estrattori: velocità e qualità nella stessa tabella.
+# Ogni combinazione (motore, numero di email) gira in un sottoprocesso separato,
+# così il picco di RSS (getrusage) è quello del solo motore misurato.
+#
+# Corpus:
+# - "real": le prime N righe di CORPUS_FILE; F1 rispetto a pii_analysis_result_human.jsonl
+#   (solo le email annotate a mano, con join su email_index);
+# - "synthetic": email generate con entità note (seed fisso); F1 rispetto alle entità inserite.
+# Il LLM è simulato da stub_llm_server.py: misura il costo della pipeline client
+# (chunking, HTTP, parsing) più l'eventuale latenza simulata, non quello del modello.
+# La qualità del LLM simulato ha senso solo sul corpus reale, dove le risposte
+# rigiocate corrispondono alle email.
+
+ENGINES = ["regex", "presidio", "llm-stub"]
+SIZES = [100, 1000, 10000]
+CORPUS = "auto"                        # "auto" (reale se presente), "real" o "synthetic"
+REFERENCE_FILE = 'pii_analysis_result_human.jsonl'
+HISTORY_FILE = 'benchmark_history.jsonl'
+SEED = 42
+BLOCK_SIZE = 1000                      # Email per blocco, come CHUNKSIZE di corpus_reader
+STUB_SECONDS_PER_TOKEN = 0.0           # Latenza di decodifica simulata dallo stub
+STUB_CONCURRENCY = 8
+REGRESSION_TOLERANCE = 0.10            # Calo di email/s rispetto alla run precedente segnalato come regressione
+F1_TOLERANCE = 0.01
+
+# --- CORPUS SINTETICO ---
+FIRST_NAMES = ["Sara", "Mark", "Paul", "Daren", "Aimee", "Richard", "Gail", "Jeff", "Kay", "Vince",
+               "Louise", "Sally", "Tana", "Greg", "Susan", "Kevin", "Elizabeth", "Steven", "Mary", "John"]
+LAST_NAMES = ["Shackleton", "Taylor", "Radous", "Farmer", "Lannou", "Sanders", "Brownfeld", "Kinneman",
+              "Mann", "Kaminski", "Kitchen", "Beck", "Jones", "Whalley", "Bailey", "Presto", "Sager",
+              "Kean", "Cook", "Lavorato"]
+FILLER = [
+    "Please review the attached draft before the meeting on Monday.",
+    "The Enron North America legal team has a few comments on the Agreement.",
+    "Let me know if the numbers for the Houston desk look right to you.",
+    "We still need the signed confirmation from the counterparty.",
+    "I will be out of the office until Friday, call me if anything comes up.",
+    "The deal sheet was updated with the latest curve.",
+]
+
+
+def _person(rng):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return f"{first} {last}", f"{first.lower()}.{last.lower()}@enron.com"
+
+
+def synthetic_email(rng):
+    """Campi dell'email (come nel corpus) ed entità inserite, nel formato dei file di risultati."""
+    sender, sender_email = _person(rng)
+    recipient, recipient_email = _person(rng)
+    names = {sender, recipient}
+    emails = {sender_email, recipient_email}
+    phones = set()
+
+    lines = [f"{recipient},"]
+    for _ in range(rng.randint(1, 4)):
+        lines.append(rng.choice(FILLER))
+        if rng.random() < 0.5:
+            name, email = _person(rng)
+            phone = f"713-{rng.randint(200, 999)}-{rng.randint(1000, 9999)}"
+            lines.append(f"Please call {name} at {phone} or write to {email}.")
+            names.add(name)
+            emails.add(email)
+            phones.add(phone)
+    lines.append(f"Thanks,\n{sender}")
+
+    fields = {
+        'subject': rng.choice(["Re: draft", "Agreement comments", "FW: curve update", "Meeting"]),
+        'from': sender_email,
+        'to': recipient_email,
+        'cc': '',
+        'bcc': '',
+        'date': f"Mon, {rng.randint(1, 28)} May 2001 16:39:00 -0700 (PDT)",
+        'body': "\n".join(lines),
+        'file_name': f"synthetic/{rng.randint(1, 999)}.",
+    }
+    truth = {'names': sorted(names), 'emails': sorted(emails), 'phones': sorted(phones)}
+    return fields, truth
+
+
+def synthetic_corpus(n, seed=SEED):
+    """Blocchi di (email_index, testo) nel formato di format_chunk_joined e ground truth per indice."""
+    from corpus_reader import EMAIL_FIELDS
+
+    rng = random.Random(seed)
+    records = []
+    truth = []
+    for idx in range(n):
+        fields, entities = synthetic_email(rng)
+        records.append((idx, ' '.join(fields[field] for field in EMAIL_FIELDS)))
+        truth.append(dict(email_index=idx, **entities))
+    blocks = [records[i:i + BLOCK_SIZE] for i in range(0, n, BLOCK_SIZE)]
+    return blocks, truth
+
+
+def resolve_corpus(corpus):
+    if corpus != "auto":
+        return corpus
+    from corpus_reader import CORPUS_FILE
+    return "real" if os.path.exists(CORPUS_FILE) else "synthetic"
+
+
+# --- ESECUZIONE DI UN MOTORE (nel sottoprocesso) ---
+def _iter_regex(blocks, metrics):
+    import regex_analysis
+    return regex_analysis.iter_results(blocks, 1, metrics)
+
+
+def _iter_presidio(blocks, metrics):
+    import presidio_analysis
+    from presidio_analyzer import AnalyzerEngine
+    analyzer = AnalyzerEngine() if presidio_analysis.MODE != "pool" else None
+    return presidio_analysis.iter_results(blocks, analyzer, metrics)
+
+
+def _iter_llm_stub(blocks, metrics, seconds_per_token=STUB_SECONDS_PER_TOKEN):
+    """Pipeline LLM con backend HTTP verso lo stub: chunking, richieste concorrenti, parsing e merge."""
+    from stub_llm_server import start_stub_server
+    from llm_backends import OpenAIHTTPBackend
+    from llama_analysis_new7 import build_pii_messages, extract_robust_json_keep_all, MAX_CHUNK_LEN, CHUNK_OVERLAP
+    from chunking import chunk_text, EntityMerger
+
+    server = start_stub_server(seconds_per_token=seconds_per_token)
+    backend = OpenAIHTTPBackend(server.url, "stub", max_new_tokens=1516, max_concurrency=STUB_CONCURRENCY)
+    try:
+        merger = EntityMerger()
+        for block in blocks:
+            items = []
+            for idx, text in block:
+                with metrics.phase('tokenize', idx):
+                    chunks = chunk_text(text, MAX_CHUNK_LEN, CHUNK_OVERLAP)
+                for chunk_idx, chunk in enumerate(chunks):
+                    items.append({'email_index': idx, 'chunk_idx': chunk_idx, 'num_chunks': len(chunks),
+                                  'messages': build_pii_messages(chunk.text)})
+
+            for start in range(0, len(items), STUB_CONCURRENCY):
+                batch = items[start:start + STUB_CONCURRENCY]
+                responses = backend.generate(batch)
+                for phase, ns in backend.last_stats['phases'].items():
+                    metrics.add_shared([item['email_index'] for item in batch], phase, ns)
+                for item, response in zip(batch, responses):
+                    with metrics.phase('parse', item['email_index']):
+                        result = merger.add(extract_robust_json_keep_all(response, item['email_index'], 0),
+                                            item['num_chunks'])
+                    if result is not None:
+                        yield result
+    finally:
+        backend.close()
+        server.shutdown()
+
+
+ENGINE_RUNNERS = {
+    'regex': _iter_regex,
+    'presidio': _iter_presidio,
+    'llm-stub': _iter_llm_stub,
+}
+
+
+def engine_available(engine):
+    if engine == 'presidio':
+        return importlib.util.find_spec('presidio_analyzer') is not None
+    return engine in ENGINE_RUNNERS
+
+
+def run_engine(engine, size, corpus, seconds_per_token=STUB_SECONDS_PER_TOKEN):
+    """Esegue un motore su size email e restituisce le misure (chiamata nel sottoprocesso)."""
+    from instrumentation import StageMetrics
+    from evaluate_systems import evaluate
+
+    setup_start = time.perf_counter()
+    if corpus == "synthetic":
+        blocks, truth = synthetic_corpus(size)
+        reference_path = None
+    else:
+        from corpus_reader import iter_record_blocks, format_chunk_joined, CORPUS_FILE
+        blocks = iter_record_blocks(CORPUS_FILE, format_chunk_joined, chunksize=BLOCK_SIZE, limit=size)
+        truth = None
+        reference_path = REFERENCE_FILE
+
+    metrics = StageMetrics(engine)
+    if engine == 'llm-stub':
+        results = _iter_llm_stub(blocks, metrics, seconds_per_token)
+    else:
+        results = ENGINE_RUNNERS[engine](blocks, metrics)
+    setup_seconds = time.perf_counter() - setup_start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, f"{engine}.jsonl")
+        start = time.perf_counter()
+        emails = 0
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for result in results:
+                with metrics.phase('write', result['email_index']):
+                    f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                metrics.finish(result['email_index'])
+                emails += 1
+        wall = time.perf_counter() - start
+
+        if reference_path is None:
+            reference_path = os.path.join(tmp, "truth.jsonl")
+            with open(reference_path, 'w', encoding='utf-8') as f:
+                for entry in truth:
+                    f.write(json.dumps(entry) + "\n")
+
+        quality = None
+        # Le risposte rigiocate dallo stub corrispondono solo alle email del corpus reale
+        if not (engine == 'llm-stub' and corpus == "synthetic"):
+            report, reference = evaluate(reference_path, {engine: output_path})
+            precision, recall, f1 = report[engine]['metrics']['all']['micro']
+            quality = {'precision': round(precision, 4), 'recall': round(recall, 4), 'f1': round(f1, 4),
+                       'reference_emails': reference['matched']}
+
+    summary = metrics.close()
+    # ru_maxrss è in KB su Linux e in byte su macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+
+    row = {
+        'engine': engine,
+        'corpus': corpus,
+        'size': size,
+        'emails': emails,
+        'setup_seconds': round(setup_seconds, 4),
+        'wall_seconds': round(wall, 4),
+        'emails_per_second': round(emails / wall, 2) if wall > 0 else 0.0,
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'p50_ms': summary['total_ms']['p50'],
+        'p95_ms': summary['total_ms']['p95'],
+        'p99_ms': summary['total_ms']['p99'],
+    }
+    row.update(quality or {'precision': None, 'recall': None, 'f1': None, 'reference_emails': 0})
+    return row
+
+
+# --- ORCHESTRAZIONE ---
+def run_in_subprocess(engine, size, corpus, seconds_per_token):
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker', engine, str(size), corpus,
+           '--stub-seconds-per-token', str(seconds_per_token)]
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        return {'engine': engine, 'corpus': corpus, 'size': size, 'error': proc.stderr.strip().splitlines()[-1:]}
+    # L'ultima riga dello stdout è il risultato; le precedenti sono i log del motore
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def pareto_front(rows):
+    """Righe non dominate su (email/s, F1): nessun'altra è più veloce e più accurata insieme."""
+    scored = [r for r in rows if r.get('f1') is not None]
+    front = []
+    for r in scored:
+        dominated = any(
+            o is not r and o['emails_per_second'] >= r['emails_per_second'] and o['f1'] >= r['f1']
+            and (o['emails_per_second'] > r['emails_per_second'] or o['f1'] > r['f1'])
+            for o in scored
+        )
+        if not dominated:
+            front.append(r)
+    return front
+
+
+def print_table(rows):
+    width = 112
+    print("=" * width)
+    print(f"{'Motore':<10} | {'Email':>6} | {'Tempo (s)':>9} | {'email/s':>9} | {'RSS (MB)':>8} | "
+          f"{'p50 ms':>8} | {'p95 ms':>8} | {'P':>6} | {'R':>6} | {'F1':>6} | Pareto")
+    print("-" * width)
+    for size in sorted({r['size'] for r in rows}):
+        group = [r for r in rows if r['size'] == size]
+        front = pareto_front([r for r in group if 'error' not in r])
+        for r in group:
+            if 'error' in r:
+                print(f"{r['engine']:<10} | {r['size']:>6} | errore: {' '.join(r['error'])}")
+                continue
+            fmt = lambda v: f"{v:>6.3f}" if v is not None else f"{'-':>6}"
+            print(f"{r['engine']:<10} | {r['emails']:>6} | {r['wall_seconds']:>9.3f} | {r['emails_per_second']:>9.1f} | "
+                  f"{r['peak_rss_mb']:>8.1f} | {r['p50_ms']:>8.3f} | {r['p95_ms']:>8.3f} | "
+                  f"{fmt(r['precision'])} | {fmt(r['recall'])} | {fmt(r['f1'])} | {'*' if r in front else ''}")
+        print("-" * width)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def last_history_entry(path):
+    if not os.path.exists(path):
+        return None
+    last = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                last = json.loads(line)
+    return last
+
+
+def regressions(rows, previous):
+    """Confronto con la run precedente sulle stesse combinazioni (motore, corpus, email)."""
+    if not previous:
+        return []
+    before = {(r['engine'], r['corpus'], r.get('emails')): r for r in previous['results'] if 'error' not in r}
+    warnings = []
+    for r in rows:
+        old = before.get((r['engine'], r['corpus'], r.get('emails')))
+        if old is None or 'error' in r:
+            continue
+        if r['emails_per_second'] < old['emails_per_second'] * (1 - REGRESSION_TOLERANCE):
+            warnings.append(f"{r['engine']} ({r['emails']} email): {old['emails_per_second']} -> "
+                            f"{r['emails_per_second']} email/s")
+        if r['f1'] is not None and old.get('f1') is not None and r['f1'] < old['f1'] - F1_TOLERANCE:
+            warnings.append(f"{r['engine']} ({r['emails']} email): F1 {old['f1']} -> {r['f1']}")
+    return warnings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di velocità e qualità degli estrattori PII.")
+    parser.add_argument('--engines', nargs='+', default=ENGINES, choices=list(ENGINE_RUNNERS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--corpus', choices=["auto", "real", "synthetic"], default=CORPUS)
+    parser.add_argument('--stub-seconds-per-token', type=float, default=STUB_SECONDS_PER_TOKEN)
+    parser.add_argument('--history', default=HISTORY_FILE)
+    parser.add_argument('--worker', nargs=3, metavar=('ENGINE', 'SIZE', 'CORPUS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        engine, size, corpus = args.worker
+        print(json.dumps(run_engine(engine, int(size), corpus, args.stub_seconds_per_token)))
+        return 0
+
+    corpus = resolve_corpus(args.corpus)
+    rows = []
+    for size in args.sizes:
+        for engine in args.engines:
+            if not engine_available(engine):
+                print(f"{engine}: non installato, saltato")
+                continue
+            print(f"{engine} su {size} email ({corpus})...")
+            rows.append(run_in_subprocess(engine, size, corpus, args.stub_seconds_per_token))
+
+    print_table(rows)
+
+    previous = last_history_entry(args.history)
+    for warning in regressions(rows, previous):
+        print(f"REGRESSIONE: {warning}")
+
+    entry = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': corpus,
+        'stub_seconds_per_token': args.stub_seconds_per_token,
+        'results': rows,
+    }
+    with open(args.history, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry) + "\n")
+    print(f"Risultati aggiunti a {args.history}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
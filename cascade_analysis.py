@@ -0,0 +1,227 @@
+import re
+import time
+from presidio_analyzer import AnalyzerEngine, BatchAnalyzerEngine
+import llama_analysis_new7 as llm
+from chunking import chunk_text, estimate_tokens
+from entity_keys import ENTITY_KEYS
+from corpus_reader import iter_corpus_chunks, format_chunk_joined, format_chunk_full, EMAIL_FIELDS, CORPUS_FILE
+from evaluate_systems import evaluate
+from instrumentation import StageMetrics, metrics_path, format_summary
+from regex_analysis import process_email, scan_entities
+from presidio_analysis import process_batch_presidio, is_valid_name, iter_blocks, BATCH_SIZE
+from results_writer import ResultsWriter
+
+# Cascata di estrattori: regex e Presidio su ogni email (millisecondi), il LLM
+# (centinaia di secondi per email) solo dove i risultati economici sono incerti:
+# - i due motori non concordano su email o telefoni, o poco sui nomi;
+# - ci sono candidati nome scartati da is_valid_name (intestazioni, luoghi, firme);
+# - il testo è lungo (più di un chunk) o è un thread inoltrato/quotato.
+# Le email certe tengono i risultati economici; le incerte prendono i nomi dal LLM
+# e uniscono email e telefoni dei tre motori. La decisione è per email intera:
+# un'email incerta viene inviata con tutti i suoi chunk.
+
+INPUT_FILE = CORPUS_FILE
+OUTPUT_FILE = 'pii_analysis_results_cascade.jsonl'
+METRICS_FILE = metrics_path(OUTPUT_FILE)
+ENTITY_INDEX_FILE = None   # 'pii_entity_index.pickle' (entity_index.py): indice delle entità aggiornato durante la scrittura
+SAMPLE_SIZE = 100          # None per analizzare tutto il corpus
+EMAIL_WINDOW = llm.EMAIL_WINDOW
+RESUME = True              # Riprende dal manifest di OUTPUT_FILE (results_writer.py)
+
+REFERENCE_FILE = 'pii_analysis_result_human.jsonl'
+LLM_BASELINE_FILE = 'pii_analysis_results_llama_cleaned.jsonl'   # Run con il LLM su ogni email
+
+NAME_AGREEMENT = 0.5       # Jaccard minimo tra i nomi di regex e Presidio
+MAX_REJECTED_NAMES = 2     # Candidati nome scartati oltre i quali l'email è incerta
+LONG_EMAIL_TOKENS = llm.MAX_CHUNK_LEN
+THREAD_PATTERN = re.compile(r'-{2,}\s*(?:Original Message|Forwarded by)|^\s*>', re.MULTILINE | re.IGNORECASE)
+
+
+def result_keys(result, field):
+    return {ENTITY_KEYS[field](str(v).lower() if field == 'emails' else str(v)) for v in result.get(field, [])}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def uncertainty_reasons(text, regex_result, presidio_result):
+    """Motivi per cui i risultati economici non bastano (lista vuota = email certa)."""
+    reasons = []
+    for field in ('emails', 'phones'):
+        if result_keys(regex_result, field) != result_keys(presidio_result, field):
+            reasons.append(f'disagreement:{field}')
+    if jaccard(result_keys(regex_result, 'names'), result_keys(presidio_result, 'names')) < NAME_AGREEMENT:
+        reasons.append('disagreement:names')
+
+    rejected = sum(1 for category, _, _, value in scan_entities(text)
+                   if category == 'names' and not is_valid_name(value))
+    if rejected > MAX_REJECTED_NAMES:
+        reasons.append('rejected_names')
+
+    if estimate_tokens([text])[0] > LONG_EMAIL_TOKENS:
+        reasons.append('long')
+    if THREAD_PATTERN.search(text):
+        reasons.append('thread')
+    return reasons
+
+
+def _union(field, *results):
+    """Entità uniche di più risultati, nell'ordine in cui compaiono."""
+    seen = {}
+    for result in results:
+        for value in result.get(field) or []:
+            val = str(value).strip()
+            if field == 'emails':
+                val = val.lower()
+            if val:
+                seen.setdefault(ENTITY_KEYS[field](val), val)
+    return list(seen.values())
+
+
+def merge_cheap(email_index, regex_result, presidio_result):
+    """Email certa: nomi filtrati di Presidio, email e telefoni di entrambi i motori."""
+    return {
+        'email_index': email_index,
+        'seconds': round(regex_result['seconds'] + presidio_result['seconds'], 4),
+        'names': _union('names', presidio_result),
+        'emails': _union('emails', regex_result, presidio_result),
+        'phones': _union('phones', regex_result, presidio_result),
+        'route': 'cheap',
+    }
+
+
+def merge_with_llm(email_index, regex_result, presidio_result, llm_rows, reasons):
+    """Email incerta: nomi del LLM; email e telefoni uniti (la regex delle email è molto precisa).
+
+    llm_rows sono le righe del LLM per l'email: una sola con MERGE_CHUNKS, altrimenti una per chunk.
+    """
+    llm_seconds = sum(row.get('seconds', 0) for row in llm_rows)
+    merged = {
+        'email_index': email_index,
+        'seconds': round(regex_result['seconds'] + presidio_result['seconds'] + llm_seconds, 4),
+        'names': _union('names', *llm_rows),
+        'emails': _union('emails', *llm_rows, regex_result, presidio_result),
+        'phones': _union('phones', *llm_rows, regex_result, presidio_result),
+        'route': 'llm',
+        'reasons': reasons,
+    }
+    if not llm_rows or any('errors' in row or 'error' in row for row in llm_rows):
+        # Nessuna riga del LLM per l'email o risposta non valida: restano almeno i nomi di Presidio
+        merged['names'] = _union('names', presidio_result)
+        merged['llm_error'] = True
+    return merged
+
+
+def process_window(chunk, batch_analyzer, backend, tokenizer, prefix, metrics, stats):
+    """Risultati della cascata per un blocco del corpus, in ordine di email_index."""
+    indexes = chunk['email_index'].tolist()
+    with metrics.phase('format', indexes):
+        joined = dict(zip(indexes, format_chunk_joined(chunk).tolist()))
+
+    regex_results = {}
+    for idx in indexes:
+        with metrics.phase('extract', idx):
+            regex_results[idx] = process_email(joined[idx], idx)
+
+    presidio_results = {}
+    for block in iter_blocks(list(joined.items()), BATCH_SIZE):
+        with metrics.phase('extract', [idx for idx, _ in block]):
+            for result in process_batch_presidio(batch_analyzer, block):
+                presidio_results[result['email_index']] = result
+
+    routes = {idx: uncertainty_reasons(joined[idx], regex_results[idx], presidio_results[idx]) for idx in indexes}
+    uncertain = [idx for idx in indexes if routes[idx]]
+
+    llm_results = {}
+    if uncertain:
+        # Il LLM riceve il testo con le etichette dei campi, come in llama_analysis_new7.py
+        with metrics.phase('format', uncertain):
+            full = format_chunk_full(chunk[chunk['email_index'].isin(uncertain)]).tolist()
+        for idx, _, result in llm.analyze_window(backend, tokenizer, prefix, list(zip(uncertain, full)), metrics):
+            llm_results.setdefault(idx, []).append(result)
+
+    rows = []
+    for idx in indexes:
+        reasons = routes[idx]
+        if reasons:
+            llm_rows = llm_results.get(idx, [])
+            stats['llm_emails'] += 1
+            stats['llm_calls'] += sum(row.get('chunks', 1) for row in llm_rows)
+            for reason in reasons:
+                stats['reasons'][reason] = stats['reasons'].get(reason, 0) + 1
+            rows.append(merge_with_llm(idx, regex_results[idx], presidio_results[idx], llm_rows, reasons))
+        else:
+            # Chiamate che il LLM avrebbe ricevuto per questa email (stima con i chunk a caratteri)
+            stats['avoided_calls'] += len(chunk_text(joined[idx], llm.MAX_CHUNK_LEN, llm.CHUNK_OVERLAP))
+            rows.append(merge_cheap(idx, regex_results[idx], presidio_results[idx]))
+    stats['emails'] += len(indexes)
+    return rows
+
+
+def print_report(stats):
+    emails = stats['emails']
+    print("\n" + "=" * 60)
+    print("RIEPILOGO CASCATA")
+    print("=" * 60)
+    print(f"Email analizzate:          {emails}")
+    print(f"Email inviate al LLM:      {stats['llm_emails']} ({100 * stats['llm_emails'] / max(emails, 1):.1f}%)")
+    print(f"Chiamate LLM eseguite:     {stats['llm_calls']}")
+    print(f"Chiamate LLM evitate:      {stats['avoided_calls']} (stima, una per chunk)")
+    for reason, count in sorted(stats['reasons'].items(), key=lambda kv: -kv[1]):
+        print(f"  motivo {reason:<20} {count}")
+
+    systems = {'cascade': OUTPUT_FILE, 'llm': LLM_BASELINE_FILE}
+    try:
+        report, reference = evaluate(REFERENCE_FILE, systems)
+    except FileNotFoundError as e:
+        print(f"F1 non calcolata: {e}")
+        return
+    f1 = {name: report[name]['metrics']['all']['micro'][2] for name in systems}
+    print(f"F1 su {reference['matched']} email annotate: cascata {f1['cascade']:.4f}, "
+          f"LLM su ogni email {f1['llm']:.4f} (delta {f1['cascade'] - f1['llm']:+.4f})")
+    print("=" * 60)
+
+
+def main():
+    print(f"Inizializzazione cascata (LLM: backend '{llm.BACKEND}')...")
+    try:
+        batch_analyzer = BatchAnalyzerEngine(analyzer_engine=AnalyzerEngine())
+        tokenizer, backend, prefix = llm.load_backend()
+    except Exception as e:
+        print(f"Errore inizializzazione: {e}")
+        return
+
+    stats = {'emails': 0, 'llm_emails': 0, 'llm_calls': 0, 'avoided_calls': 0, 'reasons': {}}
+    writer = ResultsWriter(OUTPUT_FILE, resume=RESUME, index_file=ENTITY_INDEX_FILE, index_source='cascade')
+    metrics = StageMetrics("cascade", METRICS_FILE, append=writer.start_index > 0)
+    start_time = time.time()
+    try:
+        chunks = iter_corpus_chunks(INPUT_FILE, EMAIL_FIELDS, chunksize=EMAIL_WINDOW,
+                                    start_index=writer.start_index, limit=SAMPLE_SIZE)
+        for chunk in chunks:
+            for row in process_window(chunk, batch_analyzer, backend, tokenizer, prefix, metrics, stats):
+                with metrics.phase('write', row['email_index']):
+                    writer.commit(row['email_index'], [row])
+                metrics.finish(row['email_index'])
+            print(f"Email fino a {chunk['email_index'].iloc[-1]}: {stats['llm_emails']} inviate al LLM")
+    except FileNotFoundError:
+        print(f"Errore: Il file {INPUT_FILE} non esiste.")
+        return
+    except Exception as e:
+        print(f"Errore durante l'esecuzione: {e}")
+        return
+    finally:
+        writer.close()
+        backend.close()
+        summary = metrics.close()
+
+    print(f"Completato in {time.time() - start_time:.2f}s. Risultati in: {OUTPUT_FILE}")
+    print(format_summary(summary))
+    print_report(stats)
+
+
+if __name__ == "__main__":
+    main()
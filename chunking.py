@@ -0,0 +1,152 @@
+import re
+from collections import namedtuple
+from entity_keys import ENTITY_KEYS
+
+# Chunking dei testi lunghi (thread inoltrati, allegati incollati) per l'analisi LLM.
+# I chunk sono finestre sovrapposte allineate a fine riga o fine frase, con gli offset
+# nel testo originale: nessun nome o indirizzo viene tagliato a metà tra due chunk.
+
+Chunk = namedtuple('Chunk', ['text', 'start', 'end'])
+
+CHARS_PER_TOKEN = 4   # Stima usata quando non viene passato un tokenizer
+
+LINE_PATTERN = re.compile(r'[^\n]*\n|[^\n]+$')
+SENTENCE_PATTERN = re.compile(r'.*?(?:[.!?;](?=\s)\s*|$)', re.DOTALL)
+
+
+def estimate_tokens(texts):
+    return [max(1, len(t) // CHARS_PER_TOKEN) for t in texts]
+
+
+def _spans(pattern, text, start, end):
+    return [(start + m.start(), start + m.end()) for m in pattern.finditer(text[start:end]) if m.end() > m.start()]
+
+
+def _hard_split(text, start, end, n_tokens, max_tokens):
+    """Ultima risorsa per frasi più lunghe di un chunk: tagli su spazio a lunghezza proporzionale."""
+    size = max(1, (end - start) * max_tokens // max(n_tokens, 1))
+    spans = []
+    while start < end:
+        stop = min(start + size, end)
+        if stop < end:
+            space = text.rfind(' ', start + 1, stop)
+            if space > start:
+                stop = space + 1
+        spans.append((start, stop))
+        start = stop
+    return spans
+
+
+def split_segments(text, max_tokens, count_tokens=estimate_tokens):
+    """Segmenti (start, end, n_token) del testo: righe, spezzate a fine frase se superano max_tokens."""
+    spans = _spans(LINE_PATTERN, text, 0, len(text))
+    for level in ('sentence', 'hard'):
+        counts = count_tokens([text[s:e] for s, e in spans]) if spans else []
+        too_long = [i for i, n in enumerate(counts) if n > max_tokens]
+        if not too_long:
+            break
+        refined = []
+        for i, (s, e) in enumerate(spans):
+            if counts[i] <= max_tokens:
+                refined.append((s, e))
+            elif level == 'sentence':
+                refined.extend(_spans(SENTENCE_PATTERN, text, s, e))
+            else:
+                refined.extend(_hard_split(text, s, e, counts[i], max_tokens))
+        spans = refined
+    counts = count_tokens([text[s:e] for s, e in spans]) if spans else []
+    return [(s, e, n) for (s, e), n in zip(spans, counts)]
+
+
+def chunk_text(text, max_tokens, overlap_tokens=0, count_tokens=estimate_tokens):
+    """Divide il testo in chunk di al massimo max_tokens (salvo segmenti indivisibili più lunghi).
+
+    Chunk consecutivi condividono gli ultimi segmenti, fino a overlap_tokens token:
+    un'entità a cavallo di un confine compare per intero in almeno uno dei due.
+    count_tokens riceve una lista di stringhe e restituisce il numero di token di ciascuna.
+    """
+    segments = split_segments(text, max_tokens, count_tokens)
+    if not segments:
+        return [Chunk(text, 0, len(text))]
+
+    chunks = []
+    i = 0
+    while i < len(segments):
+        j = i
+        total = 0
+        while j < len(segments) and (j == i or total + segments[j][2] <= max_tokens):
+            total += segments[j][2]
+            j += 1
+        start, end = segments[i][0], segments[j - 1][1]
+        chunks.append(Chunk(text[start:end], start, end))
+        if j == len(segments):
+            break
+
+        # Il chunk successivo riparte dagli ultimi segmenti di questo, entro il budget di sovrapposizione
+        # e solo se c'è ancora posto per segments[j]: altrimenti ripeterebbe la coda di questo chunk
+        # senza avanzare (una generazione in più per niente)
+        k = j
+        overlap = 0
+        next_tokens = segments[j][2]
+        while (k - 1 > i and overlap + segments[k - 1][2] <= overlap_tokens
+               and overlap + segments[k - 1][2] + next_tokens <= max_tokens):
+            k -= 1
+            overlap += segments[k][2]
+        i = k
+    return chunks
+
+
+class EntityMerger:
+    """Unisce in streaming i risultati dei chunk di ogni email, deduplicando le entità.
+
+    Sostituisce il passaggio successivo di clean_jsonl_llama.py: appena arrivano tutti i
+    chunk di un'email viene restituita una sola riga con le entità uniche e i secondi sommati.
+    """
+
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, chunk_result, num_chunks):
+        idx = chunk_result['email_index']
+        merged = self.pending.get(idx)
+        if merged is None:
+            merged = {
+                'email_index': idx,
+                'seconds': 0.0,
+                'names': {},
+                'emails': {},
+                'phones': {},
+                'chunks': 0,
+            }
+            self.pending[idx] = merged
+
+        merged['seconds'] = round(merged['seconds'] + chunk_result.get('seconds', 0), 2)
+        merged['chunks'] += 1
+
+        if 'error' in chunk_result:
+            merged.setdefault('errors', []).append({
+                'chunk': chunk_result.get('chunk'),
+                'error': chunk_result['error'],
+                'raw_response': chunk_result.get('raw_response'),
+            })
+
+        for field, key_fn in ENTITY_KEYS.items():
+            values = chunk_result.get(field)
+            if not isinstance(values, list):
+                continue
+            for item in values:
+                val = str(item).strip()
+                if not val:
+                    continue
+                if field == 'emails':
+                    val = val.lower()
+                # Si tiene la prima forma vista di ogni entità
+                merged[field].setdefault(key_fn(val), val)
+
+        if merged['chunks'] < num_chunks:
+            return None
+
+        del self.pending[idx]
+        for field in ENTITY_KEYS:
+            merged[field] = list(merged[field].values())
+        return merged
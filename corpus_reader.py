@@ -0,0 +1,234 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# Lettura in streaming del corpus: il file viene letto a blocchi di CHUNKSIZE righe,
+# così la memoria resta costante qualunque sia la dimensione del corpus.
+# email_index è la posizione della riga nel file (0 = prima riga dopo l'header)
+# ed è lo stesso indice usato in tutti i file pii_analysis_results_*.jsonl.
+#
+# Formati supportati: CSV, Parquet e Arrow IPC (.arrow/.feather). I formati colonnari
+# vengono aperti in memory-map e ne vengono lette solo le colonne richieste,
+# senza il parsing del CSV all'avvio di ogni script.
+
+CSV_CORPUS_FILE = 'campione_enron.csv'
+PARQUET_CORPUS_FILE = 'campione_enron.parquet'
+CHUNKSIZE = 1000
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+# Campi usati dagli estrattori (message_id escluso)
+EMAIL_FIELDS = ['subject', 'from', 'to', 'cc', 'bcc', 'date', 'body', 'file_name']
+
+
+def format_email_full(row):
+    """Testo con le etichette dei campi ("SUBJECT: ...") per dare contesto al modello."""
+    parts = []
+    for field in EMAIL_FIELDS:
+        if field not in row:
+            continue
+        val = str(row[field]).strip() if pd.notna(row[field]) else ""
+        if val:
+            # Formattiamo come "Campo: Valore" per aiutare il modello a orientarsi
+            parts.append(f"{field.upper()}: {val}")
+    return "\n".join(parts)
+
+
+def format_chunk_joined(chunk):
+    """Campi concatenati con uno spazio (formato di regex_analysis.py e presidio_analysis.py)."""
+    columns = [col for col in EMAIL_FIELDS if col in chunk.columns]
+    return chunk[columns].fillna('').astype(str).agg(' '.join, axis=1)
+
+
+def format_chunk_full(chunk):
+    return chunk.apply(format_email_full, axis=1)
+
+
+def default_corpus_file():
+    """Il corpus colonnare se è già stato creato (crea_campione_enron.py), altrimenti il CSV."""
+    return PARQUET_CORPUS_FILE if os.path.exists(PARQUET_CORPUS_FILE) else CSV_CORPUS_FILE
+
+
+CORPUS_FILE = default_corpus_file()
+
+
+def is_columnar(path):
+    return str(path).lower().endswith(PARQUET_EXTENSIONS + ARROW_EXTENSIONS)
+
+
+def write_csv_copy(columns, path):
+    """Copia CSV scritta da pandas come il campione originale: le liste diventano "['a', 'b']".
+
+    columns è un dizionario colonna -> valori Python (Dataset.to_dict(), Table.to_pydict()).
+    """
+    pd.DataFrame(columns).to_csv(path, index=False)
+
+
+def _lists_to_text(chunk):
+    """I campi lista del dataset HF (to, cc, bcc) e le date diventano la stessa stringa che compare nel CSV."""
+    for col in chunk.columns:
+        if chunk[col].dtype == object:
+            chunk[col] = chunk[col].map(lambda v: str(list(v)) if isinstance(v, (list, np.ndarray)) else v)
+        elif pd.api.types.is_datetime64_any_dtype(chunk[col]) and col != 'email_index':
+            # fillna('') non sostituisce NaT nelle colonne datetime: le date mancanti diventano None
+            chunk[col] = chunk[col].astype(object).where(chunk[col].notna(), None).map(
+                lambda v: str(v) if v is not None else None)
+    return chunk
+
+
+def open_arrow_table(path, columns=None):
+    """Tabella pyarrow in memory-map (zero-copy per Arrow IPC) con le sole colonne richieste."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if str(path).lower().endswith(ARROW_EXTENSIONS):
+        table = pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+        if columns is not None:
+            table = table.select([col for col in columns if col in table.column_names])
+        return table
+
+    schema_names = pq.read_schema(path).names
+    selected = None if columns is None else [col for col in columns if col in schema_names]
+    return pq.read_table(path, columns=selected, memory_map=True)
+
+
+def _columns_with_index(path, columns):
+    import pyarrow.parquet as pq
+    import pyarrow as pa
+
+    if str(path).lower().endswith(ARROW_EXTENSIONS):
+        names = pa.ipc.open_file(pa.memory_map(str(path), 'r')).schema.names
+    else:
+        names = pq.read_schema(path).names
+    if columns is None:
+        return names
+    # email_index viene letto anche se non richiesto, quando il file lo contiene
+    wanted = list(columns) + (['email_index'] if 'email_index' not in columns else [])
+    return [col for col in wanted if col in names]
+
+
+def _iter_arrow_batches(path, columns, chunksize, start_index, stop):
+    """RecordBatch delle righe [start_index, stop) lette in memory-map, solo per le colonne richieste."""
+    import pyarrow.parquet as pq
+
+    if str(path).lower().endswith(ARROW_EXTENSIONS):
+        table = open_arrow_table(path, columns)
+        stop = table.num_rows if stop is None else min(stop, table.num_rows)
+        if stop > start_index:
+            yield from table.slice(start_index, stop - start_index).to_batches(max_chunksize=chunksize)
+        return
+
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    stop = parquet_file.metadata.num_rows if stop is None else min(stop, parquet_file.metadata.num_rows)
+
+    # Row group interamente prima di start_index non vengono nemmeno decompressi
+    row_groups = []
+    position = None
+    offset = 0
+    for i in range(parquet_file.num_row_groups):
+        num_rows = parquet_file.metadata.row_group(i).num_rows
+        if offset + num_rows > start_index and offset < stop:
+            row_groups.append(i)
+            if position is None:
+                position = offset
+        offset += num_rows
+    if not row_groups:
+        return
+
+    for batch in parquet_file.iter_batches(batch_size=chunksize, row_groups=row_groups, columns=columns):
+        lo = max(start_index - position, 0)
+        hi = min(stop - position, batch.num_rows)
+        if hi > lo:
+            yield batch.slice(lo, hi - lo)
+        position += batch.num_rows
+        if position >= stop:
+            break
+
+
+def iter_corpus_chunks(path=CORPUS_FILE, columns=EMAIL_FIELDS, chunksize=CHUNKSIZE, start_index=0, limit=None):
+    """DataFrame di al massimo chunksize righe, con la colonna email_index globale.
+
+    start_index salta le righe già elaborate senza parsarle; limit è il numero totale
+    di righe del corpus da considerare (es. SAMPLE_SIZE), contato dalla prima riga.
+    """
+    if limit is not None and start_index >= limit:
+        return
+
+    if is_columnar(path):
+        position = start_index
+        for batch in _iter_arrow_batches(path, _columns_with_index(path, columns), chunksize, start_index, limit):
+            chunk = _lists_to_text(batch.to_pandas())
+            if 'email_index' not in chunk.columns:
+                chunk.insert(0, 'email_index', range(position, position + len(chunk)))
+            chunk.index = pd.RangeIndex(position, position + len(chunk))
+            position += len(chunk)
+            yield chunk
+        return
+
+    nrows = None if limit is None else limit - start_index
+    wanted = set(columns) if columns is not None else None
+
+    reader = pd.read_csv(
+        path,
+        chunksize=chunksize,
+        usecols=(lambda col: col in wanted) if wanted is not None else None,
+        skiprows=range(1, start_index + 1) if start_index > 0 else None,
+        nrows=nrows,
+    )
+    email_index = start_index
+    for chunk in reader:
+        chunk.index = pd.RangeIndex(email_index, email_index + len(chunk))
+        chunk.insert(0, 'email_index', chunk.index)
+        email_index += len(chunk)
+        yield chunk
+
+
+def iter_record_blocks(path=CORPUS_FILE, formatter=format_chunk_joined, chunksize=CHUNKSIZE,
+                       start_index=0, limit=None, columns=EMAIL_FIELDS, metrics=None):
+    """Liste di (email_index, testo formattato), una per blocco di righe lette.
+
+    Con metrics (instrumentation.StageMetrics) i tempi di lettura e formattazione
+    di ogni blocco vengono ripartiti tra le sue email come fasi "load" e "format".
+    """
+    chunks = iter_corpus_chunks(path, columns, chunksize, start_index, limit)
+    while True:
+        load_start = time.perf_counter_ns()
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        format_start = time.perf_counter_ns()
+        indexes = chunk['email_index'].tolist()
+        texts = formatter(chunk).tolist()
+        if metrics is not None:
+            metrics.add_shared(indexes, 'load', format_start - load_start)
+            metrics.add_shared(indexes, 'format', time.perf_counter_ns() - format_start)
+        yield list(zip(indexes, texts))
+
+
+def iter_email_records(path=CORPUS_FILE, formatter=format_chunk_joined, chunksize=CHUNKSIZE,
+                       start_index=0, limit=None, columns=EMAIL_FIELDS):
+    """(email_index, testo formattato) per ogni email del corpus, in ordine."""
+    for block in iter_record_blocks(path, formatter, chunksize, start_index, limit, columns):
+        yield from block
+
+
+def read_rows(path, start, stop, columns=EMAIL_FIELDS):
+    """Righe [start, stop) di un corpus colonnare come tabella pyarrow, senza leggere il resto."""
+    import pyarrow as pa
+
+    batches = list(_iter_arrow_batches(path, _columns_with_index(path, columns), CHUNKSIZE, start, stop))
+    if not batches:
+        return open_arrow_table(path, columns).slice(0, 0)
+    return pa.Table.from_batches(batches)
+
+
+def sample_rows(path, n, seed=42, columns=EMAIL_FIELDS):
+    """Campione casuale di n righe (stessi indici di DataFrame.sample(n, random_state=seed)).
+
+    Con Arrow IPC la tabella è in memory-map e take() copia solo le righe estratte.
+    """
+    table = open_arrow_table(path, _columns_with_index(path, columns))
+    indices = np.random.RandomState(seed).choice(table.num_rows, size=n, replace=False)
+    return table.take(indices)
@@ -1,10 +1,34 @@
-import pandas as pd
-from datasets import load_dataset
-
-dataset = load_dataset("corbt/enron-emails")
-df = pd.DataFrame(dataset['train'])
-
-# Campione da 1000 mail
-df_sample = df.sample(n=1000, random_state=42)
-df_sample.to_csv("campione_enron.csv", index=False)
-print("Tutto ok")
\ No newline at end of file
+import numpy as np
+import pyarrow as pa
+from datasets import load_dataset
+from corpus_reader import write_csv_copy
+
+SAMPLE_SIZE = 1000
+RANDOM_STATE = 42
+WRITE_CSV = True           # Copia CSV per gli strumenti che non leggono Parquet
+WRITE_FULL_CORPUS = False  # Esporta anche l'intero dataset (500k mail) in formato colonnare
+
+dataset = load_dataset("corbt/enron-emails")['train']
+
+if WRITE_FULL_CORPUS:
+    full = dataset.add_column('email_index', np.arange(len(dataset)))
+    full.to_parquet("enron_emails.parquet")
+    # Arrow IPC: aperto in memory-map dagli script e campionabile per righe senza caricarlo in RAM
+    table = full.data.table
+    with pa.OSFile("enron_emails.arrow", 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            for batch in table.to_batches(max_chunksize=10000):
+                writer.write_batch(batch)
+
+# Campione da 1000 mail: stessi indici di df.sample(n=1000, random_state=42),
+# ma selezionati sulla tabella Arrow senza convertire il dataset in pandas
+indices = np.random.RandomState(RANDOM_STATE).choice(len(dataset), size=SAMPLE_SIZE, replace=False)
+df_sample = dataset.select(indices)
+df_sample = df_sample.add_column('email_index', np.arange(SAMPLE_SIZE))
+
+df_sample.to_parquet("campione_enron.parquet")
+if WRITE_CSV:
+    # Scritto da pandas come prima (liste "['a', 'b']"), non da Dataset.to_csv: stesso testo del Parquet
+    # per gli estrattori (tests/test_corpus_reader.py)
+    write_csv_copy(df_sample.remove_columns('email_index').to_dict(), "campione_enron.csv")
+print("Tutto ok")
@@ -0,0 +1,266 @@
+import re
+import json
+import zlib
+import time
+from collections import Counter
+import numpy as np
+from corpus_reader import iter_corpus_chunks, CORPUS_FILE
+from result_cache import iter_planned
+
+# Deduplicazione dei quasi-duplicati prima dell'estrazione (stessa email nelle cartelle
+# sent, all_documents e discussion_threads, copie inoltrate, risposte quotate).
+# 1. Shingle di SHINGLE_SIZE parole del body, hash crc32.
+# 2. Firme MinHash calcolate in NumPy su blocchi di documenti (una matrice shingle x permutazioni
+#    e np.minimum.reduceat per documento).
+# 3. LSH a bande: documenti con una banda identica sono candidati; la coppia viene unita
+#    solo se la Jaccard stimata dalle firme supera SIMILARITY_THRESHOLD.
+# I cluster (rappresentante = email_index più basso, il primo letto in streaming) vanno in
+# CLUSTERS_FILE; iter_deduplicated fa analizzare agli estrattori solo i rappresentanti e
+# copia le entità sui membri, con gli offset in cui compaiono nel testo del membro.
+
+INPUT_FILE = CORPUS_FILE
+TEXT_COLUMN = 'body'
+CLUSTERS_FILE = 'dedup_clusters.jsonl'
+CHUNKSIZE = 5000
+
+SHINGLE_SIZE = 5              # Parole per shingle
+NUM_PERM = 128                # Permutazioni MinHash
+ROWS_PER_BAND = 8             # 16 bande da 8 righe: soglia LSH ~ (1/16)^(1/8) = 0.71
+SIMILARITY_THRESHOLD = 0.8    # Jaccard stimata minima per unire due email
+MIN_COVERAGE = 0.95           # Frazione degli shingle del membro presenti nel rappresentante per copiarne le entità
+MAX_BATCH_SHINGLES = 200000   # Shingle per matrice (memoria: shingle x NUM_PERM x 8 byte)
+SEED = 42
+
+MERSENNE_PRIME = np.uint64(4294967291)   # Primo < 2^32: (a * h + b) resta sotto 2^64
+MAX_HASH = np.uint32(0xFFFFFFFF)
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Insieme degli hash (crc32) delle sequenze di size parole del testo, in minuscolo."""
+    if not isinstance(text, str):
+        return set()
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {zlib.crc32(' '.join(words).encode('utf-8'))} if words else set()
+    return {zlib.crc32(' '.join(words[i:i + size]).encode('utf-8')) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """Firme MinHash con permutazioni (a * h + b) mod p, calcolate in NumPy."""
+
+    def __init__(self, num_perm=NUM_PERM, seed=SEED):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    def _batch(self, hashes, offsets):
+        values = (hashes[:, None] * self.a[None, :] + self.b[None, :]) % MERSENNE_PRIME
+        return np.minimum.reduceat(values, offsets, axis=0).astype(np.uint32)
+
+    def signatures(self, shingle_sets):
+        """Matrice (documenti x NUM_PERM) uint32; i documenti senza shingle restano a MAX_HASH."""
+        sig = np.full((len(shingle_sets), self.num_perm), MAX_HASH, dtype=np.uint32)
+        batch_rows, batch_hashes, batch_size = [], [], 0
+
+        def flush():
+            lengths = [len(h) for h in batch_hashes]
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.intp)
+            hashes = np.concatenate(batch_hashes) % MERSENNE_PRIME
+            sig[batch_rows] = self._batch(hashes, offsets)
+
+        for row, items in enumerate(shingle_sets):
+            if not items:
+                continue
+            if batch_rows and batch_size + len(items) > MAX_BATCH_SHINGLES:
+                flush()
+                batch_rows, batch_hashes, batch_size = [], [], 0
+            batch_rows.append(row)
+            batch_hashes.append(np.fromiter(items, dtype=np.uint64, count=len(items)))
+            batch_size += len(items)
+        if batch_rows:
+            flush()
+        return sig
+
+
+class LSHClusterer:
+    """Indice LSH a bande con union-find: la radice di ogni cluster è l'email_index più basso."""
+
+    def __init__(self, num_perm=NUM_PERM, rows_per_band=ROWS_PER_BAND, threshold=SIMILARITY_THRESHOLD):
+        self.rows = rows_per_band
+        self.bands = num_perm // rows_per_band
+        self.threshold = threshold
+        self.buckets = {}
+        self.signatures = {}
+        self.parent = {}
+        self.candidates = 0
+
+    def find(self, x):
+        root = x
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while x != root:
+            self.parent[x], x = root, self.parent.get(x, x)
+        return root
+
+    def union(self, x, y):
+        rx, ry = self.find(x), self.find(y)
+        if rx != ry:
+            self.parent[max(rx, ry)] = min(rx, ry)
+
+    def add(self, doc_id, signature):
+        if signature[0] == MAX_HASH:
+            return  # Nessuno shingle (body vuoto): non viene raggruppato
+        self.signatures[doc_id] = signature
+        for band in range(self.bands):
+            key = (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            head = self.buckets.setdefault(key, doc_id)
+            if head == doc_id:
+                continue
+            self.candidates += 1
+            if np.mean(self.signatures[head] == signature) >= self.threshold:
+                self.union(head, doc_id)
+
+    def clusters(self):
+        """{email_index: rappresentante} per le email in cluster di almeno due elementi."""
+        members = {doc_id: self.find(doc_id) for doc_id in self.parent}
+        for root in set(members.values()):
+            members[root] = root
+        return members
+
+
+def build_clusters(path=INPUT_FILE, column=TEXT_COLUMN, chunksize=CHUNKSIZE, limit=None):
+    hasher = MinHasher()
+    lsh = LSHClusterer()
+    total = 0
+    for chunk in iter_corpus_chunks(path, columns=[column], chunksize=chunksize, limit=limit):
+        sets = [shingles(text) for text in chunk[column].tolist()]
+        sig = hasher.signatures(sets)
+        for doc_id, signature in zip(chunk['email_index'].tolist(), sig):
+            lsh.add(doc_id, signature)
+        total += len(chunk)
+    return lsh.clusters(), total, lsh.candidates
+
+
+def write_clusters(members, path=CLUSTERS_FILE):
+    sizes = Counter(members.values())
+    with open(path, 'w', encoding='utf-8') as f:
+        for doc_id in sorted(members):
+            rep = members[doc_id]
+            f.write(json.dumps({'email_index': doc_id, 'representative': rep, 'cluster_size': sizes[rep]}) + "\n")
+
+
+def load_clusters(path=CLUSTERS_FILE):
+    """{email_index: rappresentante} per i soli membri non rappresentanti."""
+    clusters = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if entry['email_index'] != entry['representative']:
+                    clusters[entry['email_index']] = entry['representative']
+    return clusters
+
+
+# --- PROPAGAZIONE DEI RISULTATI AI MEMBRI ---
+def coverage(member_text, rep_shingles):
+    """Frazione degli shingle del membro presenti nel rappresentante (1.0 = nessun testo nuovo)."""
+    member = shingles(member_text)
+    if not member:
+        return 1.0
+    return len(member & rep_shingles) / len(member)
+
+
+def entity_pattern(value):
+    """Regex dell'entità con spazi flessibili: i risultati hanno gli spazi normalizzati (deep_clean)."""
+    return re.compile(r'\s+'.join(re.escape(word) for word in value.split()), re.IGNORECASE)
+
+
+def spread_entities(rep_result, member_index, member_text):
+    """Riga del membro con le entità del rappresentante che compaiono nel suo testo e i loro offset."""
+    result = {'email_index': member_index, 'seconds': 0.0, 'representative': rep_result['email_index']}
+    offsets = []
+    for field in ('names', 'emails', 'phones'):
+        kept = []
+        for value in rep_result.get(field) or []:
+            value = str(value).strip()
+            if not value:
+                continue
+            spans = [(m.start(), m.end()) for m in entity_pattern(value).finditer(member_text)]
+            if spans:
+                kept.append(value)
+                offsets.extend({'category': field, 'text': value, 'start': s, 'end': e} for s, e in spans)
+        result[field] = kept
+    result['entity_offsets'] = offsets
+    return result
+
+
+def iter_deduplicated(record_blocks, clusters, compute, min_coverage=MIN_COVERAGE):
+    """Fa analizzare a compute solo i rappresentanti e i membri con testo nuovo; gli altri
+    membri ricevono le entità del rappresentante. Righe in ordine di email_index.
+
+    compute riceve un iterabile di blocchi di (email_index, testo) e restituisce una riga
+    per email in ordine (come iter_results degli estrattori o iter_with_cache).
+    """
+    to_read = Counter(clusters.values())      # Membri non ancora letti, per rappresentante
+    to_write = Counter(clusters.values())     # Membri non ancora restituiti, per rappresentante
+    rep_shingles = {}
+    rep_results = {}
+
+    def plan_block(block):
+        spread = {}
+        todo = []
+        for idx, text in block:
+            if to_read[idx] > 0:
+                rep_shingles[idx] = shingles(text)
+            rep = clusters.get(idx)
+            if rep in rep_shingles and coverage(text, rep_shingles[rep]) >= min_coverage:
+                spread[idx] = rep
+            else:
+                todo.append((idx, text))
+            if rep is not None:
+                to_read[rep] -= 1
+                if to_read[rep] == 0:
+                    rep_shingles.pop(rep, None)
+        return (block, spread), todo
+
+    def finish(plan, computed):
+        block, spread = plan
+        for idx, text in block:
+            if idx in spread:
+                row = spread_entities(rep_results[spread[idx]], idx, text)
+            else:
+                row = computed[idx]
+                if to_write[idx] > 0:
+                    rep_results[idx] = row
+            rep = clusters.get(idx)
+            if rep is not None:
+                to_write[rep] -= 1
+                if to_write[rep] == 0:
+                    # Ultimo membro restituito: il risultato del rappresentante non serve più
+                    rep_results.pop(rep, None)
+            yield row
+
+    return iter_planned(record_blocks, plan_block, compute, finish)
+
+def main():
+    print(f"Calcolo firme MinHash su '{TEXT_COLUMN}' di {INPUT_FILE} ({NUM_PERM} permutazioni, "
+          f"{NUM_PERM // ROWS_PER_BAND} bande)...")
+    start_time = time.time()
+    try:
+        members, total, candidates = build_clusters()
+    except FileNotFoundError:
+        print(f"Errore: Il file {INPUT_FILE} non esiste.")
+        return
+
+    write_clusters(members)
+    reps = set(members.values())
+    duplicates = len(members) - len(reps)
+    print(f"Completato in {time.time() - start_time:.2f}s: {total} email, {candidates} coppie candidate, "
+          f"{len(reps)} cluster con {duplicates} quasi-duplicati "
+          f"({100 * duplicates / max(total, 1):.1f}% di analisi evitabili). Cluster in: {CLUSTERS_FILE}")
+
+
+if __name__ == "__main__":
+    main()
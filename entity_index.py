@@ -0,0 +1,331 @@
+import os
+import re
+import sys
+import time
+import pickle
+import argparse
+from array import array
+from bisect import bisect_left
+from evaluate_systems import iter_grouped, REFERENCE_FILE, SYSTEM_FILES, CATEGORIES
+from entity_keys import entity_key
+
+# Indice invertito delle entità su tutto il corpus: (sorgente, entità normalizzata) -> postings
+# list ordinata degli email_index in cui compare (array di interi, non liste JSON per riga).
+# Le previsioni dei diversi sistemi (e del riferimento umano) restano separate per sorgente.
+# Due modi di aggiornarlo:
+# - in streaming, mentre un estrattore scrive: ResultsWriter(..., index_file=INDEX_FILE,
+#   index_source='regex') chiama add_rows per ogni email completata e salva la sorgente alla
+#   chiusura. Le email che la sorgente ha già (resume) vengono saltate; un'esecuzione che
+#   riparte da zero svuota prima la sorgente;
+# - "python entity_index.py build NOME=FILE" ricostruisce da capo le sorgenti dai file di
+#   risultati completati, senza lasciare postings vecchie.
+# È salvato in INDEX_FILE, così le domande di esposizione ("in quante email compare
+# Sara Shackleton, anche come indirizzo?") non rileggono i file JSONL.
+#
+# Ricerche (su una sorgente o, senza --source, sull'unione di tutte):
+# - per entità: stessa semantica di are_entities_equal (nomi = insieme delle parole,
+#   email in minuscolo, telefoni per cifre);
+# - per prefisso: sulle parole dei nomi e sull'inizio di indirizzi e numeri;
+# - collegamento nome <-> indirizzo con euristiche sulla parte locale
+#   (sara.shackleton, sshackleton, shackleton.sara, ...), con il numero di email in cui
+#   compaiono insieme come conferma.
+
+INDEX_FILE = 'pii_entity_index.pickle'
+INDEX_FORMAT = 3
+WORD_PATTERN = re.compile(r'[a-z]+')
+
+
+def name_signatures(text):
+    """Firme di un nome confrontabili con quelle di una parte locale."""
+    words = WORD_PATTERN.findall(text.lower())
+    signatures = set()
+    strong = sorted({w for w in words if len(w) > 1})
+    if len(strong) >= 2:
+        signatures.add(('set', ' '.join(strong)))
+    if len(words) >= 2:
+        first, last = words[0], words[-1]
+        signatures.update({('flat', first[0] + last), ('flat', last + first[0]),
+                           ('flat', first + last), ('flat', last + first)})
+    return signatures
+
+
+def email_signatures(address):
+    """Firme della parte locale: parole separate da . _ - e lettere concatenate."""
+    tokens = WORD_PATTERN.findall(address.lower().split('@')[0])
+    signatures = set()
+    strong = sorted({t for t in tokens if len(t) > 1})
+    if len(strong) >= 2:
+        signatures.add(('set', ' '.join(strong)))
+    if tokens:
+        signatures.add(('flat', ''.join(tokens)))
+    return signatures
+
+
+def _add_posting(postings, email_index):
+    if not postings or postings[-1] < email_index:
+        postings.append(email_index)
+        return
+    pos = bisect_left(postings, email_index)
+    if pos == len(postings) or postings[pos] != email_index:
+        postings.insert(pos, email_index)
+
+
+class EntityIndex:
+    """Postings list per (sorgente, categoria, chiave), parole dei nomi e firme per il collegamento nome/email."""
+
+    def __init__(self):
+        self.postings = {}      # sorgente -> {(categoria, chiave): array('q') di email_index ordinati}
+        self.indexed = {}       # sorgente -> {email_index già indicizzati}
+        self.surface = {}       # (categoria, chiave) -> forma vista per prima
+        self.words = {}         # parola -> {(categoria, chiave)} dei nomi che la contengono
+        self.signatures = {}    # firma -> {(categoria, chiave)} di nomi e indirizzi
+        self._sorted = None     # Chiavi di ricerca per prefisso, ricalcolate dopo le modifiche
+
+    # --- AGGIORNAMENTO ---
+    def add(self, source, email_index, category, value):
+        value = str(value).strip()
+        if category == 'emails':
+            value = value.lower()
+        if not value:
+            return
+        entry = (category, entity_key(category, value))
+        if entry not in self.surface:
+            self.add_vocabulary(entry, value)
+        postings = self.postings.setdefault(source, {})
+        if entry not in postings:
+            postings[entry] = array('q')
+        _add_posting(postings[entry], email_index)
+
+    def add_vocabulary(self, entry, value):
+        """Forma, parole e firme di un'entità nuova."""
+        category = entry[0]
+        self.surface[entry] = value
+        self._sorted = None
+        if category == 'names':
+            for word in entry[1].split():
+                self.words.setdefault(word, set()).add(entry)
+        if category in ('names', 'emails'):
+            signatures = name_signatures(value) if category == 'names' else email_signatures(value)
+            for signature in signatures:
+                self.signatures.setdefault(signature, set()).add(entry)
+
+    def add_rows(self, source, rows):
+        """Aggiunge le righe di risultato della sorgente (più righe per email ammesse, es. i chunk).
+
+        Le email già indicizzate per la sorgente vengono saltate: un resume non le conta due volte.
+        """
+        done = self.indexed.setdefault(source, set())
+        added = set()
+        for row in rows:
+            email_index = row['email_index']
+            if email_index in done and email_index not in added:
+                continue
+            added.add(email_index)
+            for category in CATEGORIES:
+                values = row.get(category)
+                if isinstance(values, list):
+                    for value in values:
+                        self.add(source, email_index, category, value)
+        done.update(added)
+
+    def replace_source(self, source, rows):
+        """Sostituisce tutte le postings della sorgente con quelle delle righe date."""
+        self.postings[source] = {}
+        self.indexed[source] = set()
+        self._sorted = None
+        try:
+            self.add_rows(source, rows)
+        except Exception:
+            # Né le postings vecchie né quelle di un file letto a metà
+            del self.postings[source]
+            del self.indexed[source]
+            raise
+
+    # --- RICERCA ---
+    def _postings(self, entry, source=None):
+        """email_index ordinati dell'entità nella sorgente, o nell'unione di tutte se source è None."""
+        if source is not None:
+            return self.postings.get(source, {}).get(entry, array('q'))
+        lists = [postings[entry] for postings in self.postings.values() if entry in postings]
+        if len(lists) == 1:
+            return lists[0]
+        return array('q', sorted(set().union(*lists)))
+
+    def _known(self, entry, source=None):
+        if source is not None:
+            return entry in self.postings.get(source, {})
+        return any(entry in postings for postings in self.postings.values())
+
+    def lookup(self, value, category=None, source=None):
+        """{(categoria, chiave): postings} delle entità uguali a value (tutte le categorie se None)."""
+        found = {}
+        for cat in ([category] if category else CATEGORIES):
+            text = value.strip().lower() if cat == 'emails' else value.strip()
+            if not text:
+                continue
+            entry = (cat, entity_key(cat, text))
+            if self._known(entry, source):
+                found[entry] = self._postings(entry, source)
+        return found
+
+    def _prefix_keys(self):
+        if self._sorted is None:
+            keys = [(word, None) for word in self.words]
+            keys += [(key, (cat, key)) for cat, key in self.surface if cat != 'names']
+            self._sorted = sorted(keys, key=lambda item: item[0])
+        return self._sorted
+
+    def prefix(self, prefix, category=None, limit=50, source=None):
+        """Entità con una parola del nome, un indirizzo o un numero che inizia con prefix."""
+        prefix = prefix.strip().lower()
+        keys = self._prefix_keys()
+        pos = bisect_left(keys, (prefix,))
+        found = []
+        seen = set()
+        while pos < len(keys) and keys[pos][0].startswith(prefix) and len(found) < limit:
+            text, entry = keys[pos]
+            entries = self.words[text] if entry is None else {entry}
+            for item in sorted(entries):
+                if (item not in seen and (category is None or item[0] == category)
+                        and self._known(item, source)):
+                    seen.add(item)
+                    found.append(item)
+            pos += 1
+        return found[:limit]
+
+    def linked(self, entry, source=None):
+        """[(entità collegata, email in comune)]: indirizzi di un nome o nomi di un indirizzo."""
+        category, _ = entry
+        if category not in ('names', 'emails'):
+            return []
+        own = name_signatures(self.surface[entry]) if category == 'names' else email_signatures(self.surface[entry])
+        other = 'emails' if category == 'names' else 'names'
+        candidates = set()
+        for signature in own:
+            candidates.update(item for item in self.signatures.get(signature, ())
+                              if item[0] == other and self._known(item, source))
+        postings = set(self._postings(entry, source))
+        links = [(item, len(postings.intersection(self._postings(item, source)))) for item in candidates]
+        return sorted(links, key=lambda link: (-link[1], link[0]))
+
+    def exposure(self, value, category=None, source=None):
+        """Email in cui compare l'entità, da sola o tramite le entità collegate."""
+        report = []
+        for entry, postings in self.lookup(value, category, source).items():
+            emails = set(postings)
+            links = []
+            for item, together in self.linked(entry, source):
+                item_postings = self._postings(item, source)
+                emails.update(item_postings)
+                links.append({'entity': self.surface[item], 'category': item[0],
+                              'emails': len(item_postings), 'together': together})
+            report.append({'entity': self.surface[entry], 'category': entry[0], 'emails': len(postings),
+                           'linked': links, 'total_emails': len(emails),
+                           'email_indexes': sorted(emails)})
+        return report
+
+    # --- PERSISTENZA ---
+    def save(self, path=INDEX_FILE):
+        """Salvataggio atomico (file temporaneo + os.replace)."""
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump({'format': INDEX_FORMAT, 'postings': self.postings, 'indexed': self.indexed,
+                         'surface': self.surface, 'words': self.words, 'signatures': self.signatures},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def save_source(self, source, path=INDEX_FILE):
+        """Salva solo la sorgente, sopra l'indice attuale del file: le sorgenti aggiornate
+        nel frattempo da altri estrattori non vengono sovrascritte."""
+        current = EntityIndex.load(path)
+        current.postings[source] = self.postings.get(source, {})
+        current.indexed[source] = self.indexed.get(source, set())
+        for entry in current.postings[source]:
+            if entry not in current.surface:
+                current.add_vocabulary(entry, self.surface[entry])
+        current.save(path)
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        """Indice salvato, o vuoto se il file non esiste o ha un formato precedente."""
+        index = cls()
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('format') != INDEX_FORMAT:
+                print(f"{path}: formato precedente, l'indice riparte vuoto")
+                return index
+            index.postings = data['postings']
+            index.indexed = data['indexed']
+            index.surface = data['surface']
+            index.words = data['words']
+            index.signatures = data['signatures']
+        return index
+
+
+def parse_sources(items):
+    """{sorgente: file} da argomenti NOME=FILE (solo FILE: la sorgente è il nome del file)."""
+    sources = {}
+    for item in items:
+        name, sep, path = item.partition('=')
+        if not sep:
+            name, path = os.path.splitext(os.path.basename(item))[0], item
+        sources[name] = path
+    return sources
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Indice invertito delle entità: email per entità, prefissi e collegamenti nome/indirizzo.")
+    parser.add_argument('--index', default=INDEX_FILE)
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="Ricostruisce le sorgenti da file di risultati completati "
+                                              "(NOME=FILE, default: quelli di evaluate_systems.py)")
+    build.add_argument('files', nargs='*')
+    query = commands.add_parser('query', help="Esposizione di un'entità")
+    query.add_argument('value')
+    query.add_argument('--category', choices=CATEGORIES)
+    query.add_argument('--source', help="Solo questa sorgente (default: tutte)")
+    prefix = commands.add_parser('prefix', help="Entità che iniziano con un prefisso")
+    prefix.add_argument('value')
+    prefix.add_argument('--category', choices=CATEGORIES)
+    prefix.add_argument('--source', help="Solo questa sorgente (default: tutte)")
+    args = parser.parse_args(argv)
+
+    index = EntityIndex.load(args.index)
+    if args.command == 'build':
+        sources = parse_sources(args.files) if args.files else dict(SYSTEM_FILES, human=REFERENCE_FILE)
+        for source, path in sources.items():
+            try:
+                index.replace_source(source, (merged for _, merged, _ in iter_grouped(path)))
+            except (FileNotFoundError, ValueError) as e:
+                print(f"{source} ({path}): non indicizzato ({e})")
+                continue
+            print(f"{source} ({path}): {len(index.postings[source])} entità")
+        index.save(args.index)
+        print(f"{len(index.postings)} sorgenti in {args.index}: {', '.join(sorted(index.postings))}")
+        return 0
+
+    if args.source is not None and args.source not in index.postings:
+        print(f"Sorgente {args.source} non presente in {args.index}.")
+        return 1
+    start_ns = time.perf_counter_ns()
+    if args.command == 'query':
+        report = index.exposure(args.value, args.category, args.source)
+        elapsed_ms = (time.perf_counter_ns() - start_ns) / 1e6
+        for item in report:
+            print(f"[{item['category']}] {item['entity']}: {item['emails']} email, "
+                  f"{item['total_emails']} con le entità collegate")
+            for link in item['linked']:
+                print(f"    -> [{link['category']}] {link['entity']}: {link['emails']} email, {link['together']} insieme")
+        if not report:
+            print("Entità non trovata.")
+    else:
+        found = index.prefix(args.value, args.category, source=args.source)
+        elapsed_ms = (time.perf_counter_ns() - start_ns) / 1e6
+        for entry in found:
+            print(f"[{entry[0]}] {index.surface[entry]}: {len(index._postings(entry, args.source))} email")
+    print(f"({elapsed_ms:.2f} ms)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+# Chiavi di uguaglianza delle entità, comuni a tutto il progetto (merge dei chunk, valutazione,
+# archivio, indice, redazione): due valori con la stessa chiave sono la stessa entità.
+# - nomi: insieme delle parole in minuscolo (stessa semantica di are_entities_equal);
+# - email: in minuscolo;
+# - telefoni: sole cifre.
+
+
+def _name_key(name):
+    # Stessa semantica di are_entities_equal: parole uguali a meno di ordine e maiuscole
+    return frozenset(name.lower().split())
+
+
+def _phone_key(phone):
+    return ''.join(ch for ch in phone if ch.isdigit()) or phone
+
+
+ENTITY_KEYS = {
+    'names': _name_key,
+    'emails': lambda email: email.lower(),
+    'phones': _phone_key,
+}
+
+
+def entity_key(category, value):
+    """Chiave normalizzata come stringa (i nomi diventano le parole ordinate)."""
+    key = ENTITY_KEYS[category](value)
+    return ' '.join(sorted(key)) if isinstance(key, frozenset) else key
@@ -0,0 +1,55 @@
+from collections import Counter
+from entity_keys import entity_key
+
+# Matching delle entità tramite indice hash.
+# Due entità sono uguali se contengono le stesse parole, ignorando ordine e maiuscole
+# (stessa semantica di are_entities_equal): ogni entità viene normalizzata una sola volta
+# in una chiave frozenset e i match si contano con un multiset (Counter) per gestire i
+# duplicati. Il risultato coincide con il confronto a coppie con list.remove, perché
+# l'uguaglianza per insiemi di parole è una relazione di equivalenza.
+# Tutte le categorie usano la chiave dei nomi (entity_key 'names'), come are_entities_equal.
+
+def key_counts(entities):
+    """Multiset delle chiavi di una lista di entità (chiave vuota se l'entità è vuota)."""
+    return Counter(entity_key('names', str(entity)) for entity in entities)
+
+def match_counts(pred_counts, true_counts):
+    """TP, FP, FN tra due multiset di chiavi; le chiavi vuote non corrispondono a nulla."""
+    n_pred = sum(pred_counts.values())
+    n_true = sum(true_counts.values())
+    small, large = (pred_counts, true_counts) if len(pred_counts) <= len(true_counts) else (true_counts, pred_counts)
+    tp = sum(min(count, large[key]) for key, count in small.items() if key and key in large)
+    return tp, n_pred - tp, n_true - tp
+
+def metrics_from_counts(tp, fp, fn):
+    precision = tp / (tp + fp) if (tp + fp) > 0 else 1.0
+    recall = tp / (tp + fn) if (tp + fn) > 0 else 1.0
+    f1 = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 1.0
+    return precision, recall, f1
+
+def strict_metrics_from_counts(tp, fp, fn):
+    """Precision, recall e F1 per la valutazione dei sistemi (evaluate_systems.py).
+
+    A differenza di metrics_from_counts (regola originale "denominatore 0 -> 1.0", tenuta solo
+    per calculate_metrics) il punteggio 1.0 spetta solo a un'email perfetta (tp = fp = fn = 0):
+    un denominatore nullo con errori vale 0, e F1 è 0 quando tp è 0.
+    """
+    if tp == fp == fn == 0:
+        return 1.0, 1.0, 1.0
+    precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
+    recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
+    f1 = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0.0
+    return precision, recall, f1
+
+def calculate_metrics(pred_list, true_list):
+    """Precision, recall e F1 di una lista di predizioni rispetto al ground truth."""
+    return metrics_from_counts(*match_counts(key_counts(pred_list), key_counts(true_list)))
+
+def calculate_metrics_many(system_preds, true_list):
+    """Metriche di più sistemi rispetto allo stesso riferimento in una sola passata.
+
+    system_preds: {nome_sistema: lista di predizioni}. Il riferimento viene normalizzato una volta.
+    Restituisce {nome_sistema: (tp, fp, fn)}.
+    """
+    true_counts = key_counts(true_list)
+    return {name: match_counts(key_counts(preds), true_counts) for name, preds in system_preds.items()}
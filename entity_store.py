@@ -0,0 +1,246 @@
+import sys
+import json
+import sqlite3
+import argparse
+from itertools import chain
+from contextlib import nullcontext
+from entity_keys import entity_key
+from evaluate_systems import iter_grouped, REFERENCE_FILE, SYSTEM_FILES, CATEGORIES
+
+# Archivio delle entità estratte da tutti i sistemi, al posto delle liste JSON per email.
+# Le stringhe sono internate una volta sola (dizionario entities: id, categoria, chiave
+# normalizzata, forma trovata per prima); le menzioni sono righe compatte
+# (sorgente, email_index, entity_id, offset) con chiave primaria su questi campi, più un
+# indice per entity_id. Così "tutte le email che citano X" o "entità trovate da A e non da B"
+# sono lookup sugli indici di SQLite e non cicli annidati sulle liste.
+#
+# La chiave è la stessa semantica di ENTITY_KEYS (nomi: insieme delle parole, email in
+# minuscolo, telefoni: sole cifre). La tabella emails registra quali email ogni sorgente
+# ha elaborato: i confronti tra due sorgenti considerano solo le email elaborate da entrambe.
+
+STORE_FILE = 'pii_entities.sqlite'
+BATCH_ROWS = 10000          # Righe di risultato per transazione
+
+
+class EntityStore:
+    """Entità internate e menzioni per sorgente in un database SQLite."""
+
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " source_id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, path TEXT);"
+            "CREATE TABLE IF NOT EXISTS entities ("
+            " entity_id INTEGER PRIMARY KEY, category TEXT NOT NULL, key TEXT NOT NULL, text TEXT NOT NULL,"
+            " UNIQUE (category, key));"
+            "CREATE TABLE IF NOT EXISTS emails ("
+            " source_id INTEGER NOT NULL, email_index INTEGER NOT NULL,"
+            " PRIMARY KEY (source_id, email_index)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS mentions ("
+            " source_id INTEGER NOT NULL, email_index INTEGER NOT NULL, entity_id INTEGER NOT NULL, offsets TEXT,"
+            " PRIMARY KEY (source_id, email_index, entity_id)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS mentions_by_entity ON mentions (entity_id, email_index);"
+        )
+        self.conn.commit()
+        self._ids = {}
+
+    def source_id(self, name, path=None):
+        row = self.conn.execute("SELECT source_id FROM sources WHERE name = ?", (name,)).fetchone()
+        if row is not None:
+            return row[0]
+        return self.conn.execute("INSERT INTO sources (name, path) VALUES (?, ?)", (name, path)).lastrowid
+
+    def _lookup_source(self, name):
+        row = self.conn.execute("SELECT source_id FROM sources WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise ValueError(f"Sorgente sconosciuta: {name!r}")
+        return row[0]
+
+    def intern(self, category, value):
+        """entity_id dell'entità (creata se nuova); None se il valore è vuoto."""
+        value = str(value).strip()
+        if category == 'emails':
+            value = value.lower()
+        if not value:
+            return None
+        key = entity_key(category, value)
+        entity_id = self._ids.get((category, key))
+        if entity_id is None:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO entities (category, key, text) VALUES (?, ?, ?)", (category, key, value))
+            if cursor.rowcount == 1:
+                entity_id = cursor.lastrowid
+            else:
+                entity_id = self.conn.execute(
+                    "SELECT entity_id FROM entities WHERE category = ? AND key = ?", (category, key)).fetchone()[0]
+            self._ids[(category, key)] = entity_id
+        return entity_id
+
+    def _mentions(self, source, row):
+        offsets = {}
+        for span in row.get('entity_offsets') or []:
+            entity_id = self.intern(span['category'], span['text'])
+            if entity_id is not None:
+                offsets.setdefault(entity_id, []).append([span['start'], span['end']])
+        for category in CATEGORIES:
+            values = row.get(category)
+            if not isinstance(values, list):
+                continue
+            for value in values:
+                entity_id = self.intern(category, value)
+                if entity_id is not None:
+                    spans = offsets.get(entity_id)
+                    yield source, row['email_index'], entity_id, json.dumps(spans) if spans else None
+
+    def _insert_rows(self, source_id, rows, commit=True):
+        """Inserisce emails e menzioni delle righe a blocchi di BATCH_ROWS (commit per blocco se commit)."""
+        emails, mentions = [], []
+        count = 0
+
+        def flush():
+            with self.conn if commit else nullcontext():
+                self.conn.executemany("INSERT OR IGNORE INTO emails VALUES (?, ?)", emails)
+                self.conn.executemany("INSERT OR IGNORE INTO mentions VALUES (?, ?, ?, ?)", mentions)
+            emails.clear()
+            mentions.clear()
+
+        for row in rows:
+            emails.append((source_id, row['email_index']))
+            mentions.extend(self._mentions(source_id, row))
+            count += 1
+            if len(emails) >= BATCH_ROWS:
+                flush()
+        flush()
+        return count
+
+    def append_rows(self, source, rows, path=None):
+        """Aggiunge le righe di risultato di un estrattore (più righe per email ammesse, es. i chunk)."""
+        return self._insert_rows(self.source_id(source, path), rows)
+
+    def import_jsonl(self, source, path):
+        """Sostituisce i dati della sorgente con il contenuto di un file di risultati.
+
+        Cancellazione e inserimento sono una sola transazione: se il file si interrompe
+        (riga non valida, file non ordinato) la sorgente resta com'era.
+        """
+        groups = iter_grouped(path)
+        first = next(groups, None)      # File mancante: errore prima di toccare i dati della sorgente
+        groups = chain([first], groups) if first is not None else groups
+        try:
+            with self.conn:
+                source_id = self.source_id(source, path)
+                self.conn.execute("UPDATE sources SET path = ? WHERE source_id = ?", (path, source_id))
+                self.conn.execute("DELETE FROM mentions WHERE source_id = ?", (source_id,))
+                self.conn.execute("DELETE FROM emails WHERE source_id = ?", (source_id,))
+                return self._insert_rows(source_id, (merged for _, merged, _ in groups), commit=False)
+        except Exception:
+            self._ids.clear()     # Gli id internati nella transazione annullata non esistono più
+            raise
+
+    # --- INTERROGAZIONI ---
+    def emails_mentioning(self, value, category=None):
+        """{email_index: [sorgenti]} delle email in cui compare l'entità (tutte le categorie se None)."""
+        categories = [category] if category else CATEGORIES
+        found = {}
+        for cat in categories:
+            key = entity_key(cat, value.lower() if cat == 'emails' else value)
+            query = ("SELECT m.email_index, s.name FROM entities e"
+                     " JOIN mentions m ON m.entity_id = e.entity_id"
+                     " JOIN sources s ON s.source_id = m.source_id"
+                     " WHERE e.category = ? AND e.key = ? ORDER BY m.email_index, s.name")
+            for email_index, source in self.conn.execute(query, (cat, key)):
+                found.setdefault(email_index, []).append(source)
+        return found
+
+    def entities_of(self, email_index, source):
+        """{categoria: [entità]} di un'email secondo una sorgente."""
+        query = ("SELECT e.category, e.text FROM mentions m JOIN entities e ON e.entity_id = m.entity_id"
+                 " JOIN sources s ON s.source_id = m.source_id"
+                 " WHERE s.name = ? AND m.email_index = ? ORDER BY e.category, e.text")
+        result = {category: [] for category in CATEGORIES}
+        for category, text in self.conn.execute(query, (source, email_index)):
+            result[category].append(text)
+        return result
+
+    def only_in(self, source_a, source_b, category=None):
+        """(email_index, categoria, entità) trovate da A e non da B, sulle email elaborate da entrambe."""
+        query = ("SELECT m.email_index, e.category, e.text FROM mentions m"
+                 " JOIN entities e ON e.entity_id = m.entity_id"
+                 " JOIN emails c ON c.source_id = :b AND c.email_index = m.email_index"
+                 " WHERE m.source_id = :a AND (:category IS NULL OR e.category = :category)"
+                 " AND NOT EXISTS (SELECT 1 FROM mentions n WHERE n.source_id = :b"
+                 "                 AND n.email_index = m.email_index AND n.entity_id = m.entity_id)"
+                 " ORDER BY m.email_index, e.category, e.text")
+        params = {'a': self._lookup_source(source_a), 'b': self._lookup_source(source_b), 'category': category}
+        return self.conn.execute(query, params).fetchall()
+
+    def discrepancies(self, source_a, source_b, category=None):
+        """(email_index, categoria, entità, trovata da A, trovata da B) per le entità di una sola sorgente."""
+        rows = [(idx, cat, text, True, False) for idx, cat, text in self.only_in(source_a, source_b, category)]
+        rows += [(idx, cat, text, False, True) for idx, cat, text in self.only_in(source_b, source_a, category)]
+        rows.sort(key=lambda row: row[0])
+        return rows
+
+    def summary(self):
+        query = ("SELECT s.name, (SELECT COUNT(*) FROM emails c WHERE c.source_id = s.source_id),"
+                 " (SELECT COUNT(*) FROM mentions m WHERE m.source_id = s.source_id) FROM sources s ORDER BY s.name")
+        entities = self.conn.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+        return entities, self.conn.execute(query).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archivio SQLite delle entità estratte, con interrogazioni per entità e per sorgente.")
+    parser.add_argument('--store', default=STORE_FILE)
+    commands = parser.add_subparsers(dest='command', required=True)
+    load = commands.add_parser('import', help="Importa file di risultati (default: riferimento umano e sistemi di evaluate_systems.py)")
+    load.add_argument('sources', nargs='*', metavar='NOME=FILE')
+    mentions = commands.add_parser('mentions', help="Email che citano un'entità")
+    mentions.add_argument('value')
+    mentions.add_argument('--category', choices=CATEGORIES)
+    diff = commands.add_parser('diff', help="Entità trovate da A ma non da B")
+    diff.add_argument('source_a')
+    diff.add_argument('source_b')
+    diff.add_argument('--category', choices=CATEGORIES)
+    args = parser.parse_args(argv)
+
+    store = EntityStore(args.store)
+    try:
+        if args.command == 'import':
+            sources = dict(value.partition('=')[::2] for value in args.sources)
+            if not sources:
+                sources = dict(SYSTEM_FILES, human=REFERENCE_FILE)
+            for name, path in sources.items():
+                try:
+                    print(f"{name}: {store.import_jsonl(name, path)} email da {path}")
+                except (FileNotFoundError, ValueError) as e:
+                    print(f"{name}: non importato ({e})")
+            entities, per_source = store.summary()
+            print(f"{entities} entità distinte; " + ", ".join(f"{name} {n} menzioni su {emails} email"
+                                                          for name, emails, n in per_source))
+        elif args.command == 'mentions':
+            found = store.emails_mentioning(args.value, args.category)
+            for email_index, sources in found.items():
+                print(f"Mail #{email_index}: {', '.join(sources)}")
+            print(f"{len(found)} email")
+        else:
+            try:
+                rows = store.only_in(args.source_a, args.source_b, args.category)
+            except ValueError as e:
+                print(f"Errore: {e}")
+                return 1
+            for email_index, category, text in rows:
+                print(f"Mail #{email_index} [{category}]: {text}")
+            print(f"{len(rows)} entità trovate da {args.source_a} e non da {args.source_b}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import sys
+import json
+import argparse
+from entity_keys import ENTITY_KEYS
+from entity_matching import key_counts, match_counts, strict_metrics_from_counts
+
+# Valutazione di più sistemi rispetto a un riferimento, con join su email_index.
+# Tutti i file sono letti in streaming e in parallelo (merge ordinato): la memoria
+# resta costante qualunque sia il numero di email. I file devono essere ordinati per
+# email_index, come li scrivono tutti gli estrattori.
+#
+# Casi gestiti esplicitamente:
+# - righe consecutive con lo stesso indice (i chunk di pii_analysis_results_llama.jsonl):
+#   le entità vengono unite e deduplicate come in EntityMerger;
+# - email del riferimento assenti dal sistema: contate come "mancanti" e, secondo
+#   MISSING_POLICY, valutate come predizione vuota ("empty") o escluse ("skip");
+# - email del sistema assenti dal riferimento: contate come "extra" e ignorate.
+
+REFERENCE_FILE = 'pii_analysis_result_human.jsonl'
+SYSTEM_FILES = {
+    'regex': 'pii_analysis_results_regex.jsonl',
+    'presidio': 'pii_analysis_results_presidio.jsonl',
+    'llama_cleaned': 'pii_analysis_results_llama_cleaned.jsonl',
+    'gemini': 'gemini_with_index_modified.jsonl',
+}
+CATEGORIES = ["names", "emails", "phones"]
+MISSING_POLICY = "empty"   # "empty" o "skip"
+
+
+def _merge_entries(entries):
+    """Un'unica riga con le entità uniche di tutte le righe con lo stesso indice."""
+    if len(entries) == 1:
+        return entries[0]
+    merged = {'email_index': entries[0]['email_index']}
+    for cat in CATEGORIES:
+        key_fn = ENTITY_KEYS[cat]
+        seen = {}
+        for entry in entries:
+            values = entry.get(cat)
+            if not isinstance(values, list):
+                continue
+            for item in values:
+                val = str(item).strip()
+                if val:
+                    seen.setdefault(key_fn(val.lower() if cat == 'emails' else val), val)
+        merged[cat] = list(seen.values())
+    return merged
+
+
+def iter_grouped(path):
+    """(email_index, riga unita, numero di righe) per ogni indice del file, in ordine crescente."""
+    with open(path, 'r', encoding='utf-8') as f:
+        current = None
+        group = []
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            idx = entry['email_index']
+            if current is not None and idx < current:
+                raise ValueError(f"{path}:{line_no}: email_index {idx} dopo {current}, file non ordinato")
+            if idx != current and group:
+                yield current, _merge_entries(group), len(group)
+                group = []
+            current = idx
+            group.append(entry)
+        if group:
+            yield current, _merge_entries(group), len(group)
+
+
+class JoinCursor:
+    """Posizione di lettura di un file nel merge ordinato, con i contatori del join."""
+
+    def __init__(self, path):
+        self.path = path
+        self.groups = iter_grouped(path)
+        self.current = next(self.groups, None)
+        self.matched = 0
+        self.missing = 0
+        self.extra = 0
+        self.duplicated = 0
+
+    def _advance(self):
+        if self.current[2] > 1:
+            self.duplicated += 1
+        self.current = next(self.groups, None)
+
+    def take(self, idx):
+        """La riga con indice idx (None se assente), saltando gli indici minori."""
+        while self.current is not None and self.current[0] < idx:
+            self.extra += 1
+            self._advance()
+        if self.current is not None and self.current[0] == idx:
+            entry = self.current[1]
+            self.matched += 1
+            self._advance()
+            return entry
+        self.missing += 1
+        return None
+
+    def finish(self):
+        while self.current is not None:
+            self.extra += 1
+            self._advance()
+
+    def stats(self):
+        return {'matched': self.matched, 'missing': self.missing,
+                'extra': self.extra, 'duplicated': self.duplicated}
+
+
+def iter_joined(reference_path, system_paths, stats=None):
+    """(email_index, riga di riferimento, {sistema: riga o None}) per ogni email del riferimento.
+
+    Se viene passato un dizionario stats, a fine iterazione contiene i contatori del join
+    di ogni sistema (matched, missing, extra, duplicated) e del riferimento.
+    """
+    cursors = {name: JoinCursor(path) for name, path in system_paths.items()}
+    reference_rows = 0
+    reference_duplicated = 0
+    for idx, ref, n_lines in iter_grouped(reference_path):
+        reference_rows += 1
+        reference_duplicated += n_lines > 1
+        yield idx, ref, {name: cursor.take(idx) for name, cursor in cursors.items()}
+
+    for cursor in cursors.values():
+        cursor.finish()
+    if stats is not None:
+        for name, cursor in cursors.items():
+            stats[name] = cursor.stats()
+        stats['reference'] = {'matched': reference_rows, 'missing': 0,
+                              'extra': 0, 'duplicated': reference_duplicated}
+
+
+def evaluate(reference_path, system_paths, missing_policy=MISSING_POLICY):
+    """Contatori micro (tp, fp, fn) e somme macro (p, r, f1 per email) per sistema e categoria."""
+    micro = {name: {cat: [0, 0, 0] for cat in CATEGORIES} for name in system_paths}
+    macro = {name: {cat: [0.0, 0.0, 0.0] for cat in CATEGORIES} for name in system_paths}
+    evaluated = {name: 0 for name in system_paths}
+    stats = {}
+
+    for _, ref, preds in iter_joined(reference_path, system_paths, stats):
+        true_counts = {cat: key_counts(ref.get(cat) or []) for cat in CATEGORIES}
+        for name, pred in preds.items():
+            if pred is None:
+                if missing_policy == "skip":
+                    continue
+                pred = {}
+            evaluated[name] += 1
+            for cat in CATEGORIES:
+                tp, fp, fn = match_counts(key_counts(pred.get(cat) or []), true_counts[cat])
+                counts = micro[name][cat]
+                counts[0] += tp
+                counts[1] += fp
+                counts[2] += fn
+                for i, value in enumerate(strict_metrics_from_counts(tp, fp, fn)):
+                    macro[name][cat][i] += value
+
+    report = {}
+    for name in system_paths:
+        n = evaluated[name]
+        rows = {}
+        for cat in CATEGORIES:
+            rows[cat] = {
+                'micro': strict_metrics_from_counts(*micro[name][cat]),
+                'macro': tuple(v / n for v in macro[name][cat]) if n else (0.0, 0.0, 0.0),
+                'counts': tuple(micro[name][cat]),
+            }
+        # Riga complessiva: micro sui conteggi di tutte le categorie, macro come media delle categorie
+        total = [sum(micro[name][cat][i] for cat in CATEGORIES) for i in range(3)]
+        rows['all'] = {
+            'micro': strict_metrics_from_counts(*total),
+            'macro': tuple(sum(rows[cat]['macro'][i] for cat in CATEGORIES) / len(CATEGORIES) for i in range(3)),
+            'counts': tuple(total),
+        }
+        report[name] = {'emails': n, 'join': stats[name], 'metrics': rows}
+    return report, stats['reference']
+
+
+def print_report(report, reference):
+    width = 104
+    print("=" * width)
+    print(f"VALUTAZIONE SISTEMI vs RIFERIMENTO ({reference['matched']} email)")
+    print("=" * width)
+    print(f"{'Sistema':<14} | {'Categoria':<9} | {'P micro':>7} {'R micro':>7} {'F1 micro':>8} | "
+          f"{'P macro':>7} {'R macro':>7} {'F1 macro':>8} | {'TP/FP/FN':>12}")
+    print("-" * width)
+    for name, entry in report.items():
+        for cat, row in entry['metrics'].items():
+            p, r, f1 = row['micro']
+            mp, mr, mf1 = row['macro']
+            counts = "/".join(str(c) for c in row['counts'])
+            print(f"{name:<14} | {cat:<9} | {p:>7.4f} {r:>7.4f} {f1:>8.4f} | {mp:>7.4f} {mr:>7.4f} {mf1:>8.4f} | {counts:>12}")
+        join = entry['join']
+        print(f"{'':<14}   join: {join['matched']} trovate, {join['missing']} mancanti, "
+              f"{join['extra']} extra, {join['duplicated']} indici con più righe")
+        print("-" * width)
+
+
+def parse_systems(values):
+    systems = {}
+    for value in values:
+        name, sep, path = value.partition('=')
+        if not sep or not name or not path:
+            raise argparse.ArgumentTypeError(f"Sistema non valido: {value!r} (formato nome=file.jsonl)")
+        systems[name] = path
+    return systems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precision/recall/F1 di più sistemi rispetto a un riferimento, con join su email_index.")
+    parser.add_argument('--reference', default=REFERENCE_FILE)
+    parser.add_argument('--system', action='append', default=[], metavar='NOME=FILE',
+                        help="Sistema da valutare (ripetibile). Default: %s" % ", ".join(SYSTEM_FILES))
+    parser.add_argument('--missing', choices=["empty", "skip"], default=MISSING_POLICY)
+    parser.add_argument('--json', dest='json_output', help="Salva il report anche in formato JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        systems = parse_systems(args.system) if args.system else SYSTEM_FILES
+        report, reference = evaluate(args.reference, systems, args.missing)
+    except (FileNotFoundError, ValueError, argparse.ArgumentTypeError) as e:
+        print(f"Errore: {e}")
+        return 1
+
+    print_report(report, reference)
+    if args.json_output:
+        with open(args.json_output, 'w', encoding='utf-8') as f:
+            json.dump({'reference': args.reference, 'missing_policy': args.missing, 'systems': report},
+                      f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import random
+import asyncio
+from collections import deque
+import aiohttp
+import llama_analysis_new7 as llm
+from chunking import estimate_tokens
+from corpus_reader import iter_record_blocks, format_chunk_full, CORPUS_FILE
+from instrumentation import StageMetrics, metrics_path, format_summary
+from results_writer import ResultsWriter
+
+# Estrazione con un modello ospitato (API Gemini generateContent), stesso prompt di
+# llama_analysis_new7.py. Le richieste partono in parallelo con asyncio: il tempo totale
+# è limitato dalla quota (richieste e token al minuto), non dall'attesa di ogni risposta.
+# - al massimo MAX_CONCURRENCY richieste in volo;
+# - due token bucket (richieste/minuto e token/minuto) prima di ogni invio;
+# - 429 e 5xx ritentati con backoff esponenziale e jitter (o dopo Retry-After);
+# - righe scritte in ordine di email_index con results_writer.py: il resume riparte dalla prima mancante.
+#   Un'email ancora fallita dopo MAX_RETRIES tentativi non viene scritta e ferma la scrittura:
+#   l'esecuzione successiva riparte da lei invece di lasciare nel file una riga vuota segnata come fatta.
+#
+# Per le prove senza quota: python stub_llm_server.py e API_URL = "http://127.0.0.1:8000".
+
+INPUT_FILE = CORPUS_FILE
+OUTPUT_FILE = 'pii_analysis_results_gemini.jsonl'
+METRICS_FILE = metrics_path(OUTPUT_FILE)
+ENTITY_INDEX_FILE = None   # 'pii_entity_index.pickle' (entity_index.py): indice delle entità aggiornato durante la scrittura
+SAMPLE_SIZE = 100          # None per analizzare tutto il corpus
+CHUNKSIZE = 500
+
+API_URL = "https://generativelanguage.googleapis.com"
+MODEL_ID = "gemini-1.5-flash"
+API_KEY_ENV = "GEMINI_API_KEY"
+MAX_NEW_TOKENS = llm.MAX_NEW_TOKENS
+
+# Quota del progetto: i bucket si riempiono a REQUESTS_PER_MINUTE/60 e TOKENS_PER_MINUTE/60
+# al secondo e accumulano al massimo BURST_SECONDS secondi di quota inutilizzata
+REQUESTS_PER_MINUTE = 300
+TOKENS_PER_MINUTE = 1000000
+BURST_SECONDS = 5
+MAX_CONCURRENCY = 32
+MAX_PENDING = 4 * MAX_CONCURRENCY    # Risultati in attesa di essere scritti in ordine
+
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0         # Secondi; il tentativo n attende uniform(0, min(BACKOFF_MAX, BASE * 2^n))
+BACKOFF_MAX = 60.0
+REQUEST_TIMEOUT = 300
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Schema della risposta nel formato di generationConfig.responseSchema
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {field: {"type": "ARRAY", "items": {"type": "STRING"}} for field in ("names", "emails", "phones")},
+    "required": ["names", "emails", "phones"],
+}
+
+
+class TokenBucket:
+    """Token bucket asincrono: rate gettoni al secondo, al massimo capacity accumulati.
+
+    Le richieste vengono servite in ordine di arrivo (asyncio.Lock è FIFO).
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)  # Una richiesta più grande del bucket aspetta il bucket pieno
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+def per_minute_bucket(per_minute, burst_seconds=BURST_SECONDS):
+    return TokenBucket(per_minute / 60, per_minute / 60 * burst_seconds)
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full jitter: attesa casuale fino al backoff esponenziale, almeno Retry-After se indicato."""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def build_request(email_content):
+    """Corpo di generateContent con i messaggi di build_pii_messages (system + user)."""
+    system, user = llm.build_pii_messages(email_content)
+    return {
+        "systemInstruction": {"parts": [{"text": system['content']}]},
+        "contents": [{"role": "user", "parts": [{"text": user['content']}]}],
+        "generationConfig": {
+            "temperature": 0,
+            "maxOutputTokens": MAX_NEW_TOKENS,
+            "responseMimeType": "application/json",
+            "responseSchema": RESPONSE_SCHEMA,
+        },
+    }
+
+
+class GeminiClient:
+    """Richieste generateContent con concorrenza limitata, rate limiting e retry."""
+
+    def __init__(self, session, base_url=API_URL, model_id=MODEL_ID, api_key=None,
+                 max_concurrency=MAX_CONCURRENCY, max_retries=MAX_RETRIES):
+        self.session = session
+        self.url = f"{base_url.rstrip('/')}/v1beta/models/{model_id}:generateContent"
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.requests_bucket = per_minute_bucket(REQUESTS_PER_MINUTE)
+        self.tokens_bucket = per_minute_bucket(TOKENS_PER_MINUTE)
+        self.retries = 0
+
+    async def generate(self, email_index, email_content, metrics):
+        """Testo della risposta e conteggi dei token; RuntimeError dopo l'ultimo tentativo fallito."""
+        payload = build_request(email_content)
+        # Costo stimato per il bucket dei token: prompt più una risposta di lunghezza media
+        cost = estimate_tokens([json.dumps(payload)])[0] + MAX_NEW_TOKENS // 4
+        headers = {"Content-Type": "application/json",
+                   # Ignorato dall'API; lo stub lo usa per rigiocare la risposta dell'email
+                   "X-Email-Index": str(email_index)}
+        if self.api_key:
+            headers["x-goog-api-key"] = self.api_key
+
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                with metrics.phase('queue', email_index):
+                    await self.requests_bucket.acquire()
+                    await self.tokens_bucket.acquire(cost)
+
+                retry_after = None
+                with metrics.phase('generate', email_index):
+                    try:
+                        async with self.session.post(self.url, json=payload, headers=headers) as response:
+                            if response.status == 200:
+                                data = await response.json()
+                                return _parse_response(data)
+                            body = await response.text()
+                            error = f"HTTP {response.status}: {body[:200]}"
+                            if response.status not in RETRY_STATUS:
+                                raise RuntimeError(error)
+                            retry_after = _retry_after(response)
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        error = f"{type(e).__name__}: {e}"
+
+                if attempt == self.max_retries:
+                    raise RuntimeError(f"{error} (dopo {attempt + 1} tentativi)")
+                self.retries += 1
+                metrics.count(email_index, retries=1)
+                with metrics.phase('backoff', email_index):
+                    await asyncio.sleep(backoff_delay(attempt, retry_after))
+
+
+def _parse_response(data):
+    candidates = data.get('candidates') or []
+    parts = (candidates[0].get('content') or {}).get('parts', []) if candidates else []
+    usage = data.get('usageMetadata') or {}
+    return ''.join(part.get('text', '') for part in parts), usage
+
+
+async def analyze_email(client, email_index, email_content, metrics):
+    """Riga di risultato dell'email; RuntimeError se la richiesta fallisce dopo tutti i tentativi."""
+    start_time = time.time()
+    content, usage = await client.generate(email_index, email_content, metrics)
+    metrics.count(email_index, tokens_in=usage.get('promptTokenCount', 0),
+                  tokens_out=usage.get('candidatesTokenCount', 0))
+    with metrics.phase('parse', email_index):
+        return llm.extract_robust_json_keep_all(content, email_index, round(time.time() - start_time, 2))
+
+
+async def run(client, record_blocks, writer, metrics, max_pending=MAX_PENDING):
+    """Avvia le richieste in ordine di lettura e scrive i risultati in ordine di email_index.
+
+    Restituisce (email scritte, None) oppure (email scritte, (email_index, errore)) se un'email
+    è fallita: da lì in poi non si scrive più niente e le richieste in volo vengono annullate.
+    """
+    pending = deque()
+    written = 0
+    failed = None
+
+    async def write_next():
+        nonlocal written, failed
+        email_index, task = pending.popleft()
+        try:
+            row = await task
+        except RuntimeError as e:
+            failed = (email_index, str(e))
+            return
+        with metrics.phase('write', email_index):
+            writer.commit(email_index, [row])
+        metrics.finish(email_index)
+        written += 1
+
+    try:
+        while failed is None:
+            # Lettura del blocco in un thread: il loop continua a servire le richieste in volo
+            block = await asyncio.to_thread(next, record_blocks, None)
+            if block is None:
+                break
+            for email_index, text in block:
+                while len(pending) >= max_pending and failed is None:
+                    await write_next()
+                if failed is not None:
+                    break
+                pending.append((email_index, asyncio.create_task(analyze_email(client, email_index, text, metrics))))
+                while pending and pending[0][1].done() and failed is None:
+                    await write_next()
+            print(f"Email lette fino a {block[-1][0]}: {written} scritte, {client.retries} tentativi ripetuti")
+
+        while pending and failed is None:
+            await write_next()
+    finally:
+        # Risultati successivi all'email fallita, o qualunque eccezione (anche KeyboardInterrupt o
+        # un errore di scrittura): le richieste in volo vengono annullate e attese, mai abbandonate
+        for _, task in pending:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+    return written, failed
+
+
+async def main_async(base_url=API_URL, api_key=None, input_file=INPUT_FILE, output_file=OUTPUT_FILE,
+                     limit=SAMPLE_SIZE):
+    writer = ResultsWriter(output_file, index_file=ENTITY_INDEX_FILE, index_source='gemini')
+    start_index = writer.start_index
+    print(f"Inizio elaborazione da indice {start_index} ({MODEL_ID}, {MAX_CONCURRENCY} richieste in volo, "
+          f"{REQUESTS_PER_MINUTE} richieste/min)...")
+    metrics = StageMetrics("gemini", metrics_path(output_file), append=start_index > 0)
+    record_blocks = iter_record_blocks(input_file, format_chunk_full, chunksize=CHUNKSIZE,
+                                       start_index=start_index, limit=limit, metrics=metrics)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENCY)
+    try:
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            client = GeminiClient(session, base_url, MODEL_ID, api_key)
+            written, failed = await run(client, record_blocks, writer, metrics)
+    finally:
+        writer.close()
+        summary = metrics.close()
+    if failed is not None:
+        print(f"Interrotto all'email {failed[0]}: {failed[1]}")
+        print(f"{written} email scritte; la prossima esecuzione riparte dall'indice {writer.start_index}.")
+    else:
+        print(f"Completato: {written} email, {client.retries} tentativi ripetuti. Risultati in: {output_file}")
+    print(format_summary(summary))
+    return summary
+
+
+def main():
+    api_key = os.environ.get(API_KEY_ENV)
+    if not api_key and API_URL.startswith("https://"):
+        print(f"Errore: impostare la chiave API in {API_KEY_ENV}.")
+        return
+    try:
+        asyncio.run(main_async(API_URL, api_key))
+    except FileNotFoundError:
+        print(f"Errore: Il file {INPUT_FILE} non esiste.")
+
+
+if __name__ == "__main__":
+    main()
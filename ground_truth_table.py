@@ -1,13 +1,6 @@
-import json
 import matplotlib.pyplot as plt
+from evaluate_systems import iter_joined
 
-def load_jsonl(file_path):
-    data = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip():
-                data.append(json.loads(line))
-    return data
 
 def are_entities_equal(ent1, ent2):
     w1 = set(str(ent1).lower().strip().split())
@@ -15,9 +8,11 @@ def are_entities_equal(ent1, ent2):
     return w1 == w2 and len(w1) > 0
 
 # Caricamento dati
+# Coppie unite per email_index (non per posizione nel file)
 try:
-    gemini_data = load_jsonl('pii_analysis_result_gemini.jsonl')
-    human_data = load_jsonl('pii_analysis_result_human.jsonl')
+    pairs = [(idx, preds['gemini'] or {}, h)
+             for idx, h, preds in iter_joined('pii_analysis_result_human.jsonl',
+                                              {'gemini': 'pii_analysis_result_gemini.jsonl'})]
 except FileNotFoundError:
     print("Errore: File .jsonl non trovati.")
     exit()
@@ -26,7 +21,7 @@ except FileNotFoundError:
 discrepancy_rows = []
 categories = ["names", "emails", "phones"]
 
-for i, (g, h) in enumerate(zip(gemini_data, human_data)):
+for i, g, h in pairs:
     g_piis = []
     for cat in categories: g_piis.extend(g.get(cat, []))
     
@@ -0,0 +1,147 @@
+import time
+import pandas as pd
+from chunking import estimate_tokens
+from entity_keys import ENTITY_KEYS
+from corpus_reader import iter_corpus_chunks, CORPUS_FILE
+from regex_analysis import EMAIL_PATTERN
+from name_gazetteer import DISPLAY_NAME_PATTERN, HEADER_FIELDS, name_from_address
+from results_writer import iter_groups
+
+# Estrazione deterministica dalle intestazioni from/to/cc/bcc. Sono campi strutturati (indirizzi
+# e nomi visualizzati) e con le liste di destinatari lunghe occupano buona parte dei token del prompt.
+# Il parser le legge con le operazioni vettoriali di pandas (str.cat, str.extractall) su tutto
+# il blocco; al modello (LLM o Presidio) arrivano solo CONTENT_FIELDS, e merge() unisce le
+# entità delle intestazioni alle righe di risultato.
+#
+# Uso negli estrattori: formatter = headers.formatter(format_chunk_full), poi rows = headers.merge(rows).
+
+INPUT_FILE = CORPUS_FILE
+CHUNKSIZE = 5000
+CONTENT_FIELDS = ['subject', 'body']     # Unici campi inviati al modello
+NAMES_FROM_ADDRESSES = False   # True: sara.shackleton@... aggiunge anche il nome "Sara Shackleton"
+
+ADDRESS_PATTERN = f'({EMAIL_PATTERN})'
+LAST_FIRST_PATTERN = r'^\s*([^,]+?)\s*,\s*(.+?)\s*$'
+
+
+def header_text(chunk, fields=HEADER_FIELDS):
+    """Intestazioni di ogni email concatenate in una sola stringa, indicizzate per email_index."""
+    columns = [chunk[col].fillna('').astype(str) for col in fields if col in chunk.columns]
+    if not columns:
+        return pd.Series('', index=chunk['email_index'].values)
+    text = columns[0].str.cat(columns[1:], sep=' ') if len(columns) > 1 else columns[0]
+    return pd.Series(text.values, index=chunk['email_index'].values)
+
+
+def _grouped(matches):
+    """{email_index: [valori distinti nell'ordine di comparsa]} dai match di extractall."""
+    if matches.empty:
+        return {}
+    frame = matches.reset_index(level=1, drop=True).rename('value').reset_index().drop_duplicates()
+    return frame.groupby('index', sort=False)['value'].agg(list).to_dict()
+
+
+def parse_headers(chunk, names_from_addresses=NAMES_FROM_ADDRESSES):
+    """{email_index: {'names': [...], 'emails': [...]}} per tutte le email del blocco."""
+    text = header_text(chunk)
+    text.index.name = 'index'
+    addresses = text.str.extractall(ADDRESS_PATTERN)[0].str.lower()
+    displays = text.str.extractall(DISPLAY_NAME_PATTERN.pattern)[0].str.replace(LAST_FIRST_PATTERN, r'\2 \1', regex=True)
+    if names_from_addresses and not addresses.empty:
+        # Una chiamata per indirizzo distinto: gli stessi mittenti si ripetono in tutto il blocco
+        names = addresses.map({a: name_from_address(a) for a in addresses.unique()}).dropna()
+        displays = pd.concat([displays, names]).sort_index(level=0, kind='stable')
+
+    emails = _grouped(addresses)
+    names = _grouped(displays)
+    parsed = {}
+    for idx in text.index:
+        found = {'names': [], 'emails': emails.get(idx, [])}
+        seen = set()
+        for name in names.get(idx, []):
+            key = ENTITY_KEYS['names'](name)
+            if key not in seen:
+                seen.add(key)
+                found['names'].append(name)
+        parsed[idx] = found
+    return parsed
+
+
+class HeaderFastPath:
+    """Entità delle intestazioni estratte dal parser; il modello riceve solo oggetto e body.
+
+    formatter() registra le entità di ogni blocco letto; merge() le aggiunge all'ultima riga
+    di ogni email (righe in ordine di email_index, come ThreadIndex.resolve).
+    """
+
+    def __init__(self, count_tokens=estimate_tokens, names_from_addresses=NAMES_FROM_ADDRESSES):
+        self.count_tokens = count_tokens
+        self.names_from_addresses = names_from_addresses
+        self.pending = {}       # {email_index: entità delle intestazioni} in attesa delle righe
+        self.emails = 0
+        self.entities = 0
+        self.tokens_saved = 0
+
+    def formatter(self, base_formatter, fields=CONTENT_FIELDS):
+        """Formatter per iter_record_blocks: base_formatter applicato alle sole colonne fields."""
+        def format_content(chunk):
+            self.pending.update(parse_headers(chunk, self.names_from_addresses))
+            headers = header_text(chunk)
+            self.emails += len(headers)
+            self.tokens_saved += sum(self.count_tokens([t for t in headers.tolist() if t.strip()]))
+            columns = ['email_index'] + [col for col in fields if col in chunk.columns]
+            return base_formatter(chunk[columns])
+        return format_content
+
+    def _complete(self, email_index, rows):
+        found = self.pending.pop(email_index, None)
+        if not found or not rows:
+            return
+        last = rows[-1]
+        for field, values in found.items():
+            key_fn = ENTITY_KEYS[field]
+            merged = list(last.get(field) or [])
+            keys = {key_fn(str(v).strip()) for v in merged}
+            for value in values:
+                if key_fn(value) not in keys:
+                    keys.add(key_fn(value))
+                    merged.append(value)
+                    self.entities += 1
+            last[field] = merged
+
+    def merge(self, rows):
+        """Righe di risultato in ordine di email_index, con le entità delle intestazioni."""
+        for email_index, group in iter_groups(rows):
+            self._complete(email_index, group)
+            yield from group
+
+    def report(self):
+        return (f"Intestazioni: {self.entities} entità aggiunte dal parser in {self.emails} email; "
+                f"token non inviati al modello {self.tokens_saved}")
+
+
+def main():
+    print(f"Analisi delle intestazioni {', '.join(HEADER_FIELDS)} in {INPUT_FILE}...")
+    start_time = time.time()
+    emails = addresses = names = header_tokens = content_tokens = 0
+    try:
+        for chunk in iter_corpus_chunks(INPUT_FILE, columns=HEADER_FIELDS + CONTENT_FIELDS, chunksize=CHUNKSIZE):
+            for found in parse_headers(chunk).values():
+                addresses += len(found['emails'])
+                names += len(found['names'])
+            emails += len(chunk)
+            header_tokens += sum(estimate_tokens(header_text(chunk).tolist()))
+            content = header_text(chunk, CONTENT_FIELDS)
+            content_tokens += sum(estimate_tokens(content.tolist()))
+    except FileNotFoundError:
+        print(f"Errore: Il file {INPUT_FILE} non esiste.")
+        return
+    share = 100 * header_tokens / max(header_tokens + content_tokens, 1)
+    print(f"Completato in {time.time() - start_time:.2f}s: {emails} email, {addresses} indirizzi e "
+          f"{names} nomi dalle intestazioni.")
+    print(f"Token stimati delle intestazioni: {header_tokens} ({share:.1f}% del testo, "
+          f"{estimate_tokens.__name__})")
+
+
+if __name__ == "__main__":
+    main()
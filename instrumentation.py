@@ -0,0 +1,170 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+
+# Misure per fase comuni a tutti gli estrattori (regex, Presidio, LLM).
+# Il campo "seconds" dei file di risultati misura cose diverse per ogni motore;
+# qui ogni email riceve i tempi delle stesse fasi, presi con perf_counter_ns
+# (monotono, risoluzione al nanosecondo), più i contatori come i token del LLM.
+# Le righe vanno in un file side-car <output>.metrics.jsonl, chiuso da una riga
+# "summary" con media e percentili p50/p95/p99 di ogni fase.
+#
+# Fasi usate: load (lettura del corpus), format (testo da analizzare), tokenize,
+# prefill, decode, generate (richiesta HTTP, prefill e decode lato server),
+# extract (match regex / analisi Presidio), parse (risposta -> entità), write.
+# Le fasi eseguite su un blocco o un batch vengono ripartite tra le sue email.
+
+PERCENTILES = (50, 95, 99)
+
+
+def metrics_path(output_file):
+    """File side-car delle metriche accanto al file di risultati."""
+    base, _ = os.path.splitext(output_file)
+    return base + ".metrics.jsonl"
+
+
+def percentile(sorted_values, q):
+    """Percentile q (0-100) con il metodo nearest-rank su valori già ordinati."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-q * len(sorted_values) // 100))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _ms(ns):
+    return round(ns / 1e6, 4)
+
+
+def _distribution(values):
+    values = sorted(values)
+    summary = {'count': len(values), 'mean': round(sum(values) / len(values), 4) if values else 0.0}
+    for q in PERCENTILES:
+        summary[f'p{q}'] = round(percentile(values, q), 4)
+    summary['max'] = values[-1] if values else 0.0
+    return summary
+
+
+class StageMetrics:
+    """Tempi per fase e contatori di ogni email, scritti nel side-car quando l'email è completa."""
+
+    def __init__(self, engine, path=None, append=False):
+        self.engine = engine
+        self.path = path
+        self.file = open(path, 'a' if append else 'w', encoding='utf-8') if path else None
+        self.pending = {}
+        self.phase_samples = {}
+        self.counter_samples = {}
+        self.total_samples = []
+        self.started_ns = time.perf_counter_ns()
+
+    def _record(self, email_index):
+        record = self.pending.get(email_index)
+        if record is None:
+            record = self.pending[email_index] = {'phases': {}, 'counters': {}}
+        return record
+
+    def add(self, email_index, phase, ns):
+        phases = self._record(email_index)['phases']
+        phases[phase] = phases.get(phase, 0) + ns
+
+    def add_shared(self, email_indexes, phase, ns):
+        """Tempo di un blocco o batch diviso in parti uguali tra i suoi elementi
+        (un'email con più chunk nello stesso batch riceve una quota per chunk)."""
+        if not email_indexes:
+            return
+        share = ns / len(email_indexes)
+        for email_index in email_indexes:
+            self.add(email_index, phase, share)
+
+    def count(self, email_index, **counters):
+        totals = self._record(email_index)['counters']
+        for name, value in counters.items():
+            totals[name] = totals.get(name, 0) + value
+
+    @contextmanager
+    def phase(self, phase, email_indexes):
+        """Misura il blocco with e lo attribuisce a un'email (int) o ripartito su una lista."""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            if isinstance(email_indexes, int):
+                self.add(email_indexes, phase, elapsed)
+            else:
+                self.add_shared(list(email_indexes), phase, elapsed)
+
+    def finish(self, email_index):
+        """Chiude l'email: la riga con i tempi in millisecondi va nel side-car."""
+        record = self.pending.pop(email_index, None)
+        if record is None:
+            return None
+        phases_ms = {phase: _ms(ns) for phase, ns in record['phases'].items()}
+        total_ms = _ms(sum(record['phases'].values()))
+
+        for phase, value in phases_ms.items():
+            self.phase_samples.setdefault(phase, []).append(value)
+        for name, value in record['counters'].items():
+            self.counter_samples.setdefault(name, []).append(value)
+        self.total_samples.append(total_ms)
+
+        line = {'engine': self.engine, 'email_index': email_index, 'total_ms': total_ms, 'phases_ms': phases_ms}
+        line.update(record['counters'])
+        if self.file is not None:
+            self.file.write(json.dumps(line) + "\n")
+        return line
+
+    def summary(self):
+        wall_s = (time.perf_counter_ns() - self.started_ns) / 1e9
+        emails = len(self.total_samples)
+        return {
+            'engine': self.engine,
+            'emails': emails,
+            'wall_seconds': round(wall_s, 4),
+            'emails_per_second': round(emails / wall_s, 2) if wall_s > 0 else 0.0,
+            'total_ms': _distribution(self.total_samples),
+            'phases_ms': {phase: _distribution(values) for phase, values in self.phase_samples.items()},
+            'counters': {name: dict(_distribution(values), sum=sum(values))
+                         for name, values in self.counter_samples.items()},
+        }
+
+    def close(self):
+        """Scrive la riga di riepilogo e chiude il side-car; restituisce il riepilogo."""
+        summary = self.summary()
+        if self.file is not None:
+            self.file.write(json.dumps({'summary': summary}) + "\n")
+            self.file.close()
+            self.file = None
+        return summary
+
+
+def format_summary(summary):
+    """Tabella testuale del riepilogo (ms per email)."""
+    lines = [
+        f"Metriche {summary['engine']}: {summary['emails']} email in {summary['wall_seconds']:.2f}s "
+        f"({summary['emails_per_second']:.1f} email/s)",
+        f"{'Fase':<10} | {'media':>9} | {'p50':>9} | {'p95':>9} | {'p99':>9}   (ms per email)",
+    ]
+    rows = list(summary['phases_ms'].items()) + [('totale', summary['total_ms'])]
+    for phase, dist in rows:
+        lines.append(f"{phase:<10} | {dist['mean']:>9.4f} | {dist['p50']:>9.4f} | {dist['p95']:>9.4f} | {dist['p99']:>9.4f}")
+    for name, dist in summary['counters'].items():
+        lines.append(f"{name:<10} | {dist['mean']:>9.1f} | {dist['p50']:>9} | {dist['p95']:>9} | {dist['p99']:>9}   (totale {dist['sum']})")
+    return "\n".join(lines)
+
+
+class FirstTokenTimer:
+    """LogitsProcessor che non modifica i logits: registra solo l'istante della prima chiamata.
+
+    generate() lo chiama la prima volta subito dopo il forward del prompt, quindi separa
+    il prefill (fino alla prima chiamata) dal decode (da lì alla fine della generazione).
+    """
+
+    def __init__(self):
+        self.first_ns = None
+
+    def __call__(self, input_ids, scores):
+        if self.first_ns is None:
+            self.first_ns = time.perf_counter_ns()
+        return scores
@@ -0,0 +1,193 @@
+import json
+
+# Decodifica vincolata per lo schema {"names": [...], "emails": [...], "phones": [...]}.
+# Un piccolo automa a caratteri accetta solo prefissi validi di quell'oggetto JSON:
+# il LogitsProcessor lascia al modello solo i token che lo mantengono valido e,
+# appena l'oggetto viene chiuso, ammette soltanto il token di fine generazione.
+
+PII_FIELDS = ("names", "emails", "phones")
+
+PII_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {field: {"type": "array", "items": {"type": "string"}} for field in PII_FIELDS},
+    "required": list(PII_FIELDS),
+    "additionalProperties": False,
+}
+
+MAX_WHITESPACE_RUN = 32    # Evita che il modello resti bloccato a generare spazi e newline
+MAX_STRING_LEN = 256       # Lunghezza massima di una singola entità
+TOP_K_CANDIDATES = 32      # Token più probabili controllati prima di scorrere tutto il vocabolario
+
+WHITESPACE = " \t\n\r"
+ESCAPES = '"\\/bfnrt'
+HEX_DIGITS = '0123456789abcdefABCDEF'
+
+START = ('start', 0, 0)
+DONE = ('done', 0, 0)
+
+
+def advance(state, ch):
+    """Stato successivo dopo il carattere ch, oppure None se ch non è ammesso."""
+    mode, field, count = state
+
+    if ch in WHITESPACE and mode in ('start', 'key_open', 'colon', 'arr_open', 'arr_first',
+                                     'after_str', 'arr_next', 'after_arr'):
+        return (mode, field, count + 1) if count < MAX_WHITESPACE_RUN else None
+
+    if mode == 'start':
+        return ('key_open', 0, 0) if ch == '{' else None
+    if mode == 'key_open':
+        return ('key', field, 0) if ch == '"' else None
+    if mode == 'key':
+        expected = PII_FIELDS[field] + '"'
+        if ch != expected[count]:
+            return None
+        return ('colon', field, 0) if count + 1 == len(expected) else ('key', field, count + 1)
+    if mode == 'colon':
+        return ('arr_open', field, 0) if ch == ':' else None
+    if mode == 'arr_open':
+        return ('arr_first', field, 0) if ch == '[' else None
+    if mode in ('arr_first', 'arr_next'):
+        if ch == '"':
+            return ('str', field, 0)
+        if ch == ']' and mode == 'arr_first':
+            return ('after_arr', field, 0)
+        return None
+    if mode == 'str':
+        if ch == '"':
+            return ('after_str', field, 0)
+        if ch < ' ' or count >= MAX_STRING_LEN:
+            return None
+        return ('esc', field, count + 1) if ch == '\\' else ('str', field, count + 1)
+    if mode == 'esc':
+        if ch == 'u':
+            return ('hex4', field, count)
+        return ('str', field, count) if ch in ESCAPES else None
+    if mode.startswith('hex'):
+        # \u seguito da esattamente quattro cifre esadecimali (hexN = cifre mancanti)
+        if ch not in HEX_DIGITS:
+            return None
+        remaining = int(mode[3:]) - 1
+        return ('str', field, count) if remaining == 0 else (f'hex{remaining}', field, count)
+    if mode == 'after_str':
+        if ch == ',':
+            return ('arr_next', field, 0)
+        return ('after_arr', field, 0) if ch == ']' else None
+    if mode == 'after_arr':
+        if ch == ',' and field < len(PII_FIELDS) - 1:
+            return ('key_open', field + 1, 0)
+        if ch == '}' and field == len(PII_FIELDS) - 1:
+            return DONE
+        return None
+    return None
+
+
+def advance_text(state, text):
+    for ch in text:
+        state = advance(state, ch)
+        if state is None:
+            return None
+    return state
+
+
+def completion_suffix(state):
+    """Testo minimo che chiude un oggetto troncato (es. per max_new_tokens) rendendolo JSON valido."""
+    mode, field, count = state
+    if mode == 'done':
+        return ''
+    if mode == 'start':
+        return '{' + completion_suffix(('key_open', 0, 0))
+    if mode == 'key_open':
+        return '"' + completion_suffix(('key', field, 0))
+    if mode == 'key':
+        return (PII_FIELDS[field] + '"')[count:] + completion_suffix(('colon', field, 0))
+    if mode == 'colon':
+        return ':' + completion_suffix(('arr_open', field, 0))
+    if mode == 'arr_open':
+        return '[' + completion_suffix(('arr_first', field, 0))
+    if mode in ('arr_first', 'after_str'):
+        return ']' + completion_suffix(('after_arr', field, 0))
+    if mode == 'arr_next':
+        return '""' + completion_suffix(('after_str', field, 0))
+    if mode == 'str':
+        return '"' + completion_suffix(('after_str', field, 0))
+    if mode == 'esc':
+        return '"' + completion_suffix(('str', field, count))
+    if mode.startswith('hex'):
+        return '0' * int(mode[3:]) + completion_suffix(('str', field, count))
+    # after_arr
+    if field < len(PII_FIELDS) - 1:
+        return ',' + completion_suffix(('key_open', field + 1, 0))
+    return '}'
+
+
+def parse_constrained(response):
+    """Parsa una risposta generata sotto vincolo; se troncata la chiude. Restituisce (dict, troncata) o None."""
+    response = response.strip()
+    state = advance_text(START, response)
+    if state is None:
+        return None
+    truncated = state != DONE
+    try:
+        return json.loads(response + completion_suffix(state)), truncated
+    except ValueError:
+        return None
+
+
+def build_token_texts(tokenizer, vocab_size=None):
+    """Testo di ogni token del vocabolario; None per i token speciali, che non possono far parte del JSON.
+
+    vocab_size è la larghezza dei logits (model.config.vocab_size), che può superare len(tokenizer)
+    per il padding della matrice degli embedding: gli id oltre il tokenizer restano None.
+    """
+    special_ids = set(tokenizer.all_special_ids) | set(getattr(tokenizer, 'added_tokens_decoder', {}).keys())
+    texts = []
+    for token_id in range(max(len(tokenizer), vocab_size or 0)):
+        if token_id >= len(tokenizer) or token_id in special_ids:
+            texts.append(None)
+        else:
+            texts.append(tokenizer.decode([token_id]) or None)
+    return texts
+
+
+class PiiJsonLogitsProcessor:
+    """LogitsProcessor (interfaccia transformers) che vincola ogni riga del batch allo schema PII."""
+
+    def __init__(self, token_texts, eos_token_ids):
+        self.token_texts = token_texts
+        self.eos_token_ids = list(eos_token_ids)
+        self.states = None
+
+    def _allowed_tokens(self, state, row_scores):
+        if state == DONE:
+            return self.eos_token_ids
+
+        candidates = row_scores.topk(min(TOP_K_CANDIDATES, row_scores.shape[-1])).indices.tolist()
+        allowed = [t for t in candidates
+                   if self.token_texts[t] is not None and advance_text(state, self.token_texts[t]) is not None]
+        if allowed:
+            return allowed
+
+        # Nessuno dei token più probabili è valido: si scorre il vocabolario in ordine di punteggio
+        for t in row_scores.argsort(descending=True).tolist():
+            if self.token_texts[t] is not None and advance_text(state, self.token_texts[t]) is not None:
+                return [t]
+        return self.eos_token_ids
+
+    def __call__(self, input_ids, scores):
+        import torch
+
+        if self.states is None:
+            self.states = [START] * input_ids.shape[0]
+        else:
+            # Aggiorna lo stato di ogni riga con l'ultimo token generato
+            for row, token_id in enumerate(input_ids[:, -1].tolist()):
+                state = self.states[row]
+                if state == DONE or self.token_texts[token_id] is None:
+                    continue
+                self.states[row] = advance_text(state, self.token_texts[token_id]) or DONE
+
+        mask = torch.full_like(scores, float('-inf'))
+        for row, state in enumerate(self.states):
+            mask[row, self._allowed_tokens(state, scores[row])] = 0
+        return scores + mask
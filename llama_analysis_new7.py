@@ -1,199 +1,406 @@
-import pandas as pd
-import torch
-import json
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
-import re
-import time
-import os
-
-# --- CONFIGURAZIONE E SETUP INIZIALE ---
-FULL_ANALYSIS = False 
-SAMPLE_SIZE = 100
-OUTPUT_FILENAME = 'pii_analysis_results_new7.jsonl' 
-MODEL_ID = "meta-llama/Meta-Llama-3-8B-Instruct"
-
-# --- CARICAMENTO DEI DATI ---
-try:
-    df = pd.read_csv('campione_enron.csv')
-except FileNotFoundError:
-    print("ERRORE: File 'campione_enron.csv' non trovato.")
-    exit()
-
-if not FULL_ANALYSIS:
-    email_samples = df.head(SAMPLE_SIZE).copy()
-else:
-    email_samples = df.copy()
-
-# Definiamo i campi da includere (escludendo message_id)
-fields_to_include = ['subject', 'from', 'to', 'cc', 'bcc', 'date', 'body', 'file_name']
-
-# Creiamo il contenuto testuale includendo le etichette dei campi per dare contesto al modello
-def format_email_full(row):
-    parts = []
-    for field in fields_to_include:
-        val = str(row[field]).strip() if pd.notna(row[field]) else ""
-        if val:
-            # Formattiamo come "Campo: Valore" per aiutare il modello a orientarsi
-            parts.append(f"{field.upper()}: {val}")
-    return "\n".join(parts)
-
-# Applichiamo la formattazione
-email_texts = email_samples.apply(format_email_full, axis=1).tolist()
-
-# --- CARICAMENTO DEL MODELLO ---
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_use_double_quant=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_compute_dtype=torch.bfloat16
-)
-
-try:
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, trust_remote_code=True)
-    model = AutoModelForCausalLM.from_pretrained(
-        MODEL_ID,
-        quantization_config=bnb_config,
-        device_map="auto",
-        trust_remote_code=True
-    )
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
-    print(f"Modello {MODEL_ID} caricato.")
-except Exception as e:
-    print(f"Errore nel caricamento del modello: {e}")
-    exit()
-
-# --- FUNZIONE DI PROMPT AGGIORNATA
-def generate_pii_prompt(email_content):
-    """Generates an optimized prompt for Llama-3 to extract PII in JSON format."""
-    
-    # System Prompt:
-    system_prompt = (
-        "Extract into a valid JSON from Enron emails full names of at least two words (e.g. Name Surname), personal emails and phone numbers.\n"
-        "If a category is empty return a empty list []. Extract only entities explicitly present in the text.\n"
-        "Do not add any comments or additional text either inside or outside the JSON structure."
-    )
-
-    # Schema JSON di riferimento
-    json_schema = {
-        "names": [],
-        "emails": [],
-        "phones": []
-    }
-
-    # User Prompt
-    user_prompt = (
-        f"Analyze the following email and extract PII according to this JSON schema:\n"
-        f"{json.dumps(json_schema, indent=2)}\n\n"
-        f"### EMAIL CONTENT ###\n"
-        f"{email_content}\n"
-        f"### END EMAIL CONTENT ###\n\n"
-        f"JSON RESPONSE:"
-    )
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
-    ]
-
-    return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-
-# --- FUNZIONE DI ESTRAZIONE TOTALE (SENZA FILTRI) ---
-def extract_robust_json_keep_all(response, email_index, start_time):
-    """Estrae il JSON e mantiene TUTTI i campi presenti nella risposta originale."""
-    end_time = time.time()
-    elapsed_seconds = round(end_time - start_time, 2)
-    
-    try:
-        # 1. Estrazione del blocco JSON con regex
-        matches = re.findall(r'\{[\s\S]*?\}', response)
-        raw_output = json.loads(matches[0]) if matches else json.loads(response.strip())
-        
-        # 2. Inizializzazione con i metadati obbligatori
-        pii_data = {
-            'email_index': email_index,
-            'seconds': elapsed_seconds
-        }
-        
-        # 3. LOGICA "KEEP ALL": Copia tutto il contenuto di raw_output in pii_data
-        if isinstance(raw_output, dict):
-            pii_data.update(raw_output)
-        
-        return pii_data
-
-    except Exception as e:
-        # In caso di errore critico di parsing, restituisce comunque l'indice e l'errore
-        return {
-            'email_index': email_index,
-            'seconds': elapsed_seconds,
-            'error': f'JSON_DECODE_FAILED: {str(e)}',
-            'raw_response': response # Qui ho rimosso anche il limite [:150] per tenere tutto
-        }
-        
-# --- CICLO DI GENERAZIONE AGGIORNATO ---
-terminators = [
-    tokenizer.eos_token_id,
-    tokenizer.convert_tokens_to_ids("<|eot_id|>")
-]
-
-MAX_CHUNK_LEN = 2500 # Limite prudenziale per lasciare spazio al prompt e alla risposta
-
-with open(OUTPUT_FILENAME, 'a') as f:
-    start_index = 0
-    if os.path.exists(OUTPUT_FILENAME):
-        try:
-            with open(OUTPUT_FILENAME, 'r') as check_f:
-                lines = check_f.readlines()
-                if lines:
-                    last_data = json.loads(lines[-1].strip())
-                    start_index = last_data.get('email_index', -1) + 1
-        except:
-            start_index = 0
-
-    for i in range(start_index, len(email_samples)):
-        email_content = email_texts[i]
-        
-        # --- LOGICA DI CHUNKING ---
-        # Convertiamo in token per misurare la lunghezza reale
-        tokens = tokenizer.encode(email_content, add_special_tokens=False)
-        
-        # Dividiamo i token in pezzi da MAX_CHUNK_LEN
-        chunks = [tokens[j:j + MAX_CHUNK_LEN] for j in range(0, len(tokens), MAX_CHUNK_LEN)]
-        
-        num_chunks = len(chunks)
-        if num_chunks == 1:
-            print(f"Analizzo email {i}...")
-        else:
-            print(f"Analizzo l'email {i} chunk {chunk_idx + 1}/{num_chunks}...")
-
-        for chunk_idx, chunk_tokens in enumerate(chunks):
-            start_time = time.time()
-            chunk_text = tokenizer.decode(chunk_tokens)
-            
-            prompt = generate_pii_prompt(chunk_text) 
-            inputs = tokenizer([prompt], return_tensors="pt").to(model.device)
-
-            with torch.no_grad():
-                outputs = model.generate(
-                    **inputs,
-                    max_new_tokens=1516,
-                    eos_token_id=terminators,
-                    do_sample=False,
-                    pad_token_id=tokenizer.pad_token_id, 
-                )
-
-            response = tokenizer.decode(outputs[0][inputs['input_ids'].shape[1]:], skip_special_tokens=True)
-            
-            pii_data = extract_robust_json_keep_all(response, i, start_time)
-            # Aggiungiamo info sul chunk per chiarezza (opzionale)
-            pii_data['chunk'] = f"{chunk_idx + 1}/{len(chunks)}"
-
-            f.write(json.dumps(pii_data) + '\n')
-            f.flush() 
-            
-        if num_chunks == 1:
-            print(f"Completata email {i} in {pii_data.get('seconds')}s")
-        else:
-            print(f"Completata email {i} chunk {chunk_idx + 1}/{num_chunks} in {pii_data.get('seconds')}s")
-
-print(f"\nAnalisi completata. Risultati in: {OUTPUT_FILENAME}")
\ No newline at end of file
+import json
+import re
+import time
+import os
+from llm_backends import create_backend
+from json_constraint import parse_constrained
+from chunking import chunk_text, EntityMerger
+from corpus_reader import iter_corpus_chunks, iter_record_blocks, format_chunk_full, CORPUS_FILE
+from instrumentation import StageMetrics, metrics_path, format_summary
+from result_cache import ResultCache
+from dedup_minhash import CLUSTERS_FILE, load_clusters, iter_deduplicated
+from thread_segments import ThreadIndex, MIN_SEGMENT_CHARS, TEXT_COLUMN
+from header_parser import HeaderFastPath, CONTENT_FIELDS, NAMES_FROM_ADDRESSES
+from results_writer import ResultsWriter, iter_groups
+
+# --- CONFIGURAZIONE E SETUP INIZIALE ---
+FULL_ANALYSIS = False
+SAMPLE_SIZE = 100
+INPUT_FILENAME = CORPUS_FILE  # campione_enron.parquet se presente, altrimenti il CSV
+OUTPUT_FILENAME = 'pii_analysis_results_new7.jsonl'
+METRICS_FILENAME = metrics_path(OUTPUT_FILENAME)  # Tempi per fase e token di ogni email (instrumentation.py)
+ENTITY_INDEX_FILENAME = None   # 'pii_entity_index.pickle' (entity_index.py): indice delle entità aggiornato durante la scrittura
+MODEL_ID = "meta-llama/Meta-Llama-3-8B-Instruct"
+
+# --- BACKEND DI INFERENZA ---
+# "hf": modello caricato in questo processo; "http": server OpenAI-compatibile già avviato
+# (vLLM, llama.cpp server o stub_llm_server.py), condiviso tra più worker di estrazione
+BACKEND = "hf"
+LLM_SERVER_URL = "http://127.0.0.1:8000"
+HTTP_CONCURRENCY = 8      # Richieste in volo contemporaneamente verso il server
+
+# --- CONFIGURAZIONE BATCHING ---
+# Con BATCH_MODE = False ogni chunk viene generato da solo, nell'ordine originale (batch size 1)
+BATCH_MODE = True
+TOKEN_BUDGET = 24000      # Token massimi per batch: righe * (prompt più lungo + MAX_NEW_TOKENS)
+MAX_BATCH_SIZE = 16       # Limite al numero di prompt per batch
+EMAIL_WINDOW = 64         # Email ordinate per lunghezza insieme; i risultati sono scritti in ordine di email_index
+MAX_NEW_TOKENS = 1516     # Con CONSTRAINED_DECODING la generazione si ferma appena l'oggetto JSON è chiuso
+MAX_CHUNK_LEN = 2500 # Limite prudenziale per lasciare spazio al prompt e alla risposta
+CHUNK_OVERLAP = 200  # Token condivisi tra chunk consecutivi (righe/frasi intere)
+# Formato dell'output. Con i default (tutto False) è quello originale, letto da clean_jsonl_llama.py:
+# una riga per chunk ("chunk": "i/n"), entità estratte dal modello su tutto il testo dell'email.
+# MERGE_CHUNKS: una sola riga per email, entità deduplicate tra i chunk, senza il campo "chunk"
+MERGE_CHUNKS = False
+
+# Riutilizzo dei past-key-values del prefisso fisso del prompt (system prompt + schema JSON)
+PREFIX_CACHE = True
+EMAIL_PLACEHOLDER = "\x00EMAIL_CONTENT\x00"
+
+# Decodifica vincolata allo schema {names, emails, phones}: niente più risposte da riparare
+# con clean_jsonl_llama.py
+CONSTRAINED_DECODING = True
+
+# Cache dei risultati per contenuto (result_cache.py): le email duplicate e quelle già analizzate
+# in un'altra esecuzione non vengono rigenerate. PROMPT_VERSION va cambiata a ogni modifica del prompt.
+USE_CACHE = True
+PROMPT_VERSION = "new7"
+
+# Cluster di quasi-duplicati (dedup_minhash.py): i membri il cui testo è già tutto nel rappresentante
+# ricevono le sue entità senza generazione. Solo con MERGE_CHUNKS (una riga per email). None per disattivare.
+DEDUP_CLUSTERS_FILE = CLUSTERS_FILE
+
+# Ricostruzione dei thread (thread_segments.py): i messaggi quotati o inoltrati già analizzati in
+# un'email precedente vengono tolti dal body e le loro entità copiate nella riga dell'email.
+# Stesso formato più il campo reused_segments; il contenuto dipende dalle email lette prima
+THREAD_SEGMENTS = False
+
+# Intestazioni from/to/cc/bcc lette dal parser deterministico (header_parser.py): al modello
+# arrivano solo oggetto e body, gli indirizzi e i nomi delle intestazioni sono uniti all'ultima
+# riga di ogni email. Stesso formato, ma le entità delle intestazioni vengono dal parser
+HEADER_FAST_PATH = False
+
+# --- FUNZIONE DI PROMPT AGGIORNATA
+def build_pii_messages(email_content):
+    """Builds the chat messages asking Llama-3 to extract PII in JSON format."""
+
+    # System Prompt:
+    system_prompt = (
+        "Extract into a valid JSON from Enron emails full names of at least two words (e.g. Name Surname), personal emails and phone numbers.\n"
+        "If a category is empty return a empty list []. Extract only entities explicitly present in the text.\n"
+        "Do not add any comments or additional text either inside or outside the JSON structure."
+    )
+
+    # Schema JSON di riferimento
+    json_schema = {
+        "names": [],
+        "emails": [],
+        "phones": []
+    }
+
+    # User Prompt
+    user_prompt = (
+        f"Analyze the following email and extract PII according to this JSON schema:\n"
+        f"{json.dumps(json_schema, indent=2)}\n\n"
+        f"### EMAIL CONTENT ###\n"
+        f"{email_content}\n"
+        f"### END EMAIL CONTENT ###\n\n"
+        f"JSON RESPONSE:"
+    )
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def build_prompt_prefix(tokenizer):
+    """Testo e token della parte del prompt che precede il contenuto dell'email, uguale per ogni chunk."""
+    prompt = tokenizer.apply_chat_template(build_pii_messages(EMAIL_PLACEHOLDER), tokenize=False, add_generation_prompt=True)
+    prefix_text = prompt[:prompt.index(EMAIL_PLACEHOLDER)]
+    return prefix_text, tokenizer.encode(prefix_text, add_special_tokens=False)
+
+# --- FUNZIONE DI ESTRAZIONE TOTALE (SENZA FILTRI) ---
+def extract_robust_json_keep_all(response, email_index, elapsed_seconds):
+    """Estrae il JSON e mantiene TUTTI i campi presenti nella risposta originale."""
+
+    # 0. Risposta generata con decodifica vincolata: JSON valido (eventualmente chiuso se troncato)
+    constrained = parse_constrained(response)
+    if constrained is not None:
+        raw_output, truncated = constrained
+        pii_data = {
+            'email_index': email_index,
+            'seconds': elapsed_seconds
+        }
+        pii_data.update(raw_output)
+        if truncated:
+            pii_data['truncated'] = True
+        return pii_data
+
+    try:
+        # 1. Estrazione del blocco JSON con regex
+        matches = re.findall(r'\{[\s\S]*?\}', response)
+        raw_output = json.loads(matches[0]) if matches else json.loads(response.strip())
+
+        # 2. Inizializzazione con i metadati obbligatori
+        pii_data = {
+            'email_index': email_index,
+            'seconds': elapsed_seconds
+        }
+
+        # 3. LOGICA "KEEP ALL": Copia tutto il contenuto di raw_output in pii_data
+        if isinstance(raw_output, dict):
+            pii_data.update(raw_output)
+
+        return pii_data
+
+    except Exception as e:
+        # In caso di errore critico di parsing, restituisce comunque l'indice e l'errore
+        return {
+            'email_index': email_index,
+            'seconds': elapsed_seconds,
+            'error': f'JSON_DECODE_FAILED: {str(e)}',
+            'raw_response': response # Qui ho rimosso anche il limite [:150] per tenere tutto
+        }
+
+# --- BATCHING PER LUNGHEZZA ---
+def prepare_chunks(tokenizer, prefix, email_index, email_content):
+    """Divide l'email in chunk e restituisce un item per chunk con i token del prompt già calcolati."""
+    # Conteggio dei token per righe/frasi, senza round trip encode/decode dell'intera email
+    def count_tokens(texts):
+        return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)['input_ids']]
+
+    chunks = chunk_text(email_content, MAX_CHUNK_LEN, CHUNK_OVERLAP, count_tokens)
+
+    items = []
+    for chunk_idx, chunk in enumerate(chunks):
+        messages = build_pii_messages(chunk.text)
+        prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        # Il prefisso ha sempre gli stessi token: il backend può riusarne la cache
+        prefix_text, prefix_ids = prefix
+        input_ids = prefix_ids + tokenizer.encode(prompt[len(prefix_text):], add_special_tokens=False)
+        items.append({
+            'email_index': email_index,
+            'chunk_idx': chunk_idx,
+            'num_chunks': len(chunks),
+            'offsets': [chunk.start, chunk.end],
+            'messages': messages,
+            'input_ids': input_ids,
+            'n_tokens': len(input_ids),
+        })
+    return items
+
+def build_batches(items, token_budget, max_batch_size):
+    """Impacchetta gli item (già ordinati per lunghezza) in batch padded entro il budget di token.
+
+    Il costo di un batch è righe * (prompt più lungo + MAX_NEW_TOKENS), cioè la dimensione
+    della matrice padded che il modello deve tenere in memoria a fine generazione.
+    """
+    batches = []
+    current = []
+    current_max = 0
+    for item in items:
+        longest = max(current_max, item['n_tokens'])
+        cost = (len(current) + 1) * (longest + MAX_NEW_TOKENS)
+        if current and (cost > token_budget or len(current) >= max_batch_size):
+            batches.append(current)
+            current = []
+            longest = item['n_tokens']
+        current.append(item)
+        current_max = longest
+    if current:
+        batches.append(current)
+    return batches
+
+def analyze_window(backend, tokenizer, prefix, records, metrics):
+    """Analizza una finestra di (email_index, testo) e restituisce le righe di risultato in ordine
+    di email (e di chunk se non uniti), come (email_index, ultima riga dell'email, riga)."""
+    items = []
+    for i, email_content in records:
+        with metrics.phase('tokenize', i):
+            email_items = prepare_chunks(tokenizer, prefix, i, email_content)
+        metrics.count(i, tokens_in=sum(item['n_tokens'] for item in email_items))
+        items.extend(email_items)
+
+    if BATCH_MODE:
+        items.sort(key=lambda item: item['n_tokens'])
+        batches = build_batches(items, TOKEN_BUDGET, MAX_BATCH_SIZE)
+    else:
+        batches = [[item] for item in items]
+
+    results = {}
+    for batch in batches:
+        start_time = time.time()
+        responses = backend.generate(batch)
+        # Il tempo del batch viene ripartito tra i chunk che lo compongono
+        elapsed = round((time.time() - start_time) / len(batch), 2)
+
+        # Prefill/decode (o la richiesta HTTP) del batch ripartiti tra i chunk che lo compongono
+        stats = backend.last_stats or {}
+        for phase, ns in stats.get('phases', {}).items():
+            metrics.add_shared([item['email_index'] for item in batch], phase, ns)
+        tokens_out = stats.get('tokens_out') or [None] * len(batch)
+
+        for item, response, n_out in zip(batch, responses, tokens_out):
+            if n_out is not None:
+                metrics.count(item['email_index'], tokens_out=n_out)
+            with metrics.phase('parse', item['email_index']):
+                pii_data = extract_robust_json_keep_all(response, item['email_index'], elapsed)
+            pii_data['chunk'] = f"{item['chunk_idx'] + 1}/{item['num_chunks']}"
+            pii_data['offsets'] = item['offsets']
+            results[(item['email_index'], item['chunk_idx'])] = (pii_data, item['num_chunks'])
+
+        emails_in_batch = sorted({item['email_index'] for item in batch})
+        print(f"Batch di {len(batch)} chunk (email {emails_in_batch[0]}-{emails_in_batch[-1]}, "
+              f"max {max(item['n_tokens'] for item in batch)} token) completato in {elapsed * len(batch):.2f}s")
+
+    # Ordine di email_index: il resume resta valido anche con batch ordinati per lunghezza
+    merger = EntityMerger()
+    rows = []
+    for key in sorted(results):
+        email_index, chunk_idx = key
+        pii_data, num_chunks = results[key]
+        if MERGE_CHUNKS:
+            with metrics.phase('parse', email_index):
+                pii_data = merger.add(pii_data, num_chunks)
+            if pii_data is None:
+                continue
+        rows.append((email_index, chunk_idx == num_chunks - 1, pii_data))
+    return rows
+
+def process_window(backend, tokenizer, prefix, records, metrics, cache=None):
+    """Analizza una finestra di (email_index, testo): righe in ordine di email (e di chunk se non uniti).
+
+    Con cache vengono generate solo le email il cui testo non è già in cache.
+    """
+    if cache is None:
+        return [pii_data for _, _, pii_data in analyze_window(backend, tokenizer, prefix, records, metrics)]
+    plan = cache.plan(records)
+    computed = {}
+    if plan.misses:
+        for email_index, _, pii_data in analyze_window(backend, tokenizer, prefix, plan.misses, metrics):
+            computed.setdefault(email_index, []).append(pii_data)
+    return cache.complete(plan, computed)
+
+def write_rows(rows, writer, metrics, progress_every=EMAIL_WINDOW):
+    """Scrive le righe in ordine: tutti i chunk di un'email in un solo commit (results_writer.py)."""
+    total_start = time.time()
+    processed = 0
+    for email_index, email_rows in iter_groups(rows):
+        with metrics.phase('write', email_index):
+            writer.commit(email_index, email_rows)
+        metrics.finish(email_index)
+        processed += 1
+        if processed % progress_every == 0:
+            elapsed_hours = (time.time() - total_start) / 3600
+            print(f"Email fino a {email_index} completate ({processed / max(elapsed_hours, 1e-9):.1f} email/ora)")
+
+def cache_version():
+    """Versione del prompt più le impostazioni che cambiano le risposte (anche la riduzione del testo)."""
+    version = (f"{PROMPT_VERSION}|constrained={CONSTRAINED_DECODING}|max_new={MAX_NEW_TOKENS}"
+               f"|chunk={MAX_CHUNK_LEN}/{CHUNK_OVERLAP}|merge={MERGE_CHUNKS}")
+    if THREAD_SEGMENTS:
+        version += f"|threads={MIN_SEGMENT_CHARS}"
+    if HEADER_FAST_PATH:
+        version += f"|headers={','.join(CONTENT_FIELDS)}/{NAMES_FROM_ADDRESSES}"
+    return version
+
+def load_backend():
+    """Tokenizer, backend configurato e prefisso del prompt (con cache se PREFIX_CACHE)."""
+    # Import qui: prompt e parsing restano usabili (benchmark, stub) senza transformers
+    from transformers import AutoTokenizer
+
+    # Il tokenizer serve in ogni caso per chunking e ordinamento per lunghezza; il modello solo col backend "hf"
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, trust_remote_code=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    backend = create_backend(BACKEND, MODEL_ID, tokenizer, MAX_NEW_TOKENS,
+                             server_url=LLM_SERVER_URL, max_concurrency=HTTP_CONCURRENCY,
+                             constrained=CONSTRAINED_DECODING)
+    print(f"Backend '{BACKEND}' pronto per {MODEL_ID}.")
+
+    prefix = build_prompt_prefix(tokenizer)
+    if PREFIX_CACHE:
+        backend.set_prompt_prefix(prefix[1])
+        print(f"Prefisso del prompt: {len(prefix[1])} token calcolati una volta sola.")
+    return tokenizer, backend, prefix
+
+def main():
+    if not os.path.exists(INPUT_FILENAME):
+        print(f"ERRORE: File '{INPUT_FILENAME}' non trovato.")
+        return
+
+    # --- CARICAMENTO DEL BACKEND ---
+    try:
+        tokenizer, backend, prefix = load_backend()
+    except Exception as e:
+        print(f"Errore nell'inizializzazione del backend '{BACKEND}': {e}")
+        return
+
+    # --- CICLO DI GENERAZIONE A BATCH ---
+
+    writer = ResultsWriter(OUTPUT_FILENAME, index_file=ENTITY_INDEX_FILENAME, index_source='llama')
+    start_index = writer.start_index
+
+    # --- CARICAMENTO DEI DATI ---
+    # Il corpus viene letto in streaming, una finestra di EMAIL_WINDOW email alla volta
+    metrics = StageMetrics(f"llama-{BACKEND}", METRICS_FILENAME, append=start_index > 0)
+    count_tokens = lambda texts: [len(ids) for ids in tokenizer(texts, add_special_tokens=False)['input_ids']]
+    threads = None
+    headers = None
+    formatter = format_chunk_full
+    if THREAD_SEGMENTS:
+        threads = ThreadIndex(count_tokens)
+        formatter = threads.formatter(formatter)
+        if start_index > 0:
+            # L'indice dei segmenti è solo in memoria: al resume si rilegge il corpus fino a
+            # start_index con le righe già scritte, così i segmenti visti non vengono rianalizzati
+            bodies = ((idx, body) for chunk in iter_corpus_chunks(INPUT_FILENAME, [TEXT_COLUMN], limit=start_index)
+                      for idx, body in zip(chunk['email_index'].tolist(), chunk[TEXT_COLUMN].tolist()))
+            threads.restore(bodies, writer.iter_committed())
+            print(f"Indice dei thread ricostruito: {len(threads.segments)} segmenti dalle email fino a {start_index}")
+    if HEADER_FAST_PATH:
+        headers = HeaderFastPath(count_tokens)
+        formatter = headers.formatter(formatter)
+
+    # Con il testo ridotto la chiave resta l'email completa; le righe ridotte da ThreadIndex
+    # dipendono dalle email lette prima e vanno in cache solo dopo resolve (result_cache.py)
+    cache = ResultCache("llama", MODEL_ID, cache_version(), defer=THREAD_SEGMENTS) if USE_CACHE else None
+    if cache is not None and formatter is not format_chunk_full:
+        formatter = cache.keyed_formatter(format_chunk_full, formatter)
+    windows = iter_record_blocks(INPUT_FILENAME, formatter, chunksize=EMAIL_WINDOW,
+                                 start_index=start_index, limit=None if FULL_ANALYSIS else SAMPLE_SIZE,
+                                 metrics=metrics)
+
+    compute = lambda blocks: (row for records in blocks
+                              for row in process_window(backend, tokenizer, prefix, records, metrics, cache))
+    if MERGE_CHUNKS and DEDUP_CLUSTERS_FILE and os.path.exists(DEDUP_CLUSTERS_FILE):
+        clusters = load_clusters(DEDUP_CLUSTERS_FILE)
+        print(f"Deduplicazione: {len(clusters)} quasi-duplicati da {DEDUP_CLUSTERS_FILE}")
+        compute = lambda blocks, inner=compute: iter_deduplicated(blocks, clusters, inner)
+
+    rows = compute(windows)
+    if threads is not None:
+        rows = threads.resolve(rows)
+        if cache is not None:
+            rows = cache.store(rows)
+    if headers is not None:
+        rows = headers.merge(rows)
+
+    try:
+        write_rows(rows, writer, metrics)
+    finally:
+        writer.close()
+        backend.close()
+        summary = metrics.close()
+        if cache is not None:
+            cache.close()
+
+    print(format_summary(summary))
+    if cache is not None:
+        print(cache.report())
+    if threads is not None:
+        print(threads.report())
+    if headers is not None:
+        print(headers.report())
+
+    report = backend.prefill_report()
+    if report and report['prefill_tokens_total'] > 0:
+        saved_pct = 100 * report['prefill_tokens_saved'] / report['prefill_tokens_total']
+        print(f"Token di prefill risparmiati: {report['prefill_tokens_saved']} su {report['prefill_tokens_total']} "
+              f"({saved_pct:.1f}%, prefisso da {report['prefix_tokens']} token)")
+
+    print(f"\nAnalisi completata. Risultati in: {OUTPUT_FILENAME}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import copy
+import json
+import time
+import queue
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from json_constraint import PII_JSON_SCHEMA, PiiJsonLogitsProcessor, build_token_texts
+from instrumentation import FirstTokenTimer
+
+# Backend di estrazione: ricevono un batch di item preparati da llama_analysis_new7.py
+# (ognuno con 'messages' per la chat e 'input_ids' del prompt già tokenizzato)
+# e restituiscono le risposte testuali nello stesso ordine del batch.
+# Dopo ogni generate, last_stats contiene i nanosecondi per fase dell'intero batch
+# ("phases") e i token generati per ogni item ("tokens_out", None se non noti).
+
+class ExtractionBackend:
+    name = "base"
+    last_stats = None
+
+    def generate(self, batch):
+        raise NotImplementedError
+
+    def set_prompt_prefix(self, prefix_ids):
+        """Token iniziali comuni a tutti i prompt; i backend che possono li precalcolano una volta."""
+        pass
+
+    def prefill_report(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class HFBackend(ExtractionBackend):
+    """Modello caricato nel processo corrente con transformers (quantizzato 4-bit)."""
+    name = "hf"
+
+    def __init__(self, model_id, tokenizer, max_new_tokens, constrained=False):
+        import torch
+        from transformers import AutoModelForCausalLM, BitsAndBytesConfig
+
+        bnb_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_use_double_quant=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.bfloat16
+        )
+        self.model = AutoModelForCausalLM.from_pretrained(
+            model_id,
+            quantization_config=bnb_config,
+            device_map="auto",
+            trust_remote_code=True
+        )
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+        self.terminators = [
+            tokenizer.eos_token_id,
+            tokenizer.convert_tokens_to_ids("<|eot_id|>")
+        ]
+
+        # Testo dei token del vocabolario, calcolato una volta per la decodifica vincolata
+        self.token_texts = (build_token_texts(tokenizer, self.model.config.vocab_size)
+                            if constrained else None)
+
+        self.prefix_ids = None
+        self.prefix_cache = None
+        self.prefill_tokens_total = 0
+        self.prefill_tokens_saved = 0
+
+    def set_prompt_prefix(self, prefix_ids):
+        """Calcola una sola volta i past-key-values del prefisso fisso (system prompt + schema JSON)."""
+        import torch
+        from transformers import DynamicCache
+
+        cache = DynamicCache()
+        with torch.no_grad():
+            self.model(
+                input_ids=torch.tensor([prefix_ids], device=self.model.device),
+                past_key_values=cache,
+                use_cache=True,
+            )
+        self.prefix_ids = list(prefix_ids)
+        self.prefix_cache = cache
+
+    def _has_prefix(self, batch):
+        n = len(self.prefix_ids)
+        return all(item['input_ids'][:n] == self.prefix_ids for item in batch)
+
+    def _inputs_with_prefix_cache(self, batch):
+        """Prefisso in cache + padding + suffisso: il padding sta tra i due, così il prefisso
+        resta allineato alla cache per ogni riga e le position_ids (calcolate dall'attention
+        mask) proseguono dal prefisso senza contare i pad."""
+        import torch
+
+        n = len(self.prefix_ids)
+        suffixes = [item['input_ids'][n:] for item in batch]
+        max_len = max(len(suffix) for suffix in suffixes)
+        input_ids = []
+        attention_mask = []
+        for suffix in suffixes:
+            pad = max_len - len(suffix)
+            input_ids.append(self.prefix_ids + [self.tokenizer.pad_token_id] * pad + suffix)
+            attention_mask.append([1] * n + [0] * pad + [1] * len(suffix))
+
+        cache = copy.deepcopy(self.prefix_cache)
+        if len(batch) > 1:
+            cache.batch_repeat_interleave(len(batch))
+
+        return {
+            'input_ids': torch.tensor(input_ids, device=self.model.device),
+            'attention_mask': torch.tensor(attention_mask, device=self.model.device),
+            'past_key_values': cache,
+        }
+
+    def generate(self, batch):
+        import torch
+        from transformers import LogitsProcessorList
+
+        self.prefill_tokens_total += sum(len(item['input_ids']) for item in batch)
+        if self.prefix_cache is not None and self._has_prefix(batch):
+            inputs = self._inputs_with_prefix_cache(batch)
+            self.prefill_tokens_saved += len(self.prefix_ids) * len(batch)
+        else:
+            # Padding a sinistra: la generazione deve continuare subito dopo l'ultimo token del prompt
+            inputs = self.tokenizer.pad(
+                {'input_ids': [item['input_ids'] for item in batch]},
+                padding=True,
+                return_tensors="pt",
+            ).to(self.model.device)
+
+        # Primo processor della lista: segna la fine del prefill
+        timer = FirstTokenTimer()
+        logits_processor = LogitsProcessorList([timer])
+        if self.token_texts is not None:
+            # Nuovo processor per ogni generate: tiene lo stato dell'automa di ciascuna riga
+            logits_processor.append(PiiJsonLogitsProcessor(self.token_texts, self.terminators))
+
+        start_ns = time.perf_counter_ns()
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=self.max_new_tokens,
+                eos_token_id=self.terminators,
+                do_sample=False,
+                pad_token_id=self.tokenizer.pad_token_id,
+                logits_processor=logits_processor,
+            )
+
+        prompt_len = inputs['input_ids'].shape[1]
+        generated = [row[prompt_len:].tolist() for row in outputs]
+        responses = [self.tokenizer.decode(ids, skip_special_tokens=True) for ids in generated]
+        end_ns = time.perf_counter_ns()
+
+        first_ns = timer.first_ns or end_ns
+        self.last_stats = {
+            'phases': {'prefill': first_ns - start_ns, 'decode': end_ns - first_ns},
+            # Token fino al primo terminatore incluso: il resto della riga è padding del batch
+            'tokens_out': [next((i + 1 for i, t in enumerate(ids) if t in self.terminators), len(ids))
+                           for ids in generated],
+        }
+        return responses
+
+    def prefill_report(self):
+        return {
+            'prefix_tokens': len(self.prefix_ids) if self.prefix_ids else 0,
+            'prefill_tokens_total': self.prefill_tokens_total,
+            'prefill_tokens_saved': self.prefill_tokens_saved,
+        }
+
+
+class OpenAIHTTPBackend(ExtractionBackend):
+    """Client verso un server locale OpenAI-compatibile (vLLM, llama.cpp server).
+
+    Le connessioni HTTP restano aperte (keep-alive) in un pool e al massimo
+    max_concurrency richieste sono in volo contemporaneamente: il batching
+    vero e proprio lo fa il server, che così può servire più worker di estrazione.
+    """
+    name = "http"
+
+    def __init__(self, base_url, model_id, max_new_tokens, max_concurrency=8, timeout=600, constrained=False):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.https = parsed.scheme == "https"
+        self.path = parsed.path.rstrip('/') + "/v1/chat/completions"
+        self.model_id = model_id
+        self.max_new_tokens = max_new_tokens
+        self.timeout = timeout
+        self.constrained = constrained
+
+        self._pool = queue.LifoQueue()
+        for _ in range(max_concurrency):
+            self._pool.put(None)  # connessione creata al primo utilizzo
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def _connect(self):
+        conn_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return conn_class(self.host, self.port, timeout=self.timeout)
+
+    def _post(self, payload):
+        body = json.dumps(payload).encode('utf-8')
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        conn = self._pool.get()
+        try:
+            for attempt in range(2):
+                if conn is None:
+                    conn = self._connect()
+                try:
+                    conn.request("POST", self.path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    data = response.read()
+                    break
+                except (http.client.HTTPException, ConnectionError):
+                    # Connessione keep-alive chiusa dal server: si riprova una volta con una nuova
+                    conn.close()
+                    conn = None
+                    if attempt == 1:
+                        raise
+                except Exception:
+                    conn.close()
+                    conn = None
+                    raise
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}: {data[:200]!r}")
+            return json.loads(data)
+        finally:
+            self._pool.put(conn)
+
+    def _complete(self, item):
+        payload = {
+            "model": self.model_id,
+            "messages": item['messages'],
+            "max_tokens": self.max_new_tokens,
+            "temperature": 0,
+            # Identificativo del chunk: usato dallo stub server per il replay delle risposte
+            "user": f"email-{item['email_index']}-chunk-{item['chunk_idx'] + 1}",
+        }
+        if self.constrained:
+            # Structured output lato server (vLLM/llama.cpp applicano la grammatica dello schema)
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "pii", "schema": PII_JSON_SCHEMA, "strict": True},
+            }
+        data = self._post(payload)
+        usage = data.get('usage') or {}
+        return data['choices'][0]['message']['content'], usage.get('completion_tokens')
+
+    def generate(self, batch):
+        # Prefill e decode avvengono sul server: il client misura solo la richiesta completa
+        start_ns = time.perf_counter_ns()
+        completions = list(self._executor.map(self._complete, batch))
+        self.last_stats = {
+            'phases': {'generate': time.perf_counter_ns() - start_ns},
+            'tokens_out': [tokens for _, tokens in completions],
+        }
+        return [content for content, _ in completions]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        while not self._pool.empty():
+            conn = self._pool.get()
+            if conn is not None:
+                conn.close()
+
+
+def create_backend(name, model_id, tokenizer, max_new_tokens, server_url=None, max_concurrency=8, constrained=False):
+    if name == "hf":
+        return HFBackend(model_id, tokenizer, max_new_tokens, constrained=constrained)
+    if name == "http":
+        return OpenAIHTTPBackend(server_url, model_id, max_new_tokens,
+                                 max_concurrency=max_concurrency, constrained=constrained)
+    raise ValueError(f"Backend sconosciuto: {name}")
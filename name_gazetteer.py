@@ -0,0 +1,259 @@
+import re
+import json
+import time
+from corpus_reader import iter_corpus_chunks, format_chunk_joined, EMAIL_FIELDS, CORPUS_FILE
+from entity_keys import ENTITY_KEYS
+from instrumentation import StageMetrics, metrics_path, format_summary
+from regex_analysis import process_email, EMAIL_REGEX
+from results_writer import ResultsWriter
+
+# Backend opzionale: pyahocorasick (estensione C) se installato, altrimenti l'automa in Python puro
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Motore dei nomi a dizionario: invece di ogni bigramma/trigramma con la maiuscola
+# (NAME_REGEX + BLACKLIST), cerca nel testo solo i nomi già confermati nel corpus:
+# - le intestazioni From/To/Cc/Bcc (nomi visualizzati e parti locali tipo sara.shackleton);
+# - i nomi del ground truth umano (GROUND_TRUTH_FILE; sulle email annotate la valutazione
+#   di questo motore è quindi ottimistica).
+# Tutti i nomi sono in un automa di Aho-Corasick: ogni testo viene letto una volta sola,
+# qualunque sia la dimensione del dizionario. Le intestazioni di ogni blocco aggiornano il
+# dizionario prima della scansione dei body del blocco. Email e telefoni sono quelli della regex.
+
+INPUT_FILE = CORPUS_FILE
+OUTPUT_FILE = 'pii_analysis_results_gazetteer.jsonl'
+METRICS_FILE = metrics_path(OUTPUT_FILE)
+ENTITY_INDEX_FILE = None   # 'pii_entity_index.pickle' (entity_index.py): indice delle entità aggiornato durante la scrittura
+GROUND_TRUTH_FILE = 'pii_analysis_result_human.jsonl'
+SAMPLE_SIZE = 100          # None per analizzare tutto il corpus
+CHUNKSIZE = 1000
+
+HEADER_FIELDS = ['from', 'to', 'cc', 'bcc']
+MIN_TOKEN_LEN = 2          # Token della parte locale più corti (iniziali) non entrano nel nome
+# Parti locali di caselle non personali (enron.announcements, no.reply, ...)
+LOCAL_STOPWORDS = {
+    'enron', 'announcements', 'announcement', 'mail', 'info', 'admin', 'noreply', 'reply', 'no',
+    'team', 'group', 'help', 'support', 'news', 'list', 'service', 'services', 'office', 'dept',
+    'desk', 'center', 'www', 'web', 'online', 'the', 'all', 'employees', 'houston',
+}
+DISPLAY_NAME_PATTERN = re.compile(r'"?([A-Z][a-zA-Z\'-]+(?:,? [A-Z][a-zA-Z.\'-]*)+)"?\s*<')
+
+
+class AhoCorasick:
+    """Automa di Aho-Corasick in Python puro: add() in qualunque momento, build() prima di iter()."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]        # (lunghezza, valore) del pattern che termina nel nodo
+        self.next_output = [0]      # Nodo con output più vicino lungo i link di fallimento (0 = nessuno)
+        self.dirty = False
+
+    def add(self, pattern, value):
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(None)
+                self.next_output.append(0)
+                self.goto[node][ch] = nxt
+            node = nxt
+        self.output[node] = (len(pattern), value)
+        self.dirty = True
+
+    def build(self):
+        """Link di fallimento in ampiezza; va rifatto dopo le aggiunte (tempo lineare nei nodi)."""
+        queue = list(self.goto[0].values())
+        for node in queue:
+            self.fail[node] = 0
+            self.next_output[node] = 0
+        i = 0
+        while i < len(queue):
+            node = queue[i]
+            i += 1
+            for ch, child in self.goto[node].items():
+                state = self.fail[node]
+                while state and ch not in self.goto[state]:
+                    state = self.fail[state]
+                fallback = self.goto[state].get(ch, 0)
+                self.fail[child] = fallback if fallback != child else 0
+                self.next_output[child] = (self.fail[child] if self.output[self.fail[child]] is not None
+                                           else self.next_output[self.fail[child]])
+                queue.append(child)
+        self.dirty = False
+
+    def iter(self, text):
+        """(indice dell'ultimo carattere, (lunghezza, valore)) per ogni occorrenza, come pyahocorasick."""
+        goto, fail, output, next_output = self.goto, self.fail, self.output, self.next_output
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            match = node if output[node] is not None else next_output[node]
+            while match:
+                yield i, output[match]
+                match = next_output[match]
+
+
+class NameGazetteer:
+    """Dizionario di nomi confermati con ricerca lineare nel testo (ricerca per parole intere)."""
+
+    def __init__(self):
+        self.names = {}             # pattern normalizzato -> nome canonico
+        self.automaton = ahocorasick.Automaton() if ahocorasick is not None else AhoCorasick()
+        self.ready = False
+
+    @staticmethod
+    def normalize(text):
+        return ' '.join(text.lower().split())
+
+    def add(self, name):
+        """Aggiunge il nome e la variante "Cognome, Nome"; True se il dizionario è cambiato."""
+        words = name.split()
+        if len(words) < 2:
+            return False
+        added = False
+        for variant in (' '.join(words), f"{words[-1]}, {' '.join(words[:-1])}"):
+            pattern = self.normalize(variant)
+            if pattern not in self.names:
+                self.names[pattern] = ' '.join(words)
+                if ahocorasick is not None:
+                    self.automaton.add_word(pattern, (len(pattern), ' '.join(words)))
+                else:
+                    self.automaton.add(pattern, ' '.join(words))
+                added = True
+        if added:
+            self.ready = False
+        return added
+
+    def _build(self):
+        if ahocorasick is not None:
+            if self.names:
+                self.automaton.make_automaton()
+        else:
+            self.automaton.build()
+        self.ready = True
+
+    def scan(self, text):
+        """Nomi del dizionario presenti nel testo, a parole intere, scegliendo il match più lungo."""
+        if not isinstance(text, str) or not self.names:
+            return []
+        if not self.ready:
+            self._build()
+        text = self.normalize(text)
+        matches = []
+        for end, (length, value) in self.automaton.iter(text):
+            start = end - length + 1
+            if (start == 0 or not text[start - 1].isalnum()) and (end + 1 == len(text) or not text[end + 1].isalnum()):
+                matches.append((start, end + 1, value))
+        matches.sort(key=lambda m: (m[0], m[0] - m[1]))
+        names = {}
+        last_end = 0
+        for start, end, value in matches:
+            if start >= last_end:
+                names.setdefault(ENTITY_KEYS['names'](value), value)
+                last_end = end
+        return list(names.values())
+
+
+def name_from_address(address):
+    """Nome ricavato dalla parte locale (sara.shackleton -> Sara Shackleton), None se non personale."""
+    local = address.split('@')[0].lower()
+    tokens = [t for t in re.split(r'[._]', local) if t]
+    if not 2 <= len(tokens) <= 4 or any(not t.isalpha() for t in tokens):
+        return None
+    words = [t for t in tokens if len(t) >= MIN_TOKEN_LEN]
+    if len(words) < 2 or any(w in LOCAL_STOPWORDS for w in words):
+        return None
+    return ' '.join(w.capitalize() for w in words)
+
+
+def header_names(values):
+    """Nomi dalle intestazioni di un'email: nomi visualizzati e parti locali degli indirizzi."""
+    names = []
+    for value in values:
+        if not isinstance(value, str):
+            continue
+        for display in DISPLAY_NAME_PATTERN.findall(value):
+            if ',' in display:
+                last, _, first = display.partition(',')
+                display = f"{first.strip()} {last.strip()}"
+            names.append(display)
+        for address in EMAIL_REGEX.findall(value):
+            name = name_from_address(address)
+            if name:
+                names.append(name)
+    return names
+
+
+def load_ground_truth(gazetteer, path=GROUND_TRUTH_FILE):
+    added = 0
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    for name in json.loads(line).get('names') or []:
+                        added += gazetteer.add(str(name).strip())
+    except FileNotFoundError:
+        print(f"Ground truth {path} non trovato: dizionario solo dalle intestazioni.")
+    return added
+
+
+def process_chunk(gazetteer, chunk, metrics):
+    """Aggiorna il dizionario con le intestazioni del blocco e restituisce le righe di risultato."""
+    indexes = chunk['email_index'].tolist()
+    with metrics.phase('learn', indexes):
+        columns = [col for col in HEADER_FIELDS if col in chunk.columns]
+        for values in zip(*(chunk[col].tolist() for col in columns)):
+            for name in header_names(values):
+                gazetteer.add(name)
+    with metrics.phase('format', indexes):
+        texts = format_chunk_joined(chunk).tolist()
+
+    rows = []
+    for idx, text in zip(indexes, texts):
+        start_ns = time.perf_counter_ns()
+        result = process_email(text, idx)
+        result['names'] = sorted(gazetteer.scan(text))
+        elapsed = time.perf_counter_ns() - start_ns
+        metrics.add(idx, 'extract', elapsed)
+        result['seconds'] = round(elapsed / 1e9, 4)
+        rows.append(result)
+    return rows
+
+
+def main():
+    gazetteer = NameGazetteer()
+    seeded = load_ground_truth(gazetteer)
+    print(f"Dizionario iniziale: {len(gazetteer.names)} varianti ({seeded} dal ground truth), "
+          f"backend {'pyahocorasick' if ahocorasick is not None else 'Python puro'}")
+
+    writer = ResultsWriter(OUTPUT_FILE, resume=False, index_file=ENTITY_INDEX_FILE, index_source='gazetteer')
+    metrics = StageMetrics("gazetteer", METRICS_FILE)
+    start_time = time.time()
+    try:
+        for chunk in iter_corpus_chunks(INPUT_FILE, EMAIL_FIELDS, chunksize=CHUNKSIZE, limit=SAMPLE_SIZE):
+            for row in process_chunk(gazetteer, chunk, metrics):
+                with metrics.phase('write', row['email_index']):
+                    writer.commit(row['email_index'], [row])
+                metrics.finish(row['email_index'])
+            print(f"Email fino a {chunk['email_index'].iloc[-1]}: dizionario di {len(gazetteer.names)} varianti")
+    except FileNotFoundError:
+        print(f"Errore: Il file {INPUT_FILE} non esiste.")
+        return
+    finally:
+        writer.close()
+        summary = metrics.close()
+
+    print(f"Completato in {time.time() - start_time:.2f}s. Risultati in: {OUTPUT_FILE}")
+    print(format_summary(summary))
+
+
+if __name__ == "__main__":
+    main()
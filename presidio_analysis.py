@@ -1,121 +1,257 @@
-import pandas as pd
-import json
-import time
-import re
-from presidio_analyzer import AnalyzerEngine
-
-INPUT_FILE = "campione_enron.csv"
-OUTPUT_FILE = "pii_analysis_results_presidio.jsonl"
-SAMPLE_SIZE = 100 
-
-BLACKLIST = {
-    "Original Message", "Sent", "Subject", "From", "To", "Cc", "Bcc", 
-    "Forwarded", "Dear", "Regards", "Thank", "Thanks", "Hello", "Hi",
-    "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday",
-    "January", "February", "March", "April", "May", "June", "July", "August", 
-    "September", "October", "November", "December", "Enron", "Houston", "ECT",
-    "Agreement", "Contract", "United States", "North America", "Information",
-    "PM", "AM", "Fax", "Phone"
-}
-
-def deep_clean(text):
-    if not text: return ""
-    text = re.sub(r'[\n\t\r]+', ' ', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
-
-def is_valid_name(text):
-    text = text.split('/')[0].strip()
-    text = re.sub(r"['’]s$", "", text)
-    text = re.sub(r"[^\w\s]$", "", text)
-    clean_txt = deep_clean(text)
-    
-    if len(clean_txt) < 3: return False
-    if clean_txt in BLACKLIST: return False
-    if any(char.isdigit() for char in clean_txt): return False
-
-    words = clean_txt.split()
-    if len(words) < 2: return False
-
-    return clean_txt
-
-def is_personal_email(email_text):
-    standard_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return bool(re.match(standard_pattern, email_text))
-
-def process_email_presidio(analyzer, text, email_index):
-    start_time = time.time()
-    
-    if not isinstance(text, str):
-        text = ""
-
-    entities_to_find = ["PERSON", "EMAIL_ADDRESS", "PHONE_NUMBER"]
-    results = analyzer.analyze(text=text, entities=entities_to_find, language='en')
-
-    extracted = {
-        "names": set(),
-        "emails": set(),
-        "phones": set()
-    }
-
-    for res in results:
-        entity_text = text[res.start:res.end].strip()
-        
-        if res.entity_type == "PERSON":
-            cleaned_name = is_valid_name(entity_text)
-            if cleaned_name:
-                extracted["names"].add(cleaned_name)
-        
-        elif res.entity_type == "EMAIL_ADDRESS":
-            if is_personal_email(entity_text):
-                extracted["emails"].add(entity_text.lower())
-        
-        elif res.entity_type == "PHONE_NUMBER":
-            clean_phone = ''.join(filter(str.isdigit, entity_text))
-            if len(clean_phone) >= 7:
-                extracted["phones"].add(entity_text)
-
-    result_json = {
-        "email_index": email_index,
-        "seconds": round(time.time() - start_time, 4),
-        "names": sorted(list(extracted["names"])),
-        "emails": sorted(list(extracted["emails"])),
-        "phones": sorted(list(extracted["phones"]))
-    }
-
-    return result_json
-
-def main():
-    print("Inizializzazione Presidio Analyzer...")
-    try:
-        analyzer = AnalyzerEngine()
-    except Exception as e:
-        print(f"Errore inizializzazione: {e}")
-        return
-
-    try:
-        df = pd.read_csv(INPUT_FILE)
-        
-        target_columns = [col for col in df.columns if col != 'message_id']
-        
-        combined_text = df[target_columns].fillna('').astype(str).agg(' '.join, axis=1)
-        texts = combined_text.tolist()
-        
-        print(f"Inizio elaborazione di {min(len(texts), SAMPLE_SIZE)} record (campi: {', '.join(target_columns)})...")
-        
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-            for idx, text in enumerate(texts[:SAMPLE_SIZE]):
-                if idx % 20 == 0: print(f"Analisi riga {idx}...")
-                
-                result = process_email_presidio(analyzer, text, idx)
-                f.write(json.dumps(result, ensure_ascii=False) + "\n")
-        
-        print(f"Completato! File salvato in: {OUTPUT_FILE}")
-        
-    except FileNotFoundError:
-        print(f"Errore: Il file {INPUT_FILE} non esiste.")
-    except Exception as e:
-        print(f"Errore durante l'esecuzione: {e}")
-
-if __name__ == "__main__":
+import time
+import re
+import os
+from importlib.metadata import version
+from multiprocessing import Pool
+from presidio_analyzer import AnalyzerEngine, BatchAnalyzerEngine
+from corpus_reader import iter_record_blocks, format_chunk_joined, CHUNKSIZE, CORPUS_FILE
+from instrumentation import StageMetrics, metrics_path, format_summary
+from result_cache import ResultCache, iter_with_cache, fingerprint
+from dedup_minhash import CLUSTERS_FILE, load_clusters, iter_deduplicated
+from results_writer import ResultsWriter
+from header_parser import HeaderFastPath, CONTENT_FIELDS, NAMES_FROM_ADDRESSES
+
+INPUT_FILE = CORPUS_FILE     # campione_enron.parquet se presente, altrimenti il CSV
+OUTPUT_FILE = "pii_analysis_results_presidio.jsonl"
+METRICS_FILE = metrics_path(OUTPUT_FILE)   # Tempi per fase di ogni email (instrumentation.py)
+ENTITY_INDEX_FILE = None   # 'pii_entity_index.pickle' (entity_index.py): indice delle entità aggiornato durante la scrittura
+SAMPLE_SIZE = 100 
+
+# Modalità di esecuzione:
+# "single": analyzer.analyze un testo alla volta (comportamento originale)
+# "batch":  BatchAnalyzerEngine, spaCy elabora i testi con nlp.pipe a gruppi di BATCH_SIZE
+# "pool":   un AnalyzerEngine per processo, ognuno in modalità batch su blocchi di BATCH_SIZE testi
+MODE = "batch"
+BATCH_SIZE = 32
+NUM_WORKERS = os.cpu_count()
+RESUME = True              # Riprende dal manifest di OUTPUT_FILE (results_writer.py); False: riscrive il file da capo
+USE_CACHE = True           # Email già analizzate (stesso testo e stessi filtri) lette da result_cache.py
+HEADER_FAST_PATH = False   # True: from/to/cc/bcc dal parser di header_parser.py, Presidio analizza solo oggetto e body
+DEDUP_CLUSTERS_FILE = CLUSTERS_FILE   # Cluster di dedup_minhash.py: i quasi-duplicati ricevono le entità del rappresentante (None per disattivare)
+
+ENTITIES_TO_FIND = ["PERSON", "EMAIL_ADDRESS", "PHONE_NUMBER"]
+
+BLACKLIST = {
+    "Original Message", "Sent", "Subject", "From", "To", "Cc", "Bcc", 
+    "Forwarded", "Dear", "Regards", "Thank", "Thanks", "Hello", "Hi",
+    "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday",
+    "January", "February", "March", "April", "May", "June", "July", "August", 
+    "September", "October", "November", "December", "Enron", "Houston", "ECT",
+    "Agreement", "Contract", "United States", "North America", "Information",
+    "PM", "AM", "Fax", "Phone"
+}
+
+def deep_clean(text):
+    if not text: return ""
+    text = re.sub(r'[\n\t\r]+', ' ', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+def is_valid_name(text):
+    text = text.split('/')[0].strip()
+    text = re.sub(r"['’]s$", "", text)
+    text = re.sub(r"[^\w\s]$", "", text)
+    clean_txt = deep_clean(text)
+    
+    if len(clean_txt) < 3: return False
+    if clean_txt in BLACKLIST: return False
+    if any(char.isdigit() for char in clean_txt): return False
+
+    words = clean_txt.split()
+    if len(words) < 2: return False
+
+    return clean_txt
+
+def is_personal_email(email_text):
+    standard_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+    return bool(re.match(standard_pattern, email_text))
+
+def build_result(text, results, email_index, seconds):
+    """Filtra i RecognizerResult di Presidio e costruisce la riga JSONL dell'email."""
+    extracted = {
+        "names": set(),
+        "emails": set(),
+        "phones": set()
+    }
+
+    for res in results:
+        entity_text = text[res.start:res.end].strip()
+        
+        if res.entity_type == "PERSON":
+            cleaned_name = is_valid_name(entity_text)
+            if cleaned_name:
+                extracted["names"].add(cleaned_name)
+        
+        elif res.entity_type == "EMAIL_ADDRESS":
+            if is_personal_email(entity_text):
+                extracted["emails"].add(entity_text.lower())
+        
+        elif res.entity_type == "PHONE_NUMBER":
+            clean_phone = ''.join(filter(str.isdigit, entity_text))
+            if len(clean_phone) >= 7:
+                extracted["phones"].add(entity_text)
+
+    result_json = {
+        "email_index": email_index,
+        "seconds": round(seconds, 4),
+        "names": sorted(list(extracted["names"])),
+        "emails": sorted(list(extracted["emails"])),
+        "phones": sorted(list(extracted["phones"]))
+    }
+
+    return result_json
+
+def _analyze_email(analyzer, text, email_index):
+    """Risultato dell'email e nanosecondi delle fasi extract (analyze) e parse (filtri)."""
+    start_time = time.time()
+    start_ns = time.perf_counter_ns()
+    
+    if not isinstance(text, str):
+        text = ""
+
+    results = analyzer.analyze(text=text, entities=ENTITIES_TO_FIND, language='en')
+    parse_ns = time.perf_counter_ns()
+    result = build_result(text, results, email_index, time.time() - start_time)
+    return result, {'extract': parse_ns - start_ns, 'parse': time.perf_counter_ns() - parse_ns}
+
+def process_email_presidio(analyzer, text, email_index):
+    return _analyze_email(analyzer, text, email_index)[0]
+
+def _analyze_block(batch_analyzer, indexed_texts):
+    """Risultati del blocco e nanosecondi delle fasi extract e parse dell'intero blocco."""
+    texts = [text if isinstance(text, str) else "" for _, text in indexed_texts]
+    start_time = time.time()
+    start_ns = time.perf_counter_ns()
+    all_results = batch_analyzer.analyze_iterator(
+        texts, language='en', batch_size=BATCH_SIZE, entities=ENTITIES_TO_FIND
+    )
+    parse_ns = time.perf_counter_ns()
+    seconds = (time.time() - start_time) / max(len(texts), 1)
+    results = [build_result(text, results, idx, seconds)
+               for (idx, _), text, results in zip(indexed_texts, texts, all_results)]
+    return results, {'extract': parse_ns - start_ns, 'parse': time.perf_counter_ns() - parse_ns}
+
+def process_batch_presidio(batch_analyzer, indexed_texts):
+    """Analizza un blocco di (email_index, testo) con nlp.pipe; il tempo viene ripartito tra le email."""
+    return _analyze_block(batch_analyzer, indexed_texts)[0]
+
+# Un AnalyzerEngine per processo worker, creato una volta sola dall'initializer del Pool
+_worker_batch_analyzer = None
+
+def _init_worker():
+    global _worker_batch_analyzer
+    _worker_batch_analyzer = BatchAnalyzerEngine(analyzer_engine=AnalyzerEngine())
+
+def _process_block(indexed_texts):
+    return _analyze_block(_worker_batch_analyzer, indexed_texts)
+
+def iter_blocks(indexed_texts, size):
+    for i in range(0, len(indexed_texts), size):
+        yield indexed_texts[i:i + size]
+
+def _iter_timed(record_blocks, analyzer):
+    """(risultati, nanosecondi per fase) per email ("single") o per blocco ("batch", "pool")."""
+    if MODE == "single":
+        for records in record_blocks:
+            for idx, text in records:
+                result, timings = _analyze_email(analyzer, text, idx)
+                yield [result], timings
+    elif MODE == "batch":
+        batch_analyzer = BatchAnalyzerEngine(analyzer_engine=analyzer)
+        for records in record_blocks:
+            for block in iter_blocks(records, BATCH_SIZE):
+                yield _analyze_block(batch_analyzer, block)
+    elif MODE == "pool":
+        with Pool(processes=NUM_WORKERS, initializer=_init_worker) as pool:
+            # imap restituisce i blocchi nell'ordine di invio: l'output resta ordinato
+            for records in record_blocks:
+                yield from pool.imap(_process_block, iter_blocks(records, BATCH_SIZE))
+    else:
+        raise ValueError(f"MODE sconosciuta: {MODE}")
+
+def iter_results(record_blocks, analyzer, metrics=None):
+    """Risultati in ordine di email_index secondo la MODE configurata.
+
+    record_blocks sono le liste di (email_index, testo) lette in streaming dal corpus.
+    Con metrics i tempi di analisi e filtraggio di ogni blocco vengono ripartiti tra le sue email.
+    """
+    for results, timings in _iter_timed(record_blocks, analyzer):
+        if metrics is not None:
+            indexes = [result["email_index"] for result in results]
+            for phase, ns in timings.items():
+                metrics.add_shared(indexes, phase, ns)
+        yield from results
+
+def main():
+    print(f"Inizializzazione Presidio Analyzer (modalità {MODE})...")
+    analyzer = None
+    if MODE != "pool":
+        try:
+            analyzer = AnalyzerEngine()
+        except Exception as e:
+            print(f"Errore inizializzazione: {e}")
+            return
+
+    writer = ResultsWriter(OUTPUT_FILE, resume=RESUME, index_file=ENTITY_INDEX_FILE, index_source='presidio')
+    start_index = writer.start_index
+    metrics = StageMetrics("presidio", METRICS_FILE, append=start_index > 0)
+    cache = None
+    if USE_CACHE:
+        # La versione cambia con le entità cercate, la blacklist dei nomi o i campi inviati a Presidio
+        settings = [ENTITIES_TO_FIND, sorted(BLACKLIST)]
+        if HEADER_FAST_PATH:
+            settings.append(['headers', CONTENT_FIELDS, NAMES_FROM_ADDRESSES])
+        cache = ResultCache("presidio", f"presidio-analyzer {version('presidio-analyzer')}", fingerprint(*settings))
+    headers = HeaderFastPath() if HEADER_FAST_PATH else None
+
+    try:
+        # Lettura a blocchi dal primo indice non ancora elaborato: memoria costante
+        formatter = headers.formatter(format_chunk_joined) if headers is not None else format_chunk_joined
+        if cache is not None and headers is not None:
+            # Chiave sull'email completa, non sul testo senza intestazioni
+            formatter = cache.keyed_formatter(format_chunk_joined, formatter)
+        record_blocks = iter_record_blocks(INPUT_FILE, formatter, chunksize=CHUNKSIZE,
+                                           start_index=start_index, limit=SAMPLE_SIZE, metrics=metrics)
+        
+        print(f"Inizio elaborazione da indice {start_index}...")
+
+        compute = lambda blocks: iter_results(blocks, analyzer, metrics)
+        if cache is not None:
+            compute = lambda blocks, inner=compute: iter_with_cache(cache, blocks, inner)
+        if DEDUP_CLUSTERS_FILE and os.path.exists(DEDUP_CLUSTERS_FILE):
+            clusters = load_clusters(DEDUP_CLUSTERS_FILE)
+            print(f"Deduplicazione: {len(clusters)} quasi-duplicati da {DEDUP_CLUSTERS_FILE}")
+            compute = lambda blocks, inner=compute: iter_deduplicated(blocks, clusters, inner)
+        results = compute(record_blocks)
+        if headers is not None:
+            results = headers.merge(results)
+        
+        for result in results:
+            if result["email_index"] % 20 == 0: print(f"Analisi riga {result['email_index']}...")
+            
+            with metrics.phase('write', result["email_index"]):
+                writer.commit(result["email_index"], [result])
+            metrics.finish(result["email_index"])
+        
+    except FileNotFoundError:
+        print(f"Errore: Il file {INPUT_FILE} non esiste.")
+        return
+    except Exception as e:
+        print(f"Errore durante l'esecuzione: {e}")
+        return
+    finally:
+        # Anche dopo un errore: checkpoint delle email già scritte, metriche e cache chiuse
+        writer.close()
+        summary = metrics.close()
+        if cache is not None:
+            cache.close()
+
+    print(f"Completato! File salvato in: {OUTPUT_FILE}")
+    print(format_summary(summary))
+    if headers is not None:
+        print(headers.report())
+    if cache is not None:
+        print(cache.report())
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,420 @@
+import os
+import re
+import sys
+import hmac
+import time
+import hashlib
+import argparse
+from collections import deque
+from functools import lru_cache
+from multiprocessing import Pool
+import pandas as pd
+from corpus_reader import iter_corpus_chunks, is_columnar, CORPUS_FILE, EMAIL_FIELDS
+from dedup_minhash import entity_pattern
+from entity_keys import entity_key
+from evaluate_systems import JoinCursor, SYSTEM_FILES, CATEGORIES
+
+# Pubblicazione del corpus anonimizzato: le entità trovate dagli estrattori (regex, Presidio,
+# LLM) vengono sostituite nel corpus con pseudonimi coerenti. Lo pseudonimo è un HMAC-SHA256
+# con chiave segreta della chiave normalizzata dell'entità (stessa semantica di ENTITY_KEYS):
+# la stessa persona diventa lo stesso token in tutto il corpus, ma senza la chiave non si
+# risale al nome né si può verificare un'ipotesi ("è Sara Shackleton?") ricalcolando l'hash.
+#
+# Il corpus (CSV o Parquet) viene letto e riscritto a blocchi di CHUNKSIZE righe; i file di
+# risultati sono letti in parallelo con lo stesso merge ordinato di evaluate_systems.py:
+# memoria costante qualunque sia la dimensione del corpus. I risultati hanno i valori delle
+# entità: le occorrenze vengono cercate in ogni colonna di testo con spazi flessibili. Le righe
+# con entity_offsets (membri dei cluster di dedup_minhash.py) hanno gli offset sul testo formattato
+# dall'estrattore: per la colonna body vengono riportati al body e usati al posto della ricerca
+# quando il testo agli offset corrisponde all'entità.
+#
+# Limite: si sostituiscono solo le occorrenze del valore trovato dagli estrattori. Le menzioni
+# parziali restano in chiaro ("Hi Sara" quando è stato trovato "Sara Shackleton"), come le entità
+# che nessun estrattore ha trovato.
+#
+# Con --workers N i blocchi sono riscritti da N processi, scritti comunque in ordine.
+# --benchmark 1,2,4 misura i MB/s (testo delle colonne riscritte) per ogni numero di processi.
+
+INPUT_FILE = CORPUS_FILE
+RESULT_FILES = {name: SYSTEM_FILES[name] for name in ('regex', 'presidio', 'llama_cleaned')}
+SAMPLE_SIZE = None         # None per tutto il corpus
+CHUNKSIZE = 1000
+NUM_WORKERS = 1
+MAX_PENDING = 2            # Blocchi in volo per processo: limita la memoria in modalità multiprocesso
+
+KEY_ENV = "PII_REDACTION_KEY"
+PSEUDONYM_CHARS = 12       # Caratteri esadecimali dell'HMAC nello pseudonimo (48 bit)
+PSEUDONYM_FORMATS = {
+    'names': 'PERSON_{}',
+    'emails': 'user_{}@redacted.invalid',
+    'phones': 'PHONE_{}',
+}
+# Email senza risultati in nessun file: "drop" non le scrive (non sono state analizzate), "keep" sì
+UNCOVERED_POLICY = "drop"
+SKIP_COLUMNS = {'email_index'}
+BODY_COLUMN = 'body'
+PATTERN_CACHE_SIZE = 100000   # Regex compilate delle entità più frequenti
+TOKEN_CACHE_SIZE = 100000
+
+
+def output_path(input_file):
+    base, ext = os.path.splitext(input_file)
+    return f"{base}_redacted{ext}"
+
+
+class Pseudonymizer:
+    """Token stabile per entità: HMAC-SHA256 con chiave di (categoria, chiave normalizzata)."""
+
+    def __init__(self, key, length=PSEUDONYM_CHARS):
+        self.key = key.encode('utf-8') if isinstance(key, str) else key
+        self.length = length
+        self.token = lru_cache(maxsize=TOKEN_CACHE_SIZE)(self._token)
+
+    def _token(self, category, value):
+        value = value.lower() if category == 'emails' else value
+        message = f"{category}\x00{entity_key(category, value)}".encode('utf-8')
+        digest = hmac.new(self.key, message, hashlib.sha256).hexdigest()[:self.length]
+        return PSEUDONYM_FORMATS[category].format(digest)
+
+
+def _value_pattern(category, value):
+    if category != 'names':
+        return re.escape(value)
+    # Anche nell'ordine "Cognome, Nome" (stessa chiave: insieme delle parole)
+    words = value.split()
+    alternatives = [entity_pattern(value).pattern]
+    if len(words) >= 2:
+        alternatives.append(re.escape(words[-1]) + r',?\s+' + r'\s+'.join(re.escape(w) for w in words[:-1]))
+    return '|'.join(alternatives)
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def entity_regex(category, value, ignore_case=False):
+    """Regex compilata di un'entità (le stesse entità ricorrono in tutto il corpus), sul testo in minuscolo.
+
+    Niente lookbehind iniziale: disattiverebbe la ricerca veloce del prefisso letterale
+    (circa 10 volte più lenta); il confine a sinistra è controllato in redact_text.
+    """
+    return re.compile(rf"(?:{_value_pattern(category, value.lower())})(?!\w)", re.IGNORECASE if ignore_case else 0)
+
+
+def redact_text(text, entities, pseudonymizer, known_spans=()):
+    """Testo con le entità sostituite e numero di sostituzioni.
+
+    known_spans sono (inizio, fine, categoria) già noti (entity_offsets), aggiunti a quelli cercati.
+    Tra occorrenze sovrapposte vince quella che inizia prima e, a parità, la più lunga.
+    """
+    folded = text.lower()
+    ignore_case = len(folded) != len(text)  # Minuscole di lunghezza diversa (es. 'İ'): offset non allineati
+    if ignore_case:
+        folded = text
+    spans = [(start, -end, category) for start, end, category in known_spans]
+    for category, value in entities:
+        for m in entity_regex(category, value, ignore_case).finditer(folded):
+            start = m.start()
+            if start and (folded[start - 1].isalnum() or folded[start - 1] == '_'):
+                continue
+            spans.append((start, -m.end(), category))
+    if not spans:
+        return text, 0
+    spans.sort()
+    parts = []
+    last = 0
+    for start, neg_end, category in spans:
+        if start < last:
+            continue
+        value = text[start:-neg_end]
+        if category == 'names':
+            value = ' '.join(value.replace(',', ' ').split())
+        parts.append(text[last:start])
+        parts.append(pseudonymizer.token(category, value))
+        last = -neg_end
+    parts.append(text[last:])
+    return ''.join(parts), (len(parts) - 1) // 2
+
+
+def body_shifts(record):
+    """Posizioni possibili del body nel testo formattato dall'estrattore, come differenza
+    (offset nel testo formattato - offset nel body): format_chunk_joined e format_email_full."""
+    body = record.get(BODY_COLUMN)
+    if not isinstance(body, str):
+        return []
+    fields = [f for f in EMAIL_FIELDS if f in record]
+    before = fields[:fields.index(BODY_COLUMN)]
+    joined = sum(len('' if pd.isna(record[f]) else str(record[f])) + 1 for f in before)
+    full = 0
+    for f in before:
+        val = str(record[f]).strip() if pd.notna(record[f]) else ""
+        if val:
+            full += len(f"{f.upper()}: {val}") + 1
+    full += len(f"{BODY_COLUMN.upper()}: ") - (len(body) - len(body.lstrip()))
+    return [joined, full]
+
+
+def body_spans(record, offsets):
+    """(span nel body, valori coperti) dagli entity_offsets della riga.
+
+    Un valore è coperto se tutte le sue occorrenze cadono nel body e il testo corrisponde:
+    per lui non serve la ricerca nel body. Gli altri valori vengono cercati come sempre.
+    """
+    body = record[BODY_COLUMN]
+    by_value = {}
+    for category, value, start, end in offsets:
+        by_value.setdefault((category, value), []).append((start, end))
+    spans = []
+    covered = set()
+    shifts = body_shifts(record)
+    for (category, value), positions in by_value.items():
+        pattern = entity_pattern(value)
+        for shift in shifts:
+            mapped = [(start - shift, end - shift) for start, end in positions]
+            if all(0 <= a < b <= len(body) and pattern.fullmatch(body[a:b]) for a, b in mapped):
+                spans.extend((a, b, category) for a, b in mapped)
+                covered.add((category, value))
+                break
+    return spans, covered
+
+
+def redact_chunk(chunk, entities, pseudonymizer):
+    """Blocco con le colonne di testo riscritte; entities sono le coppie (tuple di (categoria, valore),
+    tuple di (categoria, valore, inizio, fine) da entity_offsets) di ogni riga.
+
+    Restituisce il blocco, i byte di testo elaborati e il numero di sostituzioni.
+    """
+    total_bytes = 0
+    replaced = 0
+    # Offset riportati al body prima di riscrivere le colonne: servono i valori originali
+    known = {}
+    if BODY_COLUMN in chunk.columns:
+        for i, row in enumerate(entities):
+            if row and row[1]:
+                record = {col: chunk[col].iat[i] for col in chunk.columns}
+                if isinstance(record[BODY_COLUMN], str):
+                    known[i] = body_spans(record, row[1])
+    for column in chunk.columns:
+        if column in SKIP_COLUMNS or not (pd.api.types.is_object_dtype(chunk[column])
+                                          or pd.api.types.is_string_dtype(chunk[column])):
+            continue
+        values = chunk[column].tolist()
+        for i, (value, row) in enumerate(zip(values, entities)):
+            if not isinstance(value, str):
+                continue
+            total_bytes += len(value.encode('utf-8'))
+            if not row or not row[0]:
+                continue
+            found, spans = row[0], ()
+            if column == BODY_COLUMN and i in known:
+                spans, covered = known[i]
+                found = [entity for entity in found if entity not in covered]
+            values[i], n = redact_text(value, found, pseudonymizer, spans)
+            replaced += n
+        chunk[column] = values
+    return chunk, total_bytes, replaced
+
+
+# Pseudonymizer per processo worker, creato una volta sola dall'initializer del Pool
+_worker_pseudonymizer = None
+
+def _init_worker(key):
+    global _worker_pseudonymizer
+    _worker_pseudonymizer = Pseudonymizer(key)
+
+def _redact_task(task):
+    chunk, entities = task
+    return redact_chunk(chunk, entities, _worker_pseudonymizer)
+
+
+class EntityFeed:
+    """Entità di ogni email dai file di risultati, letti in parallelo al corpus in ordine di email_index."""
+
+    def __init__(self, result_files):
+        self.cursors = {}
+        for name, path in result_files.items():
+            try:
+                self.cursors[name] = JoinCursor(path)
+            except FileNotFoundError:
+                print(f"{name}: {path} non trovato, ignorato")
+        self.uncovered = 0
+
+    def take(self, email_index):
+        """(tupla ordinata di (categoria, valore), tupla di (categoria, valore, inizio, fine) da
+        entity_offsets) dell'email; None se nessun file la contiene."""
+        found = set()
+        offsets = set()
+        covered = False
+        for cursor in self.cursors.values():
+            row = cursor.take(email_index)
+            if row is None:
+                continue
+            covered = True
+            for category in CATEGORIES:
+                for value in row.get(category) or []:
+                    value = ' '.join(str(value).split())
+                    if value:
+                        found.add((category, value))
+            for span in row.get('entity_offsets') or []:
+                value = ' '.join(str(span.get('text', '')).split())
+                if value and span.get('category') in CATEGORIES:
+                    offsets.add((span['category'], value, span['start'], span['end']))
+        if not covered:
+            self.uncovered += 1
+            return None
+        return tuple(sorted(found)), tuple(sorted(offsets))
+
+
+class CorpusWriter:
+    """Scrittura a blocchi in CSV o Parquet (secondo l'estensione), resa visibile solo a fine run."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp = path + ".tmp"
+        self.columnar = is_columnar(path)
+        self.parquet = None
+        self.file = None if self.columnar else open(self.tmp, 'w', encoding='utf-8', newline='')
+        self.header = True
+
+    def write(self, chunk):
+        if self.columnar:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if self.parquet is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                self.parquet = pq.ParquetWriter(self.tmp, table.schema)
+            else:
+                table = pa.Table.from_pandas(chunk, schema=self.parquet.schema, preserve_index=False)
+            self.parquet.write_table(table)
+        else:
+            chunk.to_csv(self.file, header=self.header, index=False)
+            self.header = False
+
+    def close(self, complete=True):
+        if self.columnar:
+            if self.parquet is not None:
+                self.parquet.close()
+        else:
+            self.file.close()
+        if complete and os.path.exists(self.tmp):
+            os.replace(self.tmp, self.path)
+        elif os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+
+def _iter_tasks(input_file, feed, limit, keep_index, stats):
+    for chunk in iter_corpus_chunks(input_file, columns=None, chunksize=CHUNKSIZE, limit=limit):
+        entities = [feed.take(idx) for idx in chunk['email_index'].tolist()]
+        if UNCOVERED_POLICY == "drop":
+            covered = [row is not None for row in entities]
+            stats['dropped'] += covered.count(False)
+            if not all(covered):
+                chunk = chunk[covered].copy()
+            entities = [row for row in entities if row is not None]
+        else:
+            entities = [row or ((), ()) for row in entities]
+        if not keep_index:
+            chunk = chunk.drop(columns=['email_index'])
+        if len(chunk):
+            yield chunk, entities
+
+
+def redact_corpus(input_file, output_file, key, result_files=RESULT_FILES, workers=NUM_WORKERS,
+                  limit=SAMPLE_SIZE):
+    """Riscrive il corpus con gli pseudonimi; restituisce i contatori (email, byte, sostituzioni, secondi)."""
+    start_time = time.time()
+    feed = EntityFeed(result_files)
+    # Il CSV non ha la colonna email_index (la aggiunge corpus_reader), il Parquet del campione sì
+    keep_index = is_columnar(input_file)
+    stats = {'emails': 0, 'dropped': 0, 'bytes': 0, 'replaced': 0}
+    writer = CorpusWriter(output_file)
+    complete = False
+
+    def collect(result):
+        chunk, total_bytes, replaced = result
+        writer.write(chunk)
+        stats['emails'] += len(chunk)
+        stats['bytes'] += total_bytes
+        stats['replaced'] += replaced
+
+    try:
+        tasks = _iter_tasks(input_file, feed, limit, keep_index, stats)
+        if workers <= 1:
+            pseudonymizer = Pseudonymizer(key)
+            for chunk, entities in tasks:
+                collect(redact_chunk(chunk, entities, pseudonymizer))
+        else:
+            with Pool(processes=workers, initializer=_init_worker, initargs=(key,)) as pool:
+                # Al massimo MAX_PENDING blocchi per processo in memoria; scrittura nell'ordine di invio
+                pending = deque()
+                for task in tasks:
+                    if len(pending) >= workers * MAX_PENDING:
+                        collect(pending.popleft().get())
+                    pending.append(pool.apply_async(_redact_task, (task,)))
+                while pending:
+                    collect(pending.popleft().get())
+        complete = True
+    finally:
+        writer.close(complete)
+    stats['uncovered'] = feed.uncovered
+    stats['seconds'] = time.time() - start_time
+    return stats
+
+
+def format_stats(stats):
+    mb = stats['bytes'] / 1e6
+    return (f"{stats['emails']} email scritte ({stats['uncovered']} senza risultati, {stats['dropped']} escluse), "
+            f"{stats['replaced']} sostituzioni; {mb:.1f} MB di testo in {stats['seconds']:.2f}s "
+            f"= {mb / max(stats['seconds'], 1e-9):.2f} MB/s")
+
+
+def benchmark(input_file, output_file, workers_list, result_files=RESULT_FILES, limit=SAMPLE_SIZE):
+    """MB/s per ogni numero di processi; l'output di prova (<output>_benchmark) viene cancellato."""
+    base, ext = os.path.splitext(output_file)
+    output_file = f"{base}_benchmark{ext}"
+    key = os.urandom(32)
+    report = []
+    try:
+        for workers in workers_list:
+            stats = redact_corpus(input_file, output_file, key, result_files, workers, limit)
+            report.append((workers, stats))
+            print(f"{workers} processi: {format_stats(stats)}")
+    finally:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Corpus con le entità sostituite da pseudonimi HMAC coerenti.",
+        epilog="Limite: si sostituiscono solo i valori trovati dagli estrattori; le menzioni parziali "
+               "(es. \"Hi Sara\" quando è stato trovato \"Sara Shackleton\") restano in chiaro.")
+    parser.add_argument('--input', default=INPUT_FILE)
+    parser.add_argument('--output', help="Default: <input>_redacted con la stessa estensione")
+    parser.add_argument('--results', nargs='*', metavar='NOME=FILE',
+                        help="File di risultati con le entità (default: regex, presidio, llama_cleaned)")
+    parser.add_argument('--workers', type=int, default=NUM_WORKERS)
+    parser.add_argument('--limit', type=int, default=SAMPLE_SIZE)
+    parser.add_argument('--benchmark', metavar='N,N,...', help="Misura i MB/s con questi numeri di processi")
+    args = parser.parse_args(argv)
+
+    output_file = args.output or output_path(args.input)
+    result_files = dict(value.partition('=')[::2] for value in args.results) if args.results else RESULT_FILES
+    try:
+        if args.benchmark:
+            benchmark(args.input, output_file, [int(n) for n in args.benchmark.split(',')], result_files, args.limit)
+            return 0
+        key = os.environ.get(KEY_ENV)
+        if not key:
+            print(f"Errore: impostare la chiave segreta degli pseudonimi in {KEY_ENV}.")
+            return 1
+        stats = redact_corpus(args.input, output_file, key, result_files, args.workers, args.limit)
+    except FileNotFoundError:
+        print(f"Errore: Il file {args.input} non esiste.")
+        return 1
+    print(format_stats(stats))
+    print(f"Corpus anonimizzato in: {output_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
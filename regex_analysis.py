@@ -1,82 +1,163 @@
-import re
-import json
-import time
-import pandas as pd
-
-EMAIL_REGEX = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b')
-PHONE_REGEX = re.compile(r'(\(?\b\d{3}\)?[-.\s/]?\d{3}[-.\s/]?\d{4}\b|\b\d{3}[-.\s/]?\d{4}\b|\bx\d{4,5}\b)')
-NAME_REGEX = re.compile(r'\b([A-Z][a-z]+(?:\s+[A-Z][a-z]+){1,2})\b')
-
-BLACKLIST = {
-    "Original Message", "Sent", "Subject", "From", "To", "Cc", "Bcc", 
-    "Forwarded", "Dear", "Regards", "Thank", "Thanks", "Hello", "Hi",
-    "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday",
-    "January", "February", "March", "April", "May", "June", "July", "August", 
-    "September", "October", "November", "December", "Enron", "Houston", "ECT",
-    "Agreement", "Contract", "United States", "North America", "Information"
-}
-
-def deep_clean(text):
-    if not text: return ""
-    text = re.sub(r'[\n\t\r]+', ' ', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
-
-def is_valid_name(name_text):
-    cleaned = deep_clean(name_text)
-    if cleaned in BLACKLIST or len(cleaned) < 3:
-        return False
-    return True
-
-
-def process_email(text, email_index):
-    start_time = time.time()
-    
-    if not isinstance(text, str):
-        text = ""
-
-    emails = EMAIL_REGEX.findall(text)
-    phones = PHONE_REGEX.findall(text)
- 
-    raw_names = NAME_REGEX.findall(text)
-    names = [deep_clean(n) for n in raw_names if is_valid_name(n)]
-
-    result = {
-        "email_index": email_index,
-        "seconds": round(time.time() - start_time, 4),
-        "names": sorted(list(set(names))),
-        "emails": sorted(list(set([deep_clean(e).lower() for e in emails]))),
-        "phones": sorted(list(set([deep_clean(p) for p in phones])))
-    }
-    return result
-
-def main():
-    input_file = "campione_enron.csv"
-    output_file = "pii_analysis_results_regex.jsonl"
-    
-    try:
-        df = pd.read_csv(input_file)
-        
-        all_cols = ["subject", "from", "to", "cc", "bcc", "date", "body", "file_name"]
-        target_columns = [col for col in all_cols if col in df.columns]
-        
-        print(f"Analisi sui campi: {', '.join(target_columns)}")
-        
-        df_combined = df[target_columns].fillna('').astype(str).agg(' '.join, axis=1)
-        
-        print(f"Inizio elaborazione...")
-        
-        with open(output_file, "w", encoding="utf-8") as f:
-            for idx, text in enumerate(df_combined[:100]):
-                result = process_email(text, idx)
-                f.write(json.dumps(result, ensure_ascii=False) + "\n")
-        
-        print(f"Completato! Risultati salvati in: {output_file}")
-        
-    except FileNotFoundError:
-        print(f"Errore: Il file {input_file} non è stato trovato.")
-    except Exception as e:
-        print(f"Si è verificato un errore: {e}")
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+import re
+import time
+import os
+from multiprocessing import Pool
+from corpus_reader import iter_record_blocks, format_chunk_joined, CHUNKSIZE, CORPUS_FILE
+from instrumentation import StageMetrics, metrics_path, format_summary
+from result_cache import ResultCache, iter_with_cache, fingerprint
+from results_writer import ResultsWriter
+
+# Backend opzionale: il modulo `regex` (se installato) compila lo stesso pattern combinato
+try:
+    import regex as re_engine
+except ImportError:
+    re_engine = re
+
+EMAIL_PATTERN = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b'
+PHONE_PATTERN = r'\(?\b\d{3}\)?[-.\s/]?\d{3}[-.\s/]?\d{4}\b|\b\d{3}[-.\s/]?\d{4}\b|\bx\d{4,5}\b'
+NAME_PATTERN = r'\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+){1,2}\b'
+
+EMAIL_REGEX = re.compile(EMAIL_PATTERN)
+PHONE_REGEX = re.compile(PHONE_PATTERN)
+NAME_REGEX = re.compile(NAME_PATTERN)
+
+# Email e telefoni in un solo pattern con gruppi nominati: a parità di posizione vince
+# l'email e un numero dentro un indirizzo email non viene contato anche come telefono.
+# I nomi restano in una scansione separata: nel pattern combinato un nome potrebbe
+# consumare l'inizio di un indirizzo ("Sara.Shackleton@..." diventava ".shackleton@...").
+CONTACT_REGEX = re_engine.compile(f'(?P<emails>{EMAIL_PATTERN})|(?P<phones>{PHONE_PATTERN})')
+NAME_SCAN_REGEX = re_engine.compile(f'(?P<names>{NAME_PATTERN})')
+
+INPUT_FILE = CORPUS_FILE     # campione_enron.parquet se presente, altrimenti il CSV
+OUTPUT_FILE = "pii_analysis_results_regex.jsonl"
+METRICS_FILE = metrics_path(OUTPUT_FILE)   # Tempi per fase di ogni email (instrumentation.py)
+ENTITY_INDEX_FILE = None   # 'pii_entity_index.pickle' (entity_index.py): indice delle entità aggiornato durante la scrittura
+SAMPLE_SIZE = 100          # None per analizzare tutto il corpus
+NUM_WORKERS = 1            # >1 divide il corpus tra più processi (os.cpu_count() per usarli tutti)
+POOL_CHUNKSIZE = 256       # Email inviate a ogni worker per volta
+USE_CACHE = True           # Email già analizzate (stesso testo e stesse regole) lette da result_cache.py
+RESUME = False             # Riprende dal manifest di OUTPUT_FILE (results_writer.py); altrimenti riscrive il file
+
+BLACKLIST = {
+    "Original Message", "Sent", "Subject", "From", "To", "Cc", "Bcc",
+    "Forwarded", "Dear", "Regards", "Thank", "Thanks", "Hello", "Hi",
+    "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday",
+    "January", "February", "March", "April", "May", "June", "July", "August",
+    "September", "October", "November", "December", "Enron", "Houston", "ECT",
+    "Agreement", "Contract", "United States", "North America", "Information"
+}
+
+def deep_clean(text):
+    if not text: return ""
+    text = re.sub(r'[\n\t\r]+', ' ', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+def is_valid_name(name_text):
+    cleaned = deep_clean(name_text)
+    if cleaned in BLACKLIST or len(cleaned) < 3:
+        return False
+    return True
+
+def scan_entities(text):
+    """Match di email/telefoni e di nomi come (categoria, start, end, testo), in ordine di posizione."""
+    found = [(m.lastgroup, m.start(), m.end(), m.group()) for m in CONTACT_REGEX.finditer(text)]
+    found += [('names', m.start(), m.end(), m.group()) for m in NAME_SCAN_REGEX.finditer(text)]
+    found.sort(key=lambda match: match[1])
+    return found
+
+def process_email(text, email_index):
+    start_time = time.time()
+
+    if not isinstance(text, str):
+        text = ""
+
+    found = {"names": [], "emails": [], "phones": []}
+    for category, _, _, value in scan_entities(text):
+        found[category].append(value)
+
+    names = [deep_clean(n) for n in found["names"] if is_valid_name(n)]
+
+    result = {
+        "email_index": email_index,
+        "seconds": round(time.time() - start_time, 4),
+        "names": sorted(list(set(names))),
+        "emails": sorted(list(set([deep_clean(e).lower() for e in found["emails"]]))),
+        "phones": sorted(list(set([deep_clean(p) for p in found["phones"]])))
+    }
+    return result
+
+def _process_indexed(item):
+    """Risultato dell'email e nanosecondi di estrazione (misurati nel processo che la esegue)."""
+    idx, text = item
+    start_ns = time.perf_counter_ns()
+    result = process_email(text, idx)
+    return result, time.perf_counter_ns() - start_ns
+
+def iter_results(blocks, num_workers=NUM_WORKERS, metrics=None):
+    """Risultati in ordine di email_index per blocchi di (email_index, testo); con più worker
+    ogni blocco viene diviso tra i processi. Con metrics registra la fase "extract"."""
+    if num_workers <= 1:
+        timed = (_process_indexed(item) for block in blocks for item in block)
+    else:
+        timed = _iter_pool(blocks, num_workers)
+
+    for result, elapsed_ns in timed:
+        if metrics is not None:
+            metrics.add(result["email_index"], 'extract', elapsed_ns)
+        yield result
+
+def _iter_pool(blocks, num_workers):
+    with Pool(processes=num_workers) as pool:
+        # Un blocco alla volta: imap consumerebbe tutto l'input in anticipo.
+        # imap mantiene l'ordine di input anche se i worker finiscono in ordine diverso
+        for block in blocks:
+            yield from pool.imap(_process_indexed, block, chunksize=POOL_CHUNKSIZE)
+
+def main():
+    input_file = INPUT_FILE
+    output_file = OUTPUT_FILE
+
+    writer = ResultsWriter(output_file, resume=RESUME, index_file=ENTITY_INDEX_FILE, index_source='regex')
+    metrics = StageMetrics("regex", METRICS_FILE, append=writer.start_index > 0)
+    # La versione cambia con i pattern o la blacklist: i risultati salvati prima non vengono riusati
+    cache = ResultCache("regex", re_engine.__name__, fingerprint(CONTACT_REGEX.pattern, NAME_SCAN_REGEX.pattern, sorted(BLACKLIST))) if USE_CACHE else None
+    try:
+        # Lettura a blocchi: memoria costante anche sull'intero dump Enron
+        blocks = iter_record_blocks(input_file, format_chunk_joined, chunksize=CHUNKSIZE,
+                                    start_index=writer.start_index, limit=SAMPLE_SIZE, metrics=metrics)
+
+        workers = NUM_WORKERS or os.cpu_count()
+        print(f"Inizio elaborazione con {workers} processi (motore: {re_engine.__name__})...")
+        if cache is not None:
+            results = iter_with_cache(cache, blocks, lambda miss_blocks: iter_results(miss_blocks, workers, metrics))
+        else:
+            results = iter_results(blocks, workers, metrics)
+        start_time = time.time()
+        processed = 0
+
+        for result in results:
+            with metrics.phase('write', result["email_index"]):
+                writer.commit(result["email_index"], [result])
+            metrics.finish(result["email_index"])
+            processed += 1
+        writer.close()
+
+        elapsed = time.time() - start_time
+        print(f"Completato in {elapsed:.2f}s ({processed / max(elapsed, 1e-9):.0f} email/s)! Risultati salvati in: {output_file}")
+        print(format_summary(metrics.close()))
+        if cache is not None:
+            print(cache.report())
+
+    except FileNotFoundError:
+        print(f"Errore: Il file {input_file} non è stato trovato.")
+    except Exception as e:
+        print(f"Si è verificato un errore: {e}")
+    finally:
+        writer.close()
+        metrics.close()
+        if cache is not None:
+            cache.close()
+
+if __name__ == "__main__":
+    main()
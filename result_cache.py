@@ -0,0 +1,249 @@
+import json
+import sqlite3
+import hashlib
+import unicodedata
+from collections import deque
+from results_writer import iter_groups
+
+# Cache persistente dei risultati, indicizzata per contenuto e non per email_index:
+# la chiave è lo SHA-256 di (testo normalizzato, estrattore, modello, versione del
+# prompt/delle regole). Le copie della stessa email (cartelle sent, all_documents,
+# discussion_threads) costano una sola analisi, e cambiare campione o ordine del
+# corpus non obbliga a ricalcolare nulla.
+#
+# Il valore è la lista delle righe di risultato dell'email senza email_index
+# (più righe se il LLM scrive un chunk per riga): a ogni hit vengono riscritte con
+# l'indice corrente e "cached": true. Gli offset dei chunk si riferiscono al testo
+# della prima copia analizzata.
+#
+# Con i formatter che riducono il testo (header_parser.py, thread_segments.py) la chiave
+# resta quella dell'email completa (keyed_formatter) e le impostazioni della riduzione vanno
+# nella versione: il testo ridotto da ThreadIndex dipende dalle email lette prima. Con
+# defer=True le righe calcolate vengono salvate solo da store(), dopo ThreadIndex.resolve,
+# così il valore in cache è completo qualunque sia la storia dell'esecuzione.
+
+CACHE_FILE = 'pii_results_cache.sqlite'
+LOOKUP_BATCH = 500          # Chiavi per query IN (...), sotto il limite di variabili di SQLite
+
+
+def normalize_text(text):
+    """Normalizzazione che non cambia il contenuto: NFC, fine riga \\n, spazi a fine riga."""
+    if not isinstance(text, str):
+        return ""
+    text = unicodedata.normalize('NFC', text).replace('\r\n', '\n').replace('\r', '\n')
+    return '\n'.join(line.rstrip() for line in text.split('\n')).strip()
+
+
+def fingerprint(*parts):
+    """Versione breve ricavata da configurazione (pattern, blacklist, ...): cambia se cambiano le regole."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:12]
+
+
+class CachePlan:
+    """Esito della lookup di un blocco di (email_index, testo)."""
+
+    def __init__(self, block, keys, found, misses):
+        self.block = block
+        self.keys = keys
+        self.found = found      # {chiave: righe salvate}
+        self.misses = misses    # (email_index, testo) da calcolare, una per chiave
+
+
+class ResultCache:
+    """Cache SQLite dei risultati di un estrattore (una tabella condivisa da tutti gli estrattori)."""
+
+    def __init__(self, extractor, model_id="", prompt_version="", path=CACHE_FILE, defer=False):
+        self.extractor = extractor
+        self.model_id = model_id
+        self.prompt_version = prompt_version
+        self.path = path
+        self.defer = defer
+        self.key_texts = {}     # {email_index: testo della chiave} scritti da keyed_formatter
+        self.deferred = {}      # {email_index: chiave} righe calcolate in attesa di store()
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key BLOB PRIMARY KEY,"
+            " extractor TEXT NOT NULL,"
+            " model_id TEXT NOT NULL,"
+            " prompt_version TEXT NOT NULL,"
+            " rows TEXT NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self.conn.commit()
+        self.hits = 0
+        self.duplicates = 0
+        self.misses = 0
+
+    def key(self, text):
+        h = hashlib.sha256()
+        for part in (self.extractor, self.model_id, self.prompt_version, normalize_text(text)):
+            h.update(part.encode('utf-8'))
+            h.update(b'\x1f')
+        return h.digest()
+
+    def get_many(self, keys):
+        """{chiave: righe} per le chiavi presenti in cache."""
+        keys = list(keys)
+        found = {}
+        for i in range(0, len(keys), LOOKUP_BATCH):
+            batch = keys[i:i + LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            for key, rows in self.conn.execute(f"SELECT key, rows FROM results WHERE key IN ({placeholders})", batch):
+                found[key] = json.loads(rows)
+        return found
+
+    def put_many(self, entries):
+        """Salva {chiave: righe} in un'unica transazione."""
+        if not entries:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results (key, extractor, model_id, prompt_version, rows) VALUES (?, ?, ?, ?, ?)",
+                [(key, self.extractor, self.model_id, self.prompt_version, json.dumps(rows, ensure_ascii=False))
+                 for key, rows in entries.items()]
+            )
+
+    def keyed_formatter(self, key_formatter, formatter):
+        """Formatter per iter_record_blocks: restituisce il testo di formatter, ma la chiave
+        di ogni email viene calcolata sul testo di key_formatter (l'email non ridotta)."""
+        def format_keyed(chunk):
+            self.key_texts.update(zip(chunk['email_index'].tolist(), key_formatter(chunk).tolist()))
+            return formatter(chunk)
+        return format_keyed
+
+    def plan(self, block):
+        """Chiavi del blocco, righe già in cache e email da analizzare (i duplicati nel blocco una volta sola)."""
+        keys = [self.key(self.key_texts.pop(idx, text)) for idx, text in block]
+        if self.key_texts and block:
+            # Email dei blocchi precedenti mai arrivate qui (es. quasi-duplicati di dedup_minhash.py)
+            for idx in [i for i in self.key_texts if i < block[-1][0]]:
+                del self.key_texts[idx]
+        found = self.get_many(set(keys))
+        misses = []
+        planned = set()
+        for (idx, text), key in zip(block, keys):
+            if key not in found and key not in planned:
+                planned.add(key)
+                misses.append((idx, text))
+        return CachePlan(block, keys, found, misses)
+
+    def complete(self, plan, computed):
+        """Salva le righe calcolate ({email_index: righe}) e restituisce le righe dell'intero blocco in ordine.
+
+        Con defer le righe calcolate non vengono salvate qui ma da store().
+        """
+        miss_indexes = {idx for idx, _ in plan.misses}
+        fresh = {}
+        for (idx, _), key in zip(plan.block, plan.keys):
+            if idx in miss_indexes and idx in computed:
+                fresh[key] = [{k: v for k, v in row.items() if k != 'email_index'} for row in computed[idx]]
+                if self.defer:
+                    self.deferred[idx] = key
+        if not self.defer:
+            self.put_many(fresh)
+
+        rows = []
+        for (idx, _), key in zip(plan.block, plan.keys):
+            if idx in miss_indexes:
+                self.misses += 1
+                rows.extend(computed.get(idx, []))
+                continue
+            stored = plan.found.get(key)
+            if stored is not None:
+                self.hits += 1
+            else:
+                stored = fresh.get(key, [])
+                self.duplicates += 1
+            rows.extend(dict(row, email_index=idx, cached=True) for row in stored)
+        return rows
+
+    def store(self, rows):
+        """Righe di risultato in ordine di email_index: salva quelle calcolate con defer e le restituisce."""
+        for email_index, group in iter_groups(rows):
+            key = self.deferred.pop(email_index, None)
+            if key is not None:
+                self.put_many({key: [{k: v for k, v in row.items() if k != 'email_index'} for row in group]})
+            yield from group
+
+    def report(self):
+        total = self.hits + self.duplicates + self.misses
+        return (f"Cache {self.extractor}: {self.hits} hit, {self.duplicates} duplicati nel blocco, "
+                f"{self.misses} analizzate su {total} email ({self.path})")
+
+    def close(self):
+        self.conn.close()
+
+
+def iter_planned(record_blocks, plan_block, compute, finish):
+    """Scheletro comune di iter_with_cache e dedup_minhash.iter_deduplicated.
+
+    plan_block(block) restituisce (piano, email da calcolare); compute riceve i blocchi delle
+    email da calcolare e restituisce una riga per email in ordine; finish(piano, {email_index: riga})
+    restituisce le righe dell'intero blocco. I blocchi completi escono prima di leggerne altri:
+    anche se compute non ha nulla da calcolare (tutti hit) in memoria resta un blocco alla volta.
+    """
+    record_blocks = iter(record_blocks)
+    plans = deque()         # (piano, email da calcolare) in attesa di essere restituiti
+    queued = deque()        # Email da calcolare dei blocchi letti qui, non ancora passate a compute
+    computed = {}
+
+    def next_plan():
+        block = next(record_blocks, None)
+        if block is None:
+            return None
+        plan, misses = plan_block(block)
+        plans.append((plan, misses))
+        return misses
+
+    def miss_blocks():
+        while True:
+            if queued:
+                yield queued.popleft()
+                continue
+            # compute chiede un blocco prima di aver restituito le righe dei precedenti
+            misses = next_plan()
+            if misses is None:
+                return
+            if misses:
+                yield misses
+
+    def ready():
+        while plans and all(idx in computed for idx, _ in plans[0][1]):
+            plan, misses = plans.popleft()
+            yield from finish(plan, {idx: computed.pop(idx) for idx, _ in misses})
+
+    results = iter(compute(miss_blocks()))
+    while True:
+        yield from ready()
+        if plans:
+            result = next(results, None)
+            if result is None:
+                break
+            computed[result['email_index']] = result
+        else:
+            misses = next_plan()
+            if misses is None:
+                break
+            if misses:
+                queued.append(misses)
+    yield from ready()
+
+
+def iter_with_cache(cache, record_blocks, compute):
+    """Applica la cache a un estrattore in streaming.
+
+    compute riceve un iterabile di blocchi (solo le email da analizzare) e restituisce
+    una riga per email in ordine, come iter_results degli estrattori: così un Pool di
+    processi resta aperto per tutta l'esecuzione. Le righe escono in ordine di email_index.
+    """
+    def plan_block(block):
+        plan = cache.plan(block)
+        return plan, plan.misses
+
+    def finish(plan, computed):
+        return cache.complete(plan, {idx: [row] for idx, row in computed.items()})
+
+    return iter_planned(record_blocks, plan_block, compute, finish)
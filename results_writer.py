@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import zlib
+
+# Scrittura dei file di risultati comune a tutti gli estrattori, sicura rispetto alle interruzioni.
+# Accanto a <output>.jsonl c'è un manifest <output>.manifest con:
+# - l'offset in byte fino a cui il file di output è stato scritto e sincronizzato (fsync);
+# - la bitmap degli email_index completati (compressa con zlib: i run contigui occupano pochi byte).
+# Il manifest viene riscritto in modo atomico (file temporaneo + fsync + os.replace) solo dopo
+# l'fsync dell'output, ogni FSYNC_EVERY email o FSYNC_SECONDS secondi.
+#
+# Al riavvio l'output viene troncato all'offset del manifest: le righe scritte dopo l'ultimo
+# checkpoint appartengono a email non segnate nella bitmap e vengono rielaborate una volta sola.
+# Le righe di un'email (più chunk) entrano tutte nello stesso checkpoint: niente righe doppie.
+# Il resume non rilegge il file di output; i file senza manifest (esecuzioni precedenti)
+# vengono letti una volta sola per ricostruirlo.
+#
+# Opzionale: con index_file le email completate vanno anche nell'indice delle entità
+# (entity_index.py) sotto la sorgente index_source, salvata alla chiusura dopo l'ultimo checkpoint.
+
+FSYNC_EVERY = 100          # Email tra due checkpoint
+FSYNC_SECONDS = 5.0        # Tempo massimo tra due checkpoint (le email del LLM sono lente)
+MANIFEST_FORMAT = 1
+
+
+def manifest_path(output_file):
+    base, _ = os.path.splitext(output_file)
+    return base + ".manifest"
+
+
+def _fsync_dir(path):
+    # Rende persistente il rename del manifest (non supportato su Windows)
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _is_last_chunk(row):
+    """True se la riga chiude la sua email: righe uniche o ultimo chunk ("3/3")."""
+    chunk = str(row.get('chunk', '1/1')).split('/')
+    return len(chunk) != 2 or chunk[0] == chunk[1]
+
+
+def iter_groups(rows):
+    """(email_index, [righe]) per gruppi consecutivi di righe della stessa email."""
+    group = []
+    for row in rows:
+        if group and row['email_index'] != group[0]['email_index']:
+            yield group[0]['email_index'], group
+            group = []
+        group.append(row)
+    if group:
+        yield group[0]['email_index'], group
+
+
+class ResultsWriter:
+    """Output JSONL con manifest: commit per email, fsync a gruppi, resume senza rileggere il file."""
+
+    def __init__(self, path, resume=True, fsync_every=FSYNC_EVERY, fsync_seconds=FSYNC_SECONDS,
+                 index_file=None, index_source=None):
+        self.path = path
+        self.manifest = manifest_path(path)
+        self.fsync_every = fsync_every
+        self.fsync_seconds = fsync_seconds
+        self.bitmap = bytearray()
+        self.completed = 0
+        self.first_missing = 0
+        self.offset = 0
+
+        if not resume:
+            open(path, 'wb').close()
+        elif os.path.exists(self.manifest) and self._load_manifest():
+            pass
+        elif os.path.exists(path):
+            self._rebuild_manifest()
+
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'wb')
+        # Righe scritte dopo l'ultimo checkpoint: le loro email non sono nella bitmap
+        self.file.truncate(self.offset)
+        self.file.seek(self.offset)
+        self.uncommitted = 0
+        self.last_checkpoint = time.monotonic()
+        self._write_manifest()
+
+        self.index = None
+        self.index_file = index_file
+        self.index_source = index_source or os.path.splitext(os.path.basename(path))[0]
+        if index_file is not None:
+            # Import solo su richiesta: gli altri writer non caricano l'indice
+            from entity_index import EntityIndex
+            self.index = EntityIndex.load(index_file)
+            if self.completed == 0:
+                # Output ripartito da zero: niente postings di un'esecuzione precedente
+                self.index.replace_source(self.index_source, [])
+
+    # --- BITMAP ---
+    def is_done(self, email_index):
+        byte = email_index >> 3
+        return byte < len(self.bitmap) and bool(self.bitmap[byte] & (1 << (email_index & 7)))
+
+    def _mark(self, email_index):
+        byte = email_index >> 3
+        if byte >= len(self.bitmap):
+            self.bitmap.extend(bytes(byte - len(self.bitmap) + 1))
+        self.bitmap[byte] |= 1 << (email_index & 7)
+        self.completed += 1
+        while self.is_done(self.first_missing):
+            self.first_missing += 1
+
+    def _find_first_missing(self):
+        byte = 0
+        while byte < len(self.bitmap) and self.bitmap[byte] == 0xFF:
+            byte += 1
+        self.first_missing = byte * 8
+        while self.is_done(self.first_missing):
+            self.first_missing += 1
+
+    @property
+    def start_index(self):
+        """Primo email_index non ancora completato: da qui riparte la lettura del corpus."""
+        return self.first_missing
+
+    # --- MANIFEST ---
+    def _output_matches(self, offset):
+        """True se l'output contiene almeno offset byte e l'ultimo prima dell'offset chiude una riga."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < offset:
+            return False
+        if offset == 0:
+            return True
+        with open(self.path, 'rb') as f:
+            f.seek(offset - 1)
+            return f.read(1) == b"\n"
+
+    def _load_manifest(self):
+        """Carica il manifest; False (manifest ignorato) se non corrisponde al file di output."""
+        with open(self.manifest, 'rb') as f:
+            header = json.loads(f.readline())
+            bitmap = bytearray(zlib.decompress(f.read()))
+        if not self._output_matches(header['offset']):
+            # Output cancellato o sostituito: la bitmap segnerebbe come fatte email mai scritte
+            print(f"Manifest {self.manifest} non corrisponde a {self.path}: ignorato")
+            return False
+        self.bitmap = bitmap
+        self.offset = header['offset']
+        self.completed = header['completed']
+        self._find_first_missing()
+        return True
+
+    def _rebuild_manifest(self):
+        """Output senza manifest: una lettura del file, fino all'ultima email con tutte le righe."""
+        position = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError
+                    row = json.loads(line)
+                    email_index = row['email_index']
+                except (ValueError, KeyError):
+                    break  # Riga scritta a metà da un'esecuzione interrotta
+                position += len(line)
+                if _is_last_chunk(row) and not self.is_done(email_index):
+                    self._mark(email_index)
+                    self.offset = position
+        print(f"Manifest ricostruito da {self.path}: {self.completed} email complete")
+
+    def _write_manifest(self):
+        header = {'format': MANIFEST_FORMAT, 'output': os.path.basename(self.path),
+                  'offset': self.offset, 'completed': self.completed, 'start_index': self.first_missing}
+        tmp = self.manifest + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b"\n")
+            f.write(zlib.compress(bytes(self.bitmap)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest)
+        _fsync_dir(self.manifest)
+
+    def iter_committed(self):
+        """Righe già scritte fino all'ultimo checkpoint, per ricostruire lo stato di un estrattore al resume."""
+        with open(self.path, 'rb') as f:
+            position = 0
+            for line in f:
+                position += len(line)
+                if position > self.offset:
+                    return
+                yield json.loads(line)
+
+    # --- SCRITTURA ---
+    def commit(self, email_index, rows):
+        """Scrive tutte le righe di un'email; False se l'email era già completata (nessuna riga doppia)."""
+        if self.is_done(email_index):
+            return False
+        self.file.write(b"".join(json.dumps(row, ensure_ascii=False).encode('utf-8') + b"\n" for row in rows))
+        self._mark(email_index)
+        if self.index is not None:
+            self.index.add_rows(self.index_source, rows)
+        self.uncommitted += 1
+        if (self.uncommitted >= self.fsync_every
+                or time.monotonic() - self.last_checkpoint >= self.fsync_seconds):
+            self.checkpoint()
+        return True
+
+    def checkpoint(self):
+        """fsync dell'output, poi manifest con il nuovo offset e la bitmap."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.offset = self.file.tell()
+        self._write_manifest()
+        self.uncommitted = 0
+        self.last_checkpoint = time.monotonic()
+
+    def close(self):
+        if self.file is not None:
+            self.checkpoint()
+            self.file.close()
+            self.file = None
+            if self.index is not None:
+                self.index.save_source(self.index_source, self.index_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,187 @@
+import json
+import re
+import sys
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from chunking import estimate_tokens
+
+# Server locale OpenAI-compatibile che non carica nessun modello: risponde a
+# /v1/chat/completions rigiocando le risposte già salvate in pii_analysis_results_llama.jsonl.
+# Serve per provare OpenAIHTTPBackend e la pipeline senza GPU.
+# Risponde anche come l'API Gemini (/v1beta/models/<modello>:generateContent) con le
+# risposte di gemini_with_index_modified.jsonl, per provare gemini_analysis.py senza quota;
+# fail_rate simula le risposte 429 (quota esaurita) con Retry-After.
+
+CANNED_FILE = 'pii_analysis_results_llama.jsonl'
+GEMINI_CANNED_FILE = 'gemini_with_index_modified.jsonl'
+HOST = '127.0.0.1'
+PORT = 8000
+
+USER_PATTERN = re.compile(r'email-(\d+)-chunk-(\d+)')
+GEMINI_PATH_PATTERN = re.compile(r'/v1beta/models/[^/:]+:generateContent')
+
+def load_canned_responses(file_path):
+    """Restituisce {(email_index, chunk): testo della risposta} e la lista in ordine di file."""
+    responses = {}
+    ordered = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'raw_response' in entry:
+                # Risposte non parsabili rigiocate così come le aveva prodotte il modello
+                text = entry['raw_response']
+            else:
+                text = json.dumps({k: entry.get(k, []) for k in ('names', 'emails', 'phones')}, ensure_ascii=False)
+            chunk = int(str(entry.get('chunk', '1/1')).split('/')[0])
+            responses[(entry['email_index'], chunk)] = text
+            ordered.append(text)
+    return responses, ordered
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, come vLLM
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/v1/models':
+            self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        if GEMINI_PATH_PATTERN.fullmatch(self.path.split('?')[0]):
+            self._gemini(request)
+            return
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self._send_json(404, {"error": "not found"})
+            return
+
+        content = self.server.next_response(request.get('user', ''))
+        # Conteggi stimati (nessun tokenizer): servono a provare le metriche dei token
+        prompt_tokens = sum(estimate_tokens([str(m.get('content', '')) for m in request.get('messages', [])]))
+        completion_tokens = estimate_tokens([content])[0]
+        if self.server.seconds_per_token:
+            # Latenza simulata di decodifica, proporzionale ai token della risposta
+            time.sleep(completion_tokens * self.server.seconds_per_token)
+        self._send_json(200, {
+            "id": "stub-completion",
+            "object": "chat.completion",
+            "model": request.get('model', 'stub'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _gemini(self, request):
+        if self.server.fail_rate and random.random() < self.server.fail_rate:
+            body = json.dumps({"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                                         "message": "Quota exceeded (stub)"}}).encode('utf-8')
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        content = self.server.next_gemini_response(self.headers.get('X-Email-Index', ''))
+        prompt_texts = [part.get('text', '') for message in request.get('contents', [])
+                        for part in message.get('parts', [])]
+        prompt_tokens = sum(estimate_tokens(prompt_texts)) if prompt_texts else 0
+        completion_tokens = estimate_tokens([content])[0]
+        if self.server.seconds_per_token:
+            time.sleep(completion_tokens * self.server.seconds_per_token)
+        self._send_json(200, {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": content}]},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": completion_tokens,
+                "totalTokenCount": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, canned_file=CANNED_FILE, seconds_per_token=0.0,
+                 gemini_file=GEMINI_CANNED_FILE, fail_rate=0.0):
+        super().__init__(address, StubHandler)
+        self.responses, self.ordered = load_canned_responses(canned_file)
+        self.gemini_responses, self.gemini_ordered = load_canned_responses(gemini_file)
+        self.seconds_per_token = seconds_per_token
+        self.fail_rate = fail_rate
+        self._lock = threading.Lock()
+        self._cursor = 0
+        self._gemini_cursor = 0
+
+    def next_response(self, user):
+        match = USER_PATTERN.fullmatch(user)
+        if match:
+            key = (int(match.group(1)), int(match.group(2)))
+            if key in self.responses:
+                return self.responses[key]
+        # Richiesta senza identificativo noto: risposte in ordine di file, a rotazione
+        with self._lock:
+            text = self.ordered[self._cursor % len(self.ordered)]
+            self._cursor += 1
+        return text
+
+    def next_gemini_response(self, email_index):
+        if email_index.isdigit() and (int(email_index), 1) in self.gemini_responses:
+            return self.gemini_responses[(int(email_index), 1)]
+        with self._lock:
+            text = self.gemini_ordered[self._gemini_cursor % len(self.gemini_ordered)]
+            self._gemini_cursor += 1
+        return text
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub_server(host=HOST, port=0, canned_file=CANNED_FILE, seconds_per_token=0.0,
+                      gemini_file=GEMINI_CANNED_FILE, fail_rate=0.0):
+    """Avvia lo stub in un thread di background (port=0 sceglie una porta libera)."""
+    server = StubLLMServer((host, port), canned_file, seconds_per_token, gemini_file, fail_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    server = StubLLMServer((HOST, port))
+    print(f"Stub server su {server.url} ({len(server.ordered)} risposte da {CANNED_FILE})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Gli script del progetto sono moduli piatti nella cartella principale
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
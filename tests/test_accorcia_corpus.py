@@ -0,0 +1,70 @@
+import os
+import re
+from multiprocessing import Pool
+import pandas as pd
+import pytest
+from accorcia_corpus import clean_series, iter_corpus_chunks, INPUT_FILE, MESSAGE_COLUMN, CHUNKSIZE
+
+# I motori veloci (regole precompilate, Series.str, Pool) devono dare lo stesso output
+# byte per byte della versione originale con sette re.sub in sequenza.
+
+# Messaggi nel formato del corpus sanders-r (header completi), con i casi limite delle regole
+SAMPLE_MESSAGES = [
+    "Message-ID: <1.JavaMail.evans@thyme>\nDate: Mon, 14 May 2001 16:39:00 -0700 (PDT)\n"
+    "From: richard.sanders@enron.com\nTo: gail.brownfeld@enron.com\nSubject: Re: deposition\n"
+    "Mime-Version: 1.0\nContent-Type: text/plain; charset=us-ascii\nContent-Transfer-Encoding: 7bit\n"
+    "X-From: Richard B Sanders\nX-To: Gail Brownfeld\nX-cc: \nX-bcc: \n"
+    "X-Folder: \\Richard_Sanders_Oct2001\\Notes Folders\\All documents\nX-Origin: Sanders-R\n"
+    "X-FileName: rsanders.nsf\n\nPlease call me.\n\n\n\n"
+    "---------------------- Forwarded by Richard B Sanders/HOU/ECT on 05/14/2001 ----------\n\n"
+    "Office: (713) 853-5587\nwww.enron.com\n<<deposition.doc>>\nThanks\n",
+    "\n\n  X-Mailer: Lotus\n\n\nMessage-ID: <2>\n \nBody text\n-----\nForwarded by x\n",
+    "Office:\n713 555 1234\n<< a >>\n\n\n\nwww.\n",
+    None,
+    "plain text without headers",
+]
+
+
+def clean_email_text_reference(raw_text):
+    """Versione originale (sette re.sub in sequenza)."""
+    if not isinstance(raw_text, str):
+        return ""
+
+    content = raw_text.strip()
+
+    content = re.sub(r'^\s*(Message-ID|Mime-Version|Content-Type|Content-Transfer-Encoding|X-Folder|X-Origin|X-FileName):.*$',
+                     '', content, flags=re.MULTILINE | re.IGNORECASE)
+    content = re.sub(r'^\s*X-(cc|bcc|From|To|Origin|FileName|Mailer|User-Agent|Priority|UID|Status|User|Ref|Attachment|Keywords):.*$',
+                     '', content, flags=re.MULTILINE | re.IGNORECASE)
+    content = re.sub(r'^\s*-+\s*Forwarded by.*$', '', content, flags=re.MULTILINE | re.IGNORECASE)
+    content = re.sub(r'^\s*Office:\s*\(?\d+\)?.*$', '', content, flags=re.MULTILINE)
+    content = re.sub(r'^\s*www\..*$', '', content, flags=re.MULTILINE)
+    content = re.sub(r'^[<]+.*[>]+$', '', content, flags=re.MULTILINE)
+    content = re.sub(r'\n{3,}', '\n\n', content).strip()
+
+    return content
+
+
+def _mismatches(messages, mode):
+    messages = pd.Series(list(messages), dtype=object)
+    expected = messages.apply(clean_email_text_reference)
+    if mode == "pool":
+        with Pool(processes=2) as pool:
+            cleaned = clean_series(messages, mode, pool)
+    else:
+        cleaned = clean_series(messages, mode)
+    return [i for i in range(len(messages)) if cleaned.iloc[i] != expected.iloc[i]]
+
+
+@pytest.mark.parametrize("mode", ["single", "vectorized", "pool"])
+def test_engines_match_reference(mode):
+    assert _mismatches(SAMPLE_MESSAGES, mode) == []
+
+
+@pytest.mark.skipif(not os.path.exists(INPUT_FILE), reason=f"{INPUT_FILE} non presente")
+@pytest.mark.parametrize("mode", ["single", "vectorized"])
+def test_engines_match_reference_on_corpus(mode):
+    messages = []
+    for chunk in iter_corpus_chunks(INPUT_FILE, columns=[MESSAGE_COLUMN], chunksize=CHUNKSIZE):
+        messages.extend(chunk[MESSAGE_COLUMN].tolist())
+    assert _mismatches(messages, mode) == []
@@ -0,0 +1,15 @@
+import pytest
+
+pytest.importorskip('presidio_analyzer')
+
+from cascade_analysis import merge_with_llm  # noqa: E402
+
+REGEX = {'email_index': 3, 'seconds': 0.01, 'names': [], 'emails': ['a@enron.com'], 'phones': []}
+PRESIDIO = {'email_index': 3, 'seconds': 0.2, 'names': ['Sara Shackleton'], 'emails': [], 'phones': []}
+
+
+def test_missing_llm_rows_fall_back_to_presidio_names():
+    merged = merge_with_llm(3, REGEX, PRESIDIO, [], ['thread'])
+    assert merged['llm_error'] is True
+    assert merged['names'] == ['Sara Shackleton']
+    assert merged['emails'] == ['a@enron.com']
@@ -0,0 +1,59 @@
+import random
+import pytest
+from chunking import chunk_text
+
+# Ogni chunk deve far avanzare l'offset finale e i chunk devono coprire tutto il testo:
+# un chunk che ripete solo la coda del precedente costa una generazione senza testo nuovo.
+
+SAMPLE_TEXTS = [
+    'Hello Sara Shackleton.\n' * 50 + 'x' * 3000,
+    'Short line.\n' * 300,
+    'One very long sentence without breaks ' * 200,
+    ('Thanks, Mark Taylor.\n' + 'y' * 450 + '\n') * 10,
+    '',
+]
+
+
+def chunk_problems(text, max_tokens, overlap_tokens):
+    """Problemi dei chunk del testo: fine che non avanza, buchi o testo diverso dall'originale."""
+    chunks = chunk_text(text, max_tokens, overlap_tokens)
+    problems = []
+    covered = 0
+    for prev, chunk in zip([None] + chunks, chunks):
+        if prev is not None and chunk.end <= prev.end:
+            problems.append(f"chunk {chunk.start}-{chunk.end} non avanza oltre {prev.end}")
+        if chunk.start > covered:
+            problems.append(f"testo {covered}-{chunk.start} in nessun chunk")
+        if chunk.text != text[chunk.start:chunk.end]:
+            problems.append(f"chunk {chunk.start}-{chunk.end} con testo diverso dall'originale")
+        covered = max(covered, chunk.end)
+    if covered < len(text):
+        problems.append(f"testo {covered}-{len(text)} in nessun chunk")
+    return problems
+
+
+def random_cases(trials=200, seed=42):
+    rng = random.Random(seed)
+    for _ in range(trials):
+        lines = [rng.choice(['Hi Sara.', 'Call me at 713-853-5620.', 'z' * rng.randint(1, 900)])
+                 for _ in range(rng.randint(1, 40))]
+        max_tokens = rng.randint(10, 200)
+        yield '\n'.join(lines), max_tokens, rng.randint(0, max_tokens)
+
+
+@pytest.mark.parametrize("text", SAMPLE_TEXTS)
+def test_chunks_advance_and_cover(text):
+    assert chunk_problems(text, 100, 20) == []
+
+
+def test_chunks_advance_and_cover_random():
+    failed = [(max_tokens, overlap, problems[0]) for text, max_tokens, overlap in random_cases()
+              for problems in [chunk_problems(text, max_tokens, overlap)] if problems]
+    assert failed == []
+
+
+def test_overlap_repeats_tail_of_previous_chunk():
+    text = ''.join(f'Line {i:03d} of the thread.\n' for i in range(60))
+    chunks = chunk_text(text, 40, 10)
+    assert len(chunks) > 1
+    assert all(b.start < a.end for a, b in zip(chunks, chunks[1:]))
@@ -0,0 +1,54 @@
+import os
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from corpus_reader import (iter_record_blocks, write_csv_copy, format_chunk_joined, format_chunk_full,
+                           CSV_CORPUS_FILE, PARQUET_CORPUS_FILE)
+
+# Lo stesso corpus letto dal CSV (write_csv_copy) e dal Parquet deve dare testi identici agli
+# estrattori: altrimenti i risultati delle due versioni non sono confrontabili per email_index.
+
+SAMPLE_RECORDS = {
+    'subject': ['Re: contract', None, 'Rates, "final"', ''],
+    'from': ['sara.shackleton@enron.com', 'mark.taylor@enron.com', "o'neal@enron.com", ''],
+    'to': [['mark.taylor@enron.com', 'tana.jones@enron.com'], [], ["d'arcy@enron.com"], ['a, b <x@y.com>']],
+    'cc': [[], None, ['carol.clair@enron.com'], []],
+    'bcc': [[], [], ['carol.clair@enron.com'], []],
+    'date': [datetime(2001, 5, 14, 16, 39), datetime(2000, 1, 3, 9, 0, 5), None, datetime(2001, 12, 31)],
+    'body': ['Call me at 713-853-5620.\nSara', 'Line one\n\nLine "two"', None, 'x,y'],
+    'file_name': ['allen-p/_sent_mail/1.', 'taylor-m/inbox/2.', 'jones-t/3.', 'clair-c/4.'],
+}
+FORMATTERS = [format_chunk_joined, format_chunk_full]
+
+
+def texts(path, formatter):
+    return [item for block in iter_record_blocks(path, formatter) for item in block]
+
+
+@pytest.fixture
+def sample_files(tmp_path):
+    csv_path, parquet_path = str(tmp_path / 'sample.csv'), str(tmp_path / 'sample.parquet')
+    write_csv_copy(SAMPLE_RECORDS, csv_path)
+    table = pa.Table.from_pydict(SAMPLE_RECORDS)
+    pq.write_table(table.append_column('email_index', pa.array(range(table.num_rows))), parquet_path)
+    return csv_path, parquet_path
+
+
+@pytest.mark.parametrize("formatter", FORMATTERS, ids=lambda f: f.__name__)
+def test_csv_and_parquet_give_same_text(sample_files, formatter):
+    csv_path, parquet_path = sample_files
+    assert texts(csv_path, formatter) == texts(parquet_path, formatter)
+
+
+def test_lists_rendered_like_pandas(sample_files):
+    _, parquet_path = sample_files
+    first = texts(parquet_path, format_chunk_joined)[0][1]
+    assert "['mark.taylor@enron.com', 'tana.jones@enron.com']" in first
+
+
+@pytest.mark.skipif(not (os.path.exists(CSV_CORPUS_FILE) and os.path.exists(PARQUET_CORPUS_FILE)),
+                    reason="campione CSV e Parquet non presenti")
+@pytest.mark.parametrize("formatter", FORMATTERS, ids=lambda f: f.__name__)
+def test_sample_corpus_csv_and_parquet_give_same_text(formatter):
+    assert texts(CSV_CORPUS_FILE, formatter) == texts(PARQUET_CORPUS_FILE, formatter)
@@ -0,0 +1,71 @@
+import json
+from entity_index import EntityIndex, main
+from results_writer import ResultsWriter
+
+
+def row(email_index, names=(), emails=()):
+    return {'email_index': email_index, 'seconds': 0.0, 'names': list(names), 'emails': list(emails), 'phones': []}
+
+
+def write_rows(path, rows, index_file, resume=True):
+    writer = ResultsWriter(str(path), resume=resume, index_file=str(index_file), index_source='regex')
+    for r in rows:
+        writer.commit(r['email_index'], [r])
+    writer.close()
+
+
+def test_writer_streams_committed_emails_into_index(tmp_path):
+    index_file = tmp_path / 'index.pickle'
+    write_rows(tmp_path / 'out.jsonl', [row(0, ['Sara Shackleton']), row(1, emails=['Sara.Shackleton@enron.com'])],
+               index_file)
+    index = EntityIndex.load(str(index_file))
+    assert list(index.lookup('shackleton sara', 'names', 'regex').values())[0].tolist() == [0]
+    assert index.exposure('Sara Shackleton', 'names')[0]['total_emails'] == 2
+
+
+def test_resume_skips_emails_already_indexed(tmp_path):
+    index_file, output = tmp_path / 'index.pickle', tmp_path / 'out.jsonl'
+    write_rows(output, [row(0, ['Sara Shackleton'])], index_file)
+    # Stessa email riproposta al resume (già nel manifest) più una nuova
+    write_rows(output, [row(0, ['Mark Taylor']), row(1, ['Sara Shackleton'])], index_file)
+    index = EntityIndex.load(str(index_file))
+    assert index.lookup('Mark Taylor', 'names', 'regex') == {}
+    assert list(index.lookup('Sara Shackleton', 'names', 'regex').values())[0].tolist() == [0, 1]
+    assert index.indexed['regex'] == {0, 1}
+
+
+def test_add_rows_skips_email_already_held():
+    index = EntityIndex()
+    index.add_rows('regex', [row(3, ['Sara Shackleton'])])
+    index.add_rows('regex', [row(3, ['Mark Taylor'])])
+    assert index.lookup('Mark Taylor', 'names', 'regex') == {}
+
+
+def test_fresh_run_replaces_source(tmp_path):
+    index_file, output = tmp_path / 'index.pickle', tmp_path / 'out.jsonl'
+    write_rows(output, [row(0, ['Sara Shackleton'])], index_file)
+    write_rows(output, [row(0, ['Mark Taylor'])], index_file, resume=False)
+    index = EntityIndex.load(str(index_file))
+    assert index.lookup('Sara Shackleton', 'names', 'regex') == {}
+    assert index.lookup('Mark Taylor', 'names', 'regex') != {}
+
+
+def test_writer_keeps_other_sources(tmp_path):
+    index_file = tmp_path / 'index.pickle'
+    other = EntityIndex()
+    other.add_rows('presidio', [row(5, ['Tana Jones'])])
+    other.save(str(index_file))
+    write_rows(tmp_path / 'out.jsonl', [row(0, ['Sara Shackleton'])], index_file)
+    index = EntityIndex.load(str(index_file))
+    assert set(index.postings) == {'presidio', 'regex'}
+
+
+def test_build_replaces_source_from_file(tmp_path):
+    index_file, results = tmp_path / 'index.pickle', tmp_path / 'a.jsonl'
+    results.write_text(''.join(json.dumps(r) + '\n' for r in [row(1, ['Sara Shackleton']), row(3, ['Mark Taylor'])]))
+    main(['--index', str(index_file), 'build', f'llama={results}'])
+    results.write_text(json.dumps(row(1, ['Sara Shackleton'])) + '\n')
+    main(['--index', str(index_file), 'build', f'llama={results}'])
+    index = EntityIndex.load(str(index_file))
+    assert index.lookup('Mark Taylor', 'names', 'llama') == {}
+    assert index.indexed['llama'] == {1}
@@ -0,0 +1,15 @@
+from entity_keys import ENTITY_KEYS, entity_key
+
+
+def test_names_ignore_order_case_and_spacing():
+    assert entity_key('names', 'Shackleton  SARA') == entity_key('names', 'sara shackleton') == 'sara shackleton'
+    assert ENTITY_KEYS['names']('Sara Shackleton') == frozenset({'sara', 'shackleton'})
+
+
+def test_emails_lowercased():
+    assert entity_key('emails', 'Sara.Shackleton@Enron.com') == 'sara.shackleton@enron.com'
+
+
+def test_phones_compared_by_digits():
+    assert entity_key('phones', '(713) 853-5620') == entity_key('phones', '713.853.5620') == '7138535620'
+    assert entity_key('phones', 'x') == 'x'
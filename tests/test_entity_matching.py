@@ -0,0 +1,52 @@
+import random
+from entity_matching import calculate_metrics, metrics_from_counts
+
+# calculate_metrics deve dare gli stessi valori del confronto a coppie con list.remove
+# (ground_truth_validator.py originale) su liste con duplicati, stringhe vuote e valori non stringa.
+
+SAMPLE_ENTITIES = [
+    'Sara Shackleton', 'shackleton sara', 'SARA  SHACKLETON', 'Sara', 'Mark Taylor', 'taylor, mark',
+    'sara.shackleton@enron.com', 'Sara.Shackleton@Enron.com', '713-853-5620', '(713) 853-5620',
+    '', '   ', None, 42, 3.5, ['Sara'],
+]
+
+
+def are_entities_equal(ent1, ent2):
+    words1 = set(str(ent1).lower().strip().split())
+    words2 = set(str(ent2).lower().strip().split())
+    return words1 == words2 and len(words1) > 0
+
+
+def calculate_metrics_reference(pred_list, true_list):
+    """Confronto a coppie originale (O(n*m))."""
+    preds = [str(x).strip() for x in pred_list]
+    trues = [str(x).strip() for x in true_list]
+    tp = 0
+    remaining_trues = list(trues)
+    for p in preds:
+        for t in remaining_trues:
+            if are_entities_equal(p, t):
+                tp += 1
+                remaining_trues.remove(t)
+                break
+    return metrics_from_counts(tp, len(preds) - tp, len(trues) - tp)
+
+
+def test_matches_pairwise_reference_on_random_lists():
+    rng = random.Random(42)
+    mismatches = []
+    for _ in range(100000):
+        pred = [rng.choice(SAMPLE_ENTITIES) for _ in range(rng.randint(0, 8))]
+        true = [rng.choice(SAMPLE_ENTITIES) for _ in range(rng.randint(0, 8))]
+        if calculate_metrics(pred, true) != calculate_metrics_reference(pred, true):
+            mismatches.append((pred, true))
+    assert mismatches[:3] == []
+
+
+def test_word_order_and_case_ignored():
+    assert calculate_metrics(['shackleton SARA'], ['Sara Shackleton']) == (1.0, 1.0, 1.0)
+
+
+def test_duplicates_counted_as_multiset():
+    precision, recall, _ = calculate_metrics(['Sara Shackleton', 'Sara Shackleton'], ['Sara Shackleton'])
+    assert (precision, recall) == (0.5, 1.0)
@@ -0,0 +1,38 @@
+import json
+import pytest
+from evaluate_systems import evaluate
+from entity_matching import strict_metrics_from_counts, metrics_from_counts
+
+
+def write_jsonl(path, rows):
+    path.write_text(''.join(json.dumps(r) + '\n' for r in rows))
+    return str(path)
+
+
+def row(email_index, names=()):
+    return {'email_index': email_index, 'names': list(names), 'emails': [], 'phones': []}
+
+
+def test_all_miss_email_scores_zero():
+    # Niente di giusto: la regola originale darebbe F1 = 1.0
+    assert metrics_from_counts(0, 2, 1)[2] == 1.0
+    assert strict_metrics_from_counts(0, 2, 1) == (0.0, 0.0, 0.0)
+
+
+@pytest.mark.parametrize("counts", [(0, 0, 3), (0, 3, 0)])
+def test_empty_side_with_errors_scores_zero(counts):
+    assert strict_metrics_from_counts(*counts) == (0.0, 0.0, 0.0)
+
+
+def test_perfect_and_empty_email_scores_one():
+    assert strict_metrics_from_counts(0, 0, 0) == (1.0, 1.0, 1.0)
+    assert strict_metrics_from_counts(2, 0, 0) == (1.0, 1.0, 1.0)
+
+
+def test_macro_f1_not_above_precision_and_recall(tmp_path):
+    reference = write_jsonl(tmp_path / 'human.jsonl', [row(0, ['Sara Shackleton']), row(1, ['Mark Taylor'])])
+    system = write_jsonl(tmp_path / 'sys.jsonl', [row(0, ['Sara Shackleton']), row(1, ['Tana Jones'])])
+    report, _ = evaluate(reference, {'sys': system})
+    p, r, f1 = report['sys']['metrics']['names']['macro']
+    assert (p, r, f1) == (0.5, 0.5, 0.5)
+    assert report['sys']['metrics']['names']['counts'] == (1, 1, 1)
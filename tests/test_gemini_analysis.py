@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from gemini_analysis import run
+from instrumentation import StageMetrics
+from results_writer import ResultsWriter
+
+
+class FakeClient:
+    """generate(): risposta subito per l'email 0, errore inatteso per la 1, attesa lunga per le altre."""
+
+    def __init__(self):
+        self.retries = 0
+        self.cancelled = []
+
+    async def generate(self, email_index, email_content, metrics):
+        if email_index == 0:
+            return '{"names": [], "emails": [], "phones": []}', {}
+        if email_index == 1:
+            await asyncio.sleep(0.01)
+            raise ValueError("risposta inattesa")
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            self.cancelled.append(email_index)
+            raise
+
+
+def test_unexpected_error_cancels_pending_requests(tmp_path):
+    client = FakeClient()
+    writer = ResultsWriter(str(tmp_path / "out.jsonl"))
+    metrics = StageMetrics("test")
+    blocks = iter([[(i, f"email {i}") for i in range(4)]])
+
+    async def main():
+        with pytest.raises(ValueError):
+            await run(client, blocks, writer, metrics)
+        # Controllo prima che asyncio.run annulli da sé i task rimasti
+        return sorted(client.cancelled)
+
+    assert asyncio.run(main()) == [2, 3]
+    writer.close()
+    assert writer.start_index == 1
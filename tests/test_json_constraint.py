@@ -0,0 +1,38 @@
+from json_constraint import START, DONE, advance_text, build_token_texts, parse_constrained
+
+
+class FakeTokenizer:
+    all_special_ids = [0]
+    added_tokens_decoder = {}
+    vocab = ['<s>', '{', '"names', '":[]']
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def decode(self, ids):
+        return ''.join(self.vocab[i] for i in ids)
+
+
+def test_complete_object_reaches_done():
+    assert advance_text(START, '{"names": ["Sara"], "emails": [], "phones": []}') == DONE
+
+
+def test_unicode_escape_requires_four_hex_digits():
+    prefix = '{"names": ["'
+    assert advance_text(START, prefix + '\\u00e9') == ('str', 0, 1)
+    assert advance_text(START, prefix + '\\u00zz') is None
+    assert advance_text(START, prefix + '\\u"') is None
+
+
+def test_truncated_escape_is_completed():
+    parsed, truncated = parse_constrained('{"names": ["Jos\\u00')
+    assert truncated
+    assert parsed == {'names': ['Jos\x00'], 'emails': [], 'phones': []}
+
+
+def test_token_table_covers_padded_vocab():
+    texts = build_token_texts(FakeTokenizer(), vocab_size=8)
+    assert len(texts) == 8
+    assert texts[:4] == [None, '{', '"names', '":[]']
+    assert texts[4:] == [None] * 4
+    assert len(build_token_texts(FakeTokenizer())) == 4
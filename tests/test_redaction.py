@@ -0,0 +1,47 @@
+import pandas as pd
+
+from corpus_reader import format_chunk_full, format_chunk_joined
+from dedup_minhash import spread_entities
+from redaction import Pseudonymizer, body_spans, redact_chunk
+
+BODY = "Hi Sara,\nplease ask Sara  Shackleton (sara.shackleton@enron.com) to sign."
+
+
+def make_chunk():
+    return pd.DataFrame({'email_index': [0], 'subject': ['ISDA for Sara Shackleton'], 'from': ['mark.taylor@enron.com'],
+                         'body': [BODY]})
+
+
+def entities_from(formatter):
+    rep = {'email_index': 9, 'names': ['Sara Shackleton'], 'emails': ['sara.shackleton@enron.com'], 'phones': []}
+    row = spread_entities(rep, 0, formatter(make_chunk()).iloc[0])
+    found = tuple(sorted((c, v) for c in ('names', 'emails') for v in row[c]))
+    offsets = tuple(sorted((s['category'], s['text'], s['start'], s['end']) for s in row['entity_offsets']))
+    return found, offsets
+
+
+def test_offsets_mapped_to_body_for_both_formats():
+    pseudonymizer = Pseudonymizer("k")
+    name = pseudonymizer.token('names', 'Sara Shackleton')
+    for formatter in (format_chunk_joined, format_chunk_full):
+        record = make_chunk().iloc[0].to_dict()
+        spans, covered = body_spans(record, entities_from(formatter)[1])
+        assert covered == {('emails', 'sara.shackleton@enron.com')}   # il nome compare anche nell'oggetto
+        assert [BODY[a:b] for a, b, _ in spans] == ['sara.shackleton@enron.com']
+        chunk, _, replaced = redact_chunk(make_chunk(), [entities_from(formatter)], pseudonymizer)
+        body = chunk['body'].iloc[0]
+        assert f"ask {name} (" in body
+        assert 'shackleton@' not in body
+        # Limite documentato: la menzione parziale resta in chiaro
+        assert body.startswith("Hi Sara,")
+        assert chunk['subject'].iloc[0] == f"ISDA for {name}"
+        assert replaced == 3
+
+
+def test_offsets_that_do_not_match_fall_back_to_search():
+    pseudonymizer = Pseudonymizer("k")
+    found, _ = entities_from(format_chunk_joined)
+    wrong = (('names', 'Sara Shackleton', 0, 15),)
+    chunk, _, replaced = redact_chunk(make_chunk(), [(found, wrong)], pseudonymizer)
+    assert 'Shackleton' not in chunk['body'].iloc[0]
+    assert replaced == 3
@@ -0,0 +1,62 @@
+import os
+import pytest
+from corpus_reader import iter_record_blocks, format_chunk_joined, CHUNKSIZE
+from regex_analysis import (process_email, deep_clean, is_valid_name, EMAIL_REGEX, PHONE_REGEX, NAME_REGEX,
+                            INPUT_FILE)
+
+# La scansione con CONTACT_REGEX e NAME_SCAN_REGEX deve dare gli stessi risultati delle tre
+# scansioni separate (findall per email, telefoni e nomi) della versione originale.
+# Unica differenza voluta: i telefoni interni a un indirizzo email non vengono contati.
+
+SAMPLE_TEXTS = [
+    "Contact Sara.Shackleton@enron.com",
+    "Please write to Mark Taylor Mtaylor@aol.com today",
+    "Hi Jeff Dasovich, call (713) 853-5620 or x3456. Cc: Chet.Fenner@Enron.com and Vince Kaminski",
+    "Sent by John Smith, 713.555.1234, john.smith2001@yahoo.com, Monday June",
+    "",
+    None,
+]
+
+
+def process_email_reference(text, email_index):
+    """process_email con le tre scansioni separate (findall) della versione originale."""
+    if not isinstance(text, str):
+        text = ""
+    emails = EMAIL_REGEX.findall(text)
+    email_spans = [m.span() for m in EMAIL_REGEX.finditer(text)]
+    phones = [m.group() for m in PHONE_REGEX.finditer(text)
+              if not any(start <= m.start() < end for start, end in email_spans)]
+    names = [deep_clean(n) for n in NAME_REGEX.findall(text) if is_valid_name(n)]
+    return {
+        "email_index": email_index,
+        "names": sorted(set(names)),
+        "emails": sorted(set(deep_clean(e).lower() for e in emails)),
+        "phones": sorted(set(deep_clean(p) for p in phones)),
+    }
+
+
+def scan_mismatches(texts):
+    mismatches = []
+    for idx, text in enumerate(texts):
+        result = process_email(text, idx)
+        expected = process_email_reference(text, idx)
+        if any(result[field] != expected[field] for field in ("names", "emails", "phones")):
+            mismatches.append((idx, result, expected))
+    return mismatches
+
+
+@pytest.mark.parametrize("text", SAMPLE_TEXTS)
+def test_scan_matches_separate_scans(text):
+    assert scan_mismatches([text]) == []
+
+
+def test_name_does_not_eat_start_of_email():
+    result = process_email("Please write to Mark Taylor Mtaylor@aol.com today", 0)
+    assert result["emails"] == ["mtaylor@aol.com"]
+
+
+@pytest.mark.skipif(not os.path.exists(INPUT_FILE), reason=f"{INPUT_FILE} non presente")
+def test_scan_matches_separate_scans_on_corpus():
+    texts = [text for block in iter_record_blocks(INPUT_FILE, format_chunk_joined, chunksize=CHUNKSIZE)
+             for _, text in block]
+    assert scan_mismatches(texts)[:5] == []
@@ -0,0 +1,41 @@
+import pandas as pd
+
+from result_cache import ResultCache
+
+
+def reduced(chunk):
+    return chunk['body'].str.slice(0, 4)
+
+
+def full(chunk):
+    return chunk['body']
+
+
+def test_key_uses_full_text_not_reduced(tmp_path):
+    cache = ResultCache("test", path=str(tmp_path / "cache.sqlite"))
+    formatter = cache.keyed_formatter(full, reduced)
+    chunk = pd.DataFrame({'email_index': [0, 1], 'body': ['same start A', 'same start B']})
+    block = list(zip(chunk['email_index'].tolist(), formatter(chunk).tolist()))
+    assert block == [(0, 'same'), (1, 'same')]
+    plan = cache.plan(block)
+    # Stesso testo ridotto, email diverse: due analisi
+    assert [idx for idx, _ in plan.misses] == [0, 1]
+    assert cache.key_texts == {}
+    cache.close()
+
+
+def test_deferred_rows_stored_after_completion(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResultCache("test", path=path, defer=True)
+    plan = cache.plan([(0, 'text')])
+    rows = cache.complete(plan, {0: [{'email_index': 0, 'names': ['A B']}]})
+    assert cache.get_many(plan.keys) == {}
+    # Passo successivo (es. ThreadIndex.resolve) che completa la riga
+    rows = [dict(row, names=row['names'] + ['C D']) for row in rows]
+    assert list(cache.store(rows)) == rows
+    cache.close()
+
+    cache = ResultCache("test", path=path)
+    rows = cache.complete(cache.plan([(5, 'text')]), {})
+    assert rows == [{'names': ['A B', 'C D'], 'email_index': 5, 'cached': True}]
+    cache.close()
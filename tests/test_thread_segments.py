@@ -0,0 +1,27 @@
+from results_writer import ResultsWriter
+from thread_segments import ThreadIndex
+
+FORWARDED = ("-----Original Message-----\nFrom: Sara Shackleton\nSent: Monday\n\n"
+             + "Please call Mark Taylor about the ISDA schedule before Friday. " * 5)
+FIRST = "See below.\n" + FORWARDED
+SECOND = "Any news on this?\n" + FORWARDED
+
+
+def test_resume_rebuilds_seen_segments(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    writer = ResultsWriter(path)
+    writer.commit(0, [{'email_index': 0, 'names': ['Mark Taylor'], 'emails': [], 'phones': []}])
+    writer.close()
+
+    writer = ResultsWriter(path)
+    assert writer.start_index == 1
+    index = ThreadIndex()
+    index.restore([(0, FIRST)], writer.iter_committed())
+    writer.close()
+
+    # Il segmento inoltrato è già noto: resta solo la sua intestazione
+    reduced = index.reduce(1, SECOND)
+    assert 'ISDA' not in reduced and 'From: Sara Shackleton' in reduced
+    rows = list(index.resolve([{'email_index': 1, 'names': [], 'emails': [], 'phones': []}]))
+    assert rows[0]['names'] == ['Mark Taylor']
+    assert rows[0]['reused_segments'] == 1
@@ -0,0 +1,234 @@
+import re
+import time
+import hashlib
+from collections import namedtuple
+from chunking import estimate_tokens
+from entity_keys import ENTITY_KEYS
+from corpus_reader import iter_corpus_chunks, CORPUS_FILE
+from dedup_minhash import entity_pattern
+from results_writer import iter_groups
+
+# Ricostruzione dei thread: ogni risposta Enron ripete tutta la conversazione precedente
+# sotto "-----Original Message-----" o "Forwarded by", e ogni copia verrebbe divisa in
+# chunk e analizzata di nuovo. Il body viene diviso in segmenti (testo nuovo, messaggi
+# inoltrati o quotati); il contenuto di ogni segmento è indicizzato per hash su tutto il
+# corpus e inviato all'estrattore solo la prima volta che compare.
+#
+# Dei segmenti già visti resta solo l'intestazione (From/To/Sent/Subject: poche righe
+# con nomi e indirizzi); le entità del contenuto vengono copiate dalla prima email che lo
+# conteneva, cercandole nel testo del segmento. Gli offset dei chunk nelle righe di
+# risultato si riferiscono al body ridotto.
+
+INPUT_FILE = CORPUS_FILE
+TEXT_COLUMN = 'body'
+CHUNKSIZE = 5000
+MIN_SEGMENT_CHARS = 200     # Segmenti più corti ("Thanks", firme) restano sempre nel testo
+
+# Separatori di Outlook e Lotus Notes che aprono un messaggio precedente
+SEPARATOR_PATTERN = re.compile(
+    r'^[ \t]*-{2,}[ \t]*(?:Original Message|Forwarded by\b.*?)[ \t]*-*[ \t]*$', re.IGNORECASE)
+# Righe di intestazione del messaggio quotato ("From: ...", "John Smith on 05/14/2001 10:20 AM")
+HEADER_PATTERN = re.compile(
+    r'^[ \t]*(?:From|Sent|To|Cc|Bcc|Subject|Date)[ \t]*:|\bon \d{1,2}/\d{1,2}/\d{2,4}\b', re.IGNORECASE)
+QUOTE_PATTERN = re.compile(r'^[ \t]*>')
+LINE_PATTERN = re.compile(r'[^\n]*\n|[^\n]+$')
+
+# Segmento del body: intestazione in [start, content_start), contenuto in [content_start, end)
+Segment = namedtuple('Segment', ['kind', 'start', 'content_start', 'end'])
+
+
+def _header_end(lines, i):
+    """Indice della prima riga di contenuto dopo il separatore lines[i] e l'eventuale intestazione."""
+    j = i + 1
+    while j < len(lines) and not lines[j][2].strip():
+        j += 1
+    if j < len(lines) and HEADER_PATTERN.search(lines[j][2]):
+        # L'intestazione finisce alla prima riga vuota (le righe To: lunghe vanno a capo indentate)
+        while j < len(lines) and lines[j][2].strip():
+            j += 1
+    return j
+
+
+def split_thread(body):
+    """Segmenti del body in ordine: 'new' (testo scritto dal mittente), 'forward' (messaggio dopo
+    un separatore, con la sua intestazione) e 'quoted' (righe consecutive che iniziano con '>')."""
+    if not isinstance(body, str) or not body:
+        return []
+    lines = [(m.start(), m.end(), m.group()) for m in LINE_PATTERN.finditer(body)]
+    segments = []
+    kind, start, content_start = 'new', 0, 0
+    i = 0
+    while i < len(lines):
+        line_start, _, line = lines[i]
+        if SEPARATOR_PATTERN.match(line):
+            if line_start > start:
+                segments.append(Segment(kind, start, content_start, line_start))
+            j = _header_end(lines, i)
+            kind, start = 'forward', line_start
+            content_start = lines[j][0] if j < len(lines) else len(body)
+            i = j
+            continue
+        is_quote = bool(QUOTE_PATTERN.match(line))
+        if is_quote != (kind == 'quoted'):
+            if line_start > start:
+                segments.append(Segment(kind, start, content_start, line_start))
+            # Dopo le righe quotate riprende il testo della risposta (risposte inline)
+            kind = 'quoted' if is_quote else 'new'
+            start = content_start = line_start
+        i += 1
+    if len(body) > start:
+        segments.append(Segment(kind, start, content_start, len(body)))
+    return segments
+
+
+def normalize_segment(text):
+    """Contenuto confrontabile tra copie: senza prefissi '>' e con gli spazi (e gli a capo) uniformati."""
+    text = re.sub(r'^[ \t>]+', '', text, flags=re.MULTILINE)
+    return ' '.join(text.split())
+
+
+def segment_key(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class ThreadIndex:
+    """Indice per hash dei segmenti già inviati all'estrattore, con le entità trovate in ciascuno.
+
+    reduce() toglie dal body i segmenti già visti; resolve() riceve le righe di risultato in
+    ordine di email_index, registra le entità dei segmenti nuovi e aggiunge quelle dei segmenti tolti.
+    """
+
+    def __init__(self, count_tokens=estimate_tokens, min_chars=MIN_SEGMENT_CHARS):
+        self.count_tokens = count_tokens
+        self.min_chars = min_chars
+        self.segments = {}      # {hash: entità del contenuto, None finché l'email proprietaria non ha risultati}
+        self.owned = {}         # {email_index: [(hash, contenuto)]} segmenti visti per la prima volta
+        self.reused = {}        # {email_index: [hash]} segmenti tolti dal body
+        self.emails = 0
+        self.segments_total = 0
+        self.segments_reused = 0
+        self.tokens_total = 0
+        self.tokens_saved = 0
+
+    def _index(self, email_index, body, segments):
+        """Registra i segmenti dell'email: (parti del body tenute, contenuti tolti)."""
+        kept = []
+        removed = []
+        for seg in segments:
+            content = body[seg.content_start:seg.end]
+            normalized = normalize_segment(content)
+            if len(normalized) < self.min_chars:
+                kept.append(body[seg.start:seg.end])
+                continue
+            key = segment_key(normalized)
+            if key in self.segments:
+                self.reused.setdefault(email_index, []).append(key)
+                kept.append(body[seg.start:seg.content_start])
+                removed.append(content)
+            else:
+                self.segments[key] = None
+                self.owned.setdefault(email_index, []).append((key, content))
+                kept.append(body[seg.start:seg.end])
+        return kept, removed
+
+    def reduce(self, email_index, body):
+        """Body senza il contenuto dei segmenti già visti (resta l'intestazione di ciascuno)."""
+        self.emails += 1
+        segments = split_thread(body)
+        if not segments:
+            return body
+        kept, removed = self._index(email_index, body, segments)
+        self.segments_total += len(segments)
+        self.segments_reused += len(removed)
+        counts = self.count_tokens([body] + removed)
+        self.tokens_total += counts[0]
+        self.tokens_saved += sum(counts[1:])
+        return ''.join(kept)
+
+    def restore(self, records, rows):
+        """Ricostruisce l'indice al resume, che altrimenti ripartirebbe vuoto.
+
+        records sono (email_index, body) delle email già scritte, in ordine; rows le loro righe
+        di risultato (ResultsWriter.iter_committed). Le statistiche di report() non cambiano.
+        """
+        groups = iter_groups(rows)
+        group = next(groups, None)
+        for email_index, body in records:
+            self._index(email_index, body, split_thread(body))
+            while group is not None and group[0] <= email_index:
+                self._complete(*group)
+                group = next(groups, None)
+        # Email senza righe: i loro segmenti restano visti, senza entità
+        self.owned.clear()
+        self.reused.clear()
+
+    def formatter(self, base_formatter, column=TEXT_COLUMN):
+        """Formatter per iter_record_blocks: base_formatter applicato al blocco con i body ridotti."""
+        def format_reduced(chunk):
+            chunk = chunk.copy()
+            chunk[column] = [self.reduce(idx, body)
+                             for idx, body in zip(chunk['email_index'].tolist(), chunk[column].tolist())]
+            return base_formatter(chunk)
+        return format_reduced
+
+    def _entities_in(self, rows, text):
+        found = {field: [] for field in ENTITY_KEYS}
+        for row in rows:
+            for field in ENTITY_KEYS:
+                for value in row.get(field) or []:
+                    value = str(value).strip()
+                    if value and value not in found[field] and entity_pattern(value).search(text):
+                        found[field].append(value)
+        return found
+
+    def _complete(self, email_index, rows):
+        for key, content in self.owned.pop(email_index, []):
+            self.segments[key] = self._entities_in(rows, content)
+        reused = self.reused.pop(email_index, [])
+        if not reused or not rows:
+            return
+        last = rows[-1]
+        for field, key_fn in ENTITY_KEYS.items():
+            values = list(last.get(field) or [])
+            keys = {key_fn(str(v).strip()) for v in values}
+            for digest in reused:
+                for value in (self.segments.get(digest) or {}).get(field, []):
+                    if key_fn(value) not in keys:
+                        keys.add(key_fn(value))
+                        values.append(value)
+            last[field] = values
+        last['reused_segments'] = len(reused)
+
+    def resolve(self, rows):
+        """Righe di risultato in ordine di email_index (una o più per email), con le entità dei segmenti tolti."""
+        for email_index, group in iter_groups(rows):
+            self._complete(email_index, group)
+            yield from group
+
+    def report(self):
+        saved_pct = 100 * self.tokens_saved / max(self.tokens_total, 1)
+        return (f"Thread: {self.segments_reused} segmenti già analizzati su {self.segments_total} "
+                f"in {self.emails} email; token risparmiati {self.tokens_saved} su {self.tokens_total} "
+                f"({saved_pct:.1f}%)")
+
+
+def main():
+    print(f"Indicizzazione dei segmenti di '{TEXT_COLUMN}' in {INPUT_FILE}...")
+    start_time = time.time()
+    index = ThreadIndex()
+    try:
+        for chunk in iter_corpus_chunks(INPUT_FILE, columns=[TEXT_COLUMN], chunksize=CHUNKSIZE):
+            for idx, body in zip(chunk['email_index'].tolist(), chunk[TEXT_COLUMN].tolist()):
+                index.reduce(idx, body)
+            # Solo statistiche: nessuna riga di risultato da completare
+            index.owned.clear()
+            index.reused.clear()
+    except FileNotFoundError:
+        print(f"Errore: Il file {INPUT_FILE} non esiste.")
+        return
+    print(f"Completato in {time.time() - start_time:.2f}s (stima con {estimate_tokens.__name__}).")
+    print(index.report())
+
+
+if __name__ == "__main__":
+    main()